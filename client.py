@@ -1,25 +1,322 @@
+"""
+Load test for the SSE fan-out.
+
+Starts the app locally (or uses --url), opens many concurrent /stream
+clients, drives rounds and news through the admin router and writes
+connect latency, time to first LOAD, per-round fan-out latency and
+server memory/CPU as JSON.
+
+    uv run client.py --admin-prefix /__admin__/<secret> --clients 2000
+
+The admin prefix is the "Secret admin_url" the server prints on startup,
+or set ADMIN_PREFIX instead of passing it. Thousands of clients need a
+raised open files limit (`ulimit -n 65536`).
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
 import httpx
+import orjson
 import uvloop
-import asyncio
+
+SRC_DIR = Path(__file__).parent / "src"
+
+
+def percentiles(values: list[float]) -> dict[str, float | None]:
+    """p50/p99/max in milliseconds"""
+    if not values:
+        return {"p50": None, "p99": None, "max": None, "count": 0}
+    ordered = sorted(values)
+    return {
+        "p50": round(statistics.median(ordered) * 1000, 3),
+        "p99": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1e3, 3),
+        "max": round(ordered[-1] * 1000, 3),
+        "count": len(ordered),
+    }
+
+
+class ServerProcess:
+    """Local uvicorn running src/main.py, with /proc based resource probes"""
+
+    def __init__(self, port: int, workers: int):
+        self.port = port
+        self.workers = workers
+        self.process: subprocess.Popen | None = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        env = dict(os.environ)
+        if self.workers > 1:
+            env["BROKER_BACKEND"] = "unix"
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "main:app",
+                "--app-dir",
+                str(SRC_DIR),
+                "--port",
+                str(self.port),
+                "--workers",
+                str(self.workers),
+                "--loop",
+                "uvloop",
+                "--log-level",
+                "warning",
+            ],
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+        async with httpx.AsyncClient() as client:
+            for _ in range(100):
+                try:
+                    await client.get(f"{self.url}/api/currencies")
+                    return
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+        raise RuntimeError("Server did not start")
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            self.process.wait()
+
+    def _pids(self) -> list[int]:
+        """Server pid and, with several workers, its worker processes"""
+        pids = [self.process.pid]
+        pid = self.process.pid
+        children = Path(f"/proc/{pid}/task/{pid}/children")
+        if children.exists():
+            pids += [int(pid) for pid in children.read_text().split()]
+        return pids
+
+    def rss_bytes(self) -> int:
+        total = 0
+        for pid in self._pids():
+            for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1]) * 1024
+        return total
+
+    def cpu_seconds(self) -> float:
+        ticks = os.sysconf("SC_CLK_TCK")
+        total = 0
+        for pid in self._pids():
+            # utime and stime, fields 14 and 15, after the "(comm)" field
+            stat = Path(f"/proc/{pid}/stat").read_text()
+            fields = stat.rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+        return total / ticks
 
 
-async def client():
-    async with httpx.AsyncClient() as client:
-        async with client.stream(
-            "GET",
-            "https://stock-market-simulation.onrender.com/stream",
-            timeout=None
-        ) as stream:
-            async for msg in stream.aiter_lines():
-                print(msg)
+class StreamClient:
+    def __init__(self):
+        self.connect_latency: float | None = None
+        self.first_load_latency: float | None = None
+        self.first_load = asyncio.Event()
+        # round number -> perf_counter when its chart update arrived
+        self.chart_received: dict[str, float] = {}
+        # news round number -> perf_counter when it arrived
+        self.news_received: dict[str, float] = {}
 
+    async def run(
+        self, client: httpx.AsyncClient, url: str, connect: asyncio.Semaphore
+    ):
+        async with connect:
+            started = time.perf_counter()
+            response = await client.send(
+                client.build_request("GET", f"{url}/stream"), stream=True
+            )
+            self.connect_latency = time.perf_counter() - started
 
-async def main(clients: int = 1):
-    await asyncio.gather(
-        *[
-            client()
-            for _ in range(clients)
+        try:
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                received = time.perf_counter()
+                message = orjson.loads(line[6:])
+                is_load = message["event_type"] == "load"
+                if is_load and not self.first_load.is_set():
+                    self.first_load_latency = received - started
+                    self.first_load.set()
+                elif message["event_type"] == "update":
+                    target = (
+                        self.chart_received
+                        if message["data_type"] == "chart"
+                        else self.news_received
+                    )
+                    for step in message["data"]:
+                        target[step] = received
+        finally:
+            await response.aclose()
+
+    async def loaded(self, task: asyncio.Task, timeout: float) -> bool:
+        """Wait for the first LOAD, False if the stream failed or timed out"""
+        first_load = asyncio.ensure_future(self.first_load.wait())
+        await asyncio.wait(
+            (first_load, task), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+        first_load.cancel()
+        return self.first_load.is_set()
+
+
+async def wait_delivered(
+    clients: list[StreamClient], attr: str, step: str, timeout: float
+):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if all(step in getattr(c, attr) for c in clients):
+            return
+        await asyncio.sleep(0.005)
+
+
+async def drive(
+    admin: httpx.AsyncClient,
+    clients: list[StreamClient],
+    rounds: int,
+    timeout: float,
+) -> tuple[list[dict], list[dict]]:
+    round_results, news_results = [], []
+    for _ in range(rounds):
+        sent = time.perf_counter()
+        response = (await admin.post("/next_round")).json()
+        if response["status"] != "success":
+            break
+        info = (await admin.get("/service_info")).json()
+        step = str(info["current_round_number"])
+        await wait_delivered(clients, "chart_received", step, timeout)
+        latencies = [
+            c.chart_received[step] - sent for c in clients if step in c.chart_received
         ]
+        round_results.append({"round": int(step), "fanout_ms": percentiles(latencies)})
+
+        sent = time.perf_counter()
+        response = (await admin.post("/publish_news")).json()
+        if response["status"] != "success":
+            continue
+        news_step = str(int(step) - 1)
+        await wait_delivered(clients, "news_received", news_step, timeout)
+        latencies = [
+            c.news_received[news_step] - sent
+            for c in clients
+            if news_step in c.news_received
+        ]
+        news_results.append(
+            {"round": int(news_step), "fanout_ms": percentiles(latencies)}
+        )
+    return round_results, news_results
+
+
+async def main(args: argparse.Namespace):
+    server = None
+    url = args.url
+    if url is None:
+        server = ServerProcess(args.port, args.workers)
+        await server.start()
+        url = server.url
+
+    try:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        timeout = httpx.Timeout(None)
+        async with (
+            httpx.AsyncClient(limits=limits, timeout=timeout) as streams,
+            httpx.AsyncClient(
+                base_url=url + args.admin_prefix, timeout=timeout
+            ) as admin,
+        ):
+            await admin.post("/reset")
+            rss_before = server.rss_bytes() if server else None
+            cpu_before = server.cpu_seconds() if server else None
+            started = time.perf_counter()
+
+            connect = asyncio.Semaphore(args.connect_concurrency)
+            clients = [StreamClient() for _ in range(args.clients)]
+            tasks = [asyncio.create_task(c.run(streams, url, connect)) for c in clients]
+            # A client without a LOAD in time counts as failed, the run goes on
+            loaded = await asyncio.gather(
+                *(c.loaded(task, args.timeout) for c, task in zip(clients, tasks))
+            )
+            connected = [c for c, ok in zip(clients, loaded) if ok]
+            rss_connected = server.rss_bytes() if server else None
+
+            round_results, news_results = await drive(
+                admin, connected, args.rounds, args.timeout
+            )
+            duration = time.perf_counter() - started
+            cpu_after = server.cpu_seconds() if server else None
+
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        if server:
+            server.stop()
+
+    results = {
+        "config": {
+            "clients": args.clients,
+            "rounds": args.rounds,
+            "workers": args.workers,
+            "url": url,
+        },
+        "connect_ms": percentiles(
+            [c.connect_latency for c in clients if c.connect_latency]
+        ),
+        "failed_clients": len(clients) - len(connected),
+        "first_load_ms": percentiles(
+            [c.first_load_latency for c in clients if c.first_load_latency]
+        ),
+        "rounds": round_results,
+        "news": news_results,
+        "duration_s": round(duration, 3),
+    }
+    if server:
+        results["server"] = {
+            "rss_bytes_idle": rss_before,
+            "rss_bytes_connected": rss_connected,
+            "rss_bytes_per_subscriber": (rss_connected - rss_before) // args.clients,
+            "cpu_seconds": round(cpu_after - cpu_before, 3),
+            "cpu_percent": round((cpu_after - cpu_before) / duration * 100, 1),
+        }
+
+    output = orjson.dumps(results, option=orjson.OPT_INDENT_2)
+    if args.output:
+        Path(args.output).write_bytes(output)
+    print(output.decode())
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--url", help="Benchmark a running server instead")
+    parser.add_argument(
+        "--admin-prefix",
+        default=os.environ.get("ADMIN_PREFIX"),
+        help="Admin router prefix, /__admin__/<secret>",
     )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="Write JSON results to this file")
+    args = parser.parse_args()
+    if not args.admin_prefix:
+        parser.error("--admin-prefix or ADMIN_PREFIX is required")
+    args.admin_prefix = args.admin_prefix.rstrip("/")
+    return args
+
 
-uvloop.run(main(100))
\ No newline at end of file
+if __name__ == "__main__":
+    uvloop.run(main(parse_args()))
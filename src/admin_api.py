@@ -1,47 +1,103 @@
-from fastapi import APIRouter
+import secrets
+import time
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
-from stock import StockMarketController
+from config import REQUIRED_CURRENCIES, SCHEDULE_NEWS_DELAY, SCHEDULE_ROUND_INTERVAL
+from metrics import REGISTRY
+from rooms import Room, Rooms
+from stock import StockMarket
 
 secret_uid = "18277e534bd1424da77490360b5b9614"
 
 print(f"Secret admin_url is /__admin__/{secret_uid}", flush=True)
 
-router = APIRouter(prefix=f"/__admin__/{secret_uid}")
+ADMIN_PREFIX = f"/__admin__/{secret_uid}"
+
+router = APIRouter(prefix=ADMIN_PREFIX)
+
+# Game routes, included under ADMIN_PREFIX for the default room and
+# under ADMIN_PREFIX/rooms/{room} for every other room
+game_router = APIRouter()
 
 
-@router.get("/service_info")
-async def get_service_info():
-    from config import REQUIRED_CURRENCIES
+def get_room(room: str = Rooms.DEFAULT) -> Room:
+    found = Rooms.get(room)
+    if found is None:
+        raise HTTPException(status_code=404, detail=f"Unknown room: {room}")
+    return found
 
+
+@router.get("/rooms")
+async def list_rooms():
     return {
-        "current_prices": StockMarketController.get_current_step_chart(),
-        "current_news": StockMarketController.get_current_step_news(),
-        "current_round_number": StockMarketController.stock().current_step_chart,
-        "next_prices": StockMarketController.get_next_step_chart(),
-        "next_news": StockMarketController.get_next_step_news(),
-        "available_currencies": REQUIRED_CURRENCIES,
+        "rooms": [
+            {
+                "name": room.name,
+                "current_round_number": room.stock.current_step_chart,
+                "subscribers": len(room.publisher.subscribers),
+            }
+            for room in Rooms.all()
+        ]
     }
 
 
-@router.post("/next_round")
-async def next_round():
+@router.post("/rooms/{room}")
+async def create_room(room: str):
+    try:
+        await Rooms.create(room)
+        return {"status": "success", "message": f"Room {room} created"}
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+
+
+@router.delete("/rooms/{room}")
+async def close_room(room: str):
+    try:
+        await Rooms.close(room)
+        return {"status": "success", "message": f"Room {room} closed"}
+    except (KeyError, ValueError) as e:
+        return {"status": "error", "message": str(e)}
+
+
+@game_router.get("/service_info")
+async def get_service_info(room: Room = Depends(get_room)):
+    return room.dashboard.state()
+
+
+@game_router.get("/events")
+async def dashboard_events(room: Room = Depends(get_room)):
+    """Dashboard state on connect, then changes as they happen"""
+    return StreamingResponse(room.dashboard.stream(), media_type="text/event-stream")
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """Publisher and game loop metrics in Prometheus text format"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@game_router.post("/next_round")
+async def next_round(room: Room = Depends(get_room)):
     """Start next round + publish chart data for round"""
     try:
-        success = await StockMarketController.next_chart_step()
+        success = await room.controller.next_chart_step()
         if not success:
             return {"status": "warning", "message": "Already at last round"}
 
-        await StockMarketController.publish_current_chart_data()
+        await room.controller.publish_current_chart_data()
         return {"status": "success", "message": "Advanced to next round"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 
-@router.post("/publish_news")
-async def publish_news():
+@game_router.post("/publish_news")
+async def publish_news(room: Room = Depends(get_room)):
     try:
-        success = await StockMarketController.publish_current_news()
+        success = await room.controller.publish_current_news()
         if success:
             return {"status": "success", "message": "News published successfully"}
         else:
@@ -59,55 +115,52 @@ class RoundUpdateData(BaseModel):
     news: list[str] | None = None
 
 
-@router.post("/edit_round")
-async def edit_round(data: RoundUpdateData):
+def validate_round_update(
+    stock: StockMarket,
+    round_number: int,
+    chart_data: dict[str, int] | None,
+    news: list[str] | None,
+) -> str | None:
+    """Error message for an invalid round edit, None if it is valid"""
+    if round_number < 0:
+        return "Round number must be non-negative"
+    if round_number >= len(stock.data):
+        return f"Round {round_number} exceeds available data"
+
+    if chart_data:
+        # Validate chart data structure
+        if not all(currency in chart_data for currency in REQUIRED_CURRENCIES):
+            return f"Chart data must contain all currencies: {REQUIRED_CURRENCIES}"
+        if not all(
+            isinstance(price, (int, float)) and price >= 0
+            for price in chart_data.values()
+        ):
+            return "All prices must be non-negative numbers"
+
+    if news:
+        if not isinstance(news, list) or not all(
+            isinstance(item, str) for item in news
+        ):
+            return "News must be a list of strings"
+        if round_number >= len(stock.news):
+            return f"Round {round_number} has no news"
+    return None
+
+
+@game_router.post("/edit_round")
+async def edit_round(data: RoundUpdateData, room: Room = Depends(get_room)):
     try:
-        if data.round_number < 0:
-            return {"status": "error", "message": "Round number must be non-negative"}
-
-        stock = StockMarketController.stock()
-        if data.round_number >= len(stock.data):
-            return {
-                "status": "error",
-                "message": f"Round {data.round_number} exceeds available data",
-            }
-
-        if data.chart_data:
-            # Validate chart data structure
-            from config import REQUIRED_CURRENCIES
-
-            required_currencies = REQUIRED_CURRENCIES
-            if not all(currency in data.chart_data for currency in required_currencies):
-                return {
-                    "status": "error",
-                    "message": f"Chart data must contain all currencies: {required_currencies}",
-                }
-
-            if not all(
-                isinstance(price, (int, float)) and price >= 0
-                for price in data.chart_data.values()
-            ):
-                return {
-                    "status": "error",
-                    "message": "All prices must be non-negative numbers",
-                }
-
-            success = stock.update_step_data(data.round_number, data.chart_data)
-            if not success:
-                return {"status": "error", "message": "Failed to update chart data"}
-
-        if data.news:
-            if not isinstance(data.news, list) or not all(
-                isinstance(item, str) for item in data.news
-            ):
-                return {"status": "error", "message": "News must be a list of strings"}
-
-            success = stock.update_step_news(data.round_number, data.news)
-            if not success:
-                return {"status": "error", "message": "Failed to update news data"}
-
-        await StockMarketController.publish_until_current_step_data_all()
-        await StockMarketController.publish_until_current_step_news_all()
+        error = validate_round_update(
+            room.stock, data.round_number, data.chart_data, data.news
+        )
+        if error is not None:
+            return {"status": "error", "message": error}
+
+        success = await room.controller.update_round(
+            data.round_number, data.chart_data, data.news
+        )
+        if not success:
+            return {"status": "error", "message": "Failed to update round data"}
 
         return {
             "status": "success",
@@ -117,42 +170,244 @@ async def edit_round(data: RoundUpdateData):
         return {"status": "error", "message": str(e)}
 
 
-@router.post("/go_to_step/{step}")
-async def go_to_step(step: int):
+@game_router.post("/go_to_step/{step}")
+async def go_to_step(step: int, room: Room = Depends(get_room)):
     try:
         if step < 0:
             return {"status": "error", "message": "Step must be non-negative"}
 
-        stock = StockMarketController.stock()
+        stock = room.stock
         if step >= len(stock.data):
             return {
                 "status": "error",
                 "message": f"Step {step} exceeds available data (max: {len(stock.data)-1})",
             }
 
-        stock.set_chart_step(step)
-        stock.set_news_step(step - 1)
-        await StockMarketController.publish_until_current_step_data_all()
-        await StockMarketController.publish_until_current_step_news_all()
+        await room.controller.go_to_step(step)
 
         return {"status": "success", "current_step": step}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 
-@router.post("/finish_game")
-async def stop_game():
+@game_router.post("/finish_game")
+async def stop_game(room: Room = Depends(get_room)):
     try:
-        await StockMarketController.publish_stop_game()
+        await room.controller.publish_stop_game()
         return {"status": "success", "message": "Game finished successfully"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 
-@router.post("/reset")
-async def reset():
+@game_router.post("/reset")
+async def reset(room: Room = Depends(get_room)):
     try:
-        await StockMarketController.reset()
+        await room.controller.reset()
         return {"status": "success", "message": "Game reset successfully"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
+
+
+class GeneratedScenario(BaseModel):
+    rounds: int = 100
+    # Random if not given, the one used is returned
+    seed: int | None = None
+    volatility: float = 0.1
+    correlation: float = 0.0
+    # Std of the log-return jump of tickers named in a round's news
+    news_jump: float = 0.0
+
+
+@game_router.post("/generate_scenario")
+async def generate_scenario(
+    settings: GeneratedScenario, room: Room = Depends(get_room)
+):
+    """Restart the game on generated prices over the same tickers and news"""
+    if not 2 <= settings.rounds <= 100_000:
+        return {"status": "error", "message": "Rounds must be between 2 and 100000"}
+    if settings.volatility < 0 or settings.news_jump < 0:
+        return {
+            "status": "error",
+            "message": "Volatility and news jump must be non-negative",
+        }
+    if not 0 <= settings.correlation < 1:
+        return {"status": "error", "message": "Correlation must be in [0, 1)"}
+    if settings.seed is not None and settings.seed < 0:
+        return {"status": "error", "message": "Seed must be non-negative"}
+
+    # Chosen here, so the journaled command replays the same prices
+    seed = secrets.randbelow(2**32) if settings.seed is None else settings.seed
+    try:
+        await room.controller.load_generated_scenario(
+            settings.rounds,
+            seed,
+            settings.volatility,
+            settings.correlation,
+            settings.news_jump,
+        )
+        return {
+            "status": "success",
+            "message": f"Generated {settings.rounds} rounds",
+            "seed": seed,
+        }
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+
+class BatchOperation(BaseModel):
+    op: Literal["edit_round", "go_to_step", "next_round", "publish_news", "reset"]
+    # edit_round
+    round_number: int | None = None
+    chart_data: dict[str, int] | None = None
+    news: list[str] | None = None
+    # go_to_step
+    step: int | None = None
+
+
+def validate_batch(stock: StockMarket, operations: list[BatchOperation]) -> list[dict]:
+    """
+    Check every operation against the game state the operations before it
+    leave, without applying anything. Returns the errors by index.
+    """
+    errors = []
+    rounds, news_rounds = len(stock.data), len(stock.news)
+    chart_step, news_step = stock.current_step_chart, stock.current_step_news
+
+    def error(index: int, message: str):
+        errors.append({"index": index, "op": operation.op, "message": message})
+
+    for index, operation in enumerate(operations):
+        if operation.op == "edit_round":
+            if operation.round_number is None:
+                error(index, "round_number is required")
+            elif not operation.chart_data and not operation.news:
+                error(index, "chart_data or news is required")
+            elif message := validate_round_update(
+                stock, operation.round_number, operation.chart_data, operation.news
+            ):
+                error(index, message)
+        elif operation.op == "go_to_step":
+            if operation.step is None or not 0 <= operation.step < rounds:
+                error(index, f"Step must be between 0 and {rounds - 1}")
+                continue
+            chart_step = operation.step
+            if 0 <= chart_step - 1 < news_rounds:
+                news_step = chart_step - 1
+            else:
+                news_step = min(news_step, chart_step - 1)
+        elif operation.op == "next_round":
+            if chart_step >= rounds - 1:
+                error(index, "Already at last round")
+                continue
+            chart_step += 1
+        elif operation.op == "publish_news":
+            if news_step + 1 > chart_step or news_step + 1 >= news_rounds:
+                error(index, "No news to publish for the current round")
+                continue
+            news_step += 1
+        elif operation.op == "reset":
+            chart_step, news_step = 0, -1
+    return errors
+
+
+@game_router.post("/batch")
+async def apply_batch(operations: list[BatchOperation], room: Room = Depends(get_room)):
+    """
+    Apply several operations as one transaction: all of them are validated
+    first, and clients get one set of updates at the end instead of one
+    per operation
+    """
+    started = time.perf_counter()
+    errors = validate_batch(room.stock, operations)
+    validated = time.perf_counter()
+    timings = {"validation_ms": round((validated - started) * 1000, 3)}
+    if errors:
+        return {
+            "status": "error",
+            "message": "Nothing applied, the batch has invalid operations",
+            "errors": errors,
+            "timings": timings,
+        }
+
+    try:
+        timings |= await room.controller.apply_batch(
+            [operation.model_dump(exclude_none=True) for operation in operations]
+        )
+    except Exception as e:
+        return {"status": "error", "message": str(e), "timings": timings}
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return {
+        "status": "success",
+        "message": f"Applied {len(operations)} operations",
+        "current_step": room.stock.current_step_chart,
+        "timings": timings,
+    }
+
+
+class ScheduleSettings(BaseModel):
+    round_interval: float = SCHEDULE_ROUND_INTERVAL
+    # Seconds after each chart step, None to publish news by hand
+    news_delay: float | None = SCHEDULE_NEWS_DELAY
+    # Finish the game after the last round
+    finish_game: bool = False
+    start_delay: float = 0.0
+
+
+@game_router.get("/schedule")
+async def get_schedule(room: Room = Depends(get_room)):
+    """Automatic rounds state and jitter of scheduled publishes"""
+    return room.controller.scheduler.report()
+
+
+@game_router.post("/schedule/start")
+async def start_schedule(settings: ScheduleSettings, room: Room = Depends(get_room)):
+    """Start automatic rounds, or change settings of running ones"""
+    if settings.round_interval <= 0:
+        return {"status": "error", "message": "Round interval must be positive"}
+    if settings.news_delay is not None and not (
+        0 <= settings.news_delay < settings.round_interval
+    ):
+        return {
+            "status": "error",
+            "message": "News delay must be between 0 and the round interval",
+        }
+    if settings.start_delay < 0:
+        return {"status": "error", "message": "Start delay must be non-negative"}
+
+    try:
+        await room.controller.schedule_start(
+            settings.round_interval,
+            settings.news_delay,
+            settings.finish_game,
+            settings.start_delay,
+        )
+        return {"status": "success", "schedule": room.controller.scheduler.report()}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+
+@game_router.post("/schedule/pause")
+async def pause_schedule(room: Room = Depends(get_room)):
+    try:
+        await room.controller.schedule_pause()
+        return {"status": "success", "schedule": room.controller.scheduler.report()}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+
+@game_router.post("/schedule/resume")
+async def resume_schedule(room: Room = Depends(get_room)):
+    try:
+        await room.controller.schedule_resume()
+        return {"status": "success", "schedule": room.controller.scheduler.report()}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+
+@game_router.post("/schedule/stop")
+async def stop_schedule(room: Room = Depends(get_room)):
+    try:
+        await room.controller.schedule_stop()
+        return {"status": "success", "schedule": room.controller.scheduler.report()}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
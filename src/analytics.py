@@ -0,0 +1,137 @@
+"""
+Per-currency analytics of the chart rounds played so far.
+
+Kept up to date in O(1) per round: a chart step adds its round to running
+sums and drops the round leaving each window. Edits of played rounds and
+rewinds rebuild from round 0 on the next read.
+"""
+
+import logging
+import math
+from typing import TYPE_CHECKING
+
+from config import ANALYTICS_MA_WINDOWS, ANALYTICS_VOLATILITY_WINDOW
+from events import AnalyticsEvent
+
+if TYPE_CHECKING:
+    from stock import StockMarket
+
+logger = logging.getLogger(__name__)
+
+
+def _return(price: int, previous: int) -> float:
+    return price / previous - 1 if previous else 0.0
+
+
+class _RunningStats:
+    """Running state of one currency up to the last added round"""
+
+    def __init__(self, column):
+        self.column = column
+        self.first = self.last = self.previous = 0
+        self.low = self.high = 0
+        self.ma_sums = {window: 0 for window in ANALYTICS_MA_WINDOWS}
+        # Sums of round-over-round returns in the volatility window
+        self.returns_sum = 0.0
+        self.returns_sum_squares = 0.0
+
+    def add(self, step: int):
+        column = self.column
+        price = column[step]
+        if step == 0:
+            self.first = self.low = self.high = price
+        else:
+            self.low = min(self.low, price)
+            self.high = max(self.high, price)
+            change = _return(price, column[step - 1])
+            self.returns_sum += change
+            self.returns_sum_squares += change * change
+            # Return of round step - window, leaving the window
+            leaving = step - ANALYTICS_VOLATILITY_WINDOW
+            if leaving >= 1:
+                change = _return(column[leaving], column[leaving - 1])
+                self.returns_sum -= change
+                self.returns_sum_squares -= change * change
+        for window in self.ma_sums:
+            self.ma_sums[window] += price
+            if step >= window:
+                self.ma_sums[window] -= column[step - window]
+        self.previous = self.last if step else price
+        self.last = price
+
+    def report(self, step: int) -> dict:
+        rounds = step + 1
+        returns = min(step, ANALYTICS_VOLATILITY_WINDOW)
+        volatility = None
+        if returns >= 2:
+            mean = self.returns_sum / returns
+            variance = (self.returns_sum_squares - returns * mean * mean) / (
+                returns - 1
+            )
+            volatility = round(math.sqrt(max(variance, 0.0)) * 100, 4)
+        return {
+            "price": self.last,
+            "change_pct": round(_return(self.last, self.previous) * 100, 4),
+            "return_pct": round(_return(self.last, self.first) * 100, 4),
+            "moving_averages": {
+                str(window): round(total / min(window, rounds), 4)
+                for window, total in self.ma_sums.items()
+            },
+            "volatility_pct": volatility,
+            "min": self.low,
+            "max": self.high,
+        }
+
+
+class Analytics:
+    def __init__(self, stock: "StockMarket"):
+        self.stock = stock
+        # Last round added to the running stats, -1 before the first
+        self.step = -1
+        # Prices the running stats read, replaced by the first edit
+        self._data = None
+        self._stats: dict[str, _RunningStats] = {}
+        self._event: AnalyticsEvent | None = None
+
+    def invalidate(self, from_step: int = 0):
+        """Rounds from from_step changed, rebuild if they were added"""
+        if from_step <= self.step:
+            self.step = -1
+
+    def update(self):
+        """Catch up with the current chart step"""
+        target = self.stock.current_step_chart
+        data = self.stock.data
+        if self.step > target or self.step < 0 or data is not self._data:
+            # Rewound, invalidated or prices copied: start over from round 0
+            self._data = data
+            self._stats = {
+                currency: _RunningStats(data.column(currency))
+                for currency in data.currencies
+            }
+            self.step = -1
+        if self.step == target:
+            return
+        while self.step < target:
+            self.step += 1
+            for stats in self._stats.values():
+                stats.add(self.step)
+        self._event = None
+
+    def report(self) -> dict:
+        """Stats of every currency, ranked by return since round 0"""
+        self.update()
+        currencies = {
+            currency: stats.report(self.step) for currency, stats in self._stats.items()
+        }
+        ranked = sorted(currencies, key=lambda c: -currencies[c]["return_pct"])
+        for rank, currency in enumerate(ranked, 1):
+            currencies[currency]["rank"] = rank
+        return {"round": self.step, "currencies": currencies}
+
+    def event(self) -> AnalyticsEvent:
+        """Built once per round, so its frame is encoded once too"""
+        self.update()
+        if self._event is None:
+            self._event = AnalyticsEvent(self.report())
+        return self._event
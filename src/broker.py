@@ -0,0 +1,265 @@
+import asyncio
+import fcntl
+import logging
+import os
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+from uuid import uuid4
+
+import orjson
+
+from config import BROKER_BACKEND, BROKER_RETRY_INTERVAL, BROKER_SOCKET_PATH
+
+logger = logging.getLogger(__name__)
+
+ApplyCallback = Callable[[str, list], Awaitable[Any]]
+
+
+class BrokerBackend:
+    LOCAL = "local"
+    UNIX = "unix"
+
+
+class Broker:
+    """
+    Delivers game commands to every worker in the same order.
+    Each worker applies them to its own game state replica and fans
+    resulting events out to its own subscribers.
+    """
+
+    def __init__(
+        self,
+        apply: ApplyCallback,
+        dump_state: Callable[[], dict],
+        load_state: Callable[[dict], Awaitable[None]],
+    ):
+        self.apply = apply
+        self.dump_state = dump_state
+        self.load_state = load_state
+        # Loads durable state, awaited once by the first worker to lead.
+        # Workers getting state from a leader never call it
+        self.recover: Callable[[], Awaitable[None]] | None = None
+
+    async def _recover(self):
+        if self.recover is not None:
+            recover, self.recover = self.recover, None
+            await recover()
+
+    @property
+    def is_leader(self) -> bool:
+        """Whether this worker runs timed commands, e.g. scheduled rounds"""
+        return True
+
+    async def start(self):
+        await self._recover()
+
+    async def stop(self):
+        pass
+
+    async def dispatch(self, op: str, *args) -> Any:
+        """Apply command in every worker, returns result of this worker's apply"""
+        raise NotImplementedError
+
+
+class LocalBroker(Broker):
+    """Single worker, commands are applied right away"""
+
+    async def dispatch(self, op: str, *args) -> Any:
+        return await self.apply(op, list(args))
+
+
+async def _read_message(reader: asyncio.StreamReader) -> dict:
+    header = await reader.readexactly(4)
+    return orjson.loads(await reader.readexactly(int.from_bytes(header, "big")))
+
+
+def _write_message(writer: asyncio.StreamWriter, message: dict):
+    body = orjson.dumps(message)
+    writer.write(len(body).to_bytes(4, "big") + body)
+
+
+class UnixSocketBroker(Broker):
+    """
+    Broker for `uvicorn --workers N` on one host.
+
+    The worker holding an exclusive lock on `<socket>.lock` is the hub: it
+    applies every command first and forwards it to all other workers over
+    a Unix socket, so the hub defines one total order. Workers joining
+    later receive the hub's state. If the hub dies its lock is released
+    and the first worker to grab it becomes the new hub.
+    """
+
+    def __init__(self, *args, path: str = BROKER_SOCKET_PATH, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path = Path(path)
+        self.token = uuid4().hex
+        self._lock_fd: int | None = None
+        self._server: asyncio.AbstractServer | None = None
+        self._peers: set[asyncio.StreamWriter] = set()
+        self._hub_writer: asyncio.StreamWriter | None = None
+        self._pending: dict[int, asyncio.Future] = {}
+        self._next_request = 0
+        # Serializes apply + forward at the hub
+        self._order_lock = asyncio.Lock()
+        self._client_task: asyncio.Task | None = None
+
+    @property
+    def is_hub(self) -> bool:
+        return self._server is not None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.is_hub
+
+    def _try_lock(self) -> bool:
+        lock_path = self.path.with_suffix(".lock")
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def start(self):
+        if self._try_lock():
+            await self._start_hub()
+        else:
+            self._client_task = asyncio.create_task(self._run_client())
+
+    async def stop(self):
+        if self._client_task:
+            self._client_task.cancel()
+        if self._hub_writer:
+            self._hub_writer.close()
+        if self._server:
+            self._server.close()
+            for writer in list(self._peers):
+                writer.close()
+            self.path.unlink(missing_ok=True)
+            self._server = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    async def _start_hub(self):
+        # Before listening, so peers are synced to the recovered state
+        await self._recover()
+        # Lock holder owns the path, any socket file left there is stale
+        self.path.unlink(missing_ok=True)
+        self._server = await asyncio.start_unix_server(
+            self._serve_peer, path=str(self.path)
+        )
+        logger.info(f"Broker hub listening on {self.path}")
+
+    async def _serve_peer(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        async with self._order_lock:
+            _write_message(writer, {"sync": self.dump_state()})
+            self._peers.add(writer)
+        try:
+            while True:
+                message = await _read_message(reader)
+                try:
+                    await self._apply_as_hub(message)
+                except Exception as e:
+                    # Origin worker gets the same error applying it itself
+                    logger.error(f"Error applying command {message['op']}: {e}")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    async def _apply_as_hub(self, message: dict) -> Any:
+        async with self._order_lock:
+            try:
+                return await self.apply(message["op"], message["args"])
+            finally:
+                # Forwarded even if apply failed, replicas must stay in step
+                for writer in list(self._peers):
+                    _write_message(writer, message)
+
+    async def _run_client(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(str(self.path))
+            except OSError:
+                # Hub isn't listening yet or has just died
+                await asyncio.sleep(BROKER_RETRY_INTERVAL)
+                if self._try_lock():
+                    await self._start_hub()
+                    return
+                continue
+
+            self._hub_writer = writer
+            try:
+                while True:
+                    await self._apply_as_client(await _read_message(reader))
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.warning("Lost connection to broker hub")
+            finally:
+                self._hub_writer = None
+                writer.close()
+                for future in self._pending.values():
+                    future.set_exception(ConnectionError("Broker hub went away"))
+                self._pending.clear()
+
+            if self._try_lock():
+                await self._start_hub()
+                return
+
+    async def _apply_as_client(self, message: dict):
+        if "sync" in message:
+            # The hub's state is newer than anything on disk
+            self.recover = None
+            await self.load_state(message["sync"])
+            return
+
+        future = None
+        if message["origin"] == self.token:
+            future = self._pending.pop(message["req"], None)
+        try:
+            result = await self.apply(message["op"], message["args"])
+        except Exception as e:
+            if future is None:
+                logger.error(f"Error applying command {message['op']}: {e}")
+            else:
+                future.set_exception(e)
+            return
+        if future is not None:
+            future.set_result(result)
+
+    async def dispatch(self, op: str, *args) -> Any:
+        self._next_request += 1
+        message = {
+            "op": op,
+            "args": list(args),
+            "origin": self.token,
+            "req": self._next_request,
+        }
+        if self.is_hub:
+            return await self._apply_as_hub(message)
+
+        if self._hub_writer is None:
+            raise ConnectionError("Not connected to broker hub")
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message["req"]] = future
+        _write_message(self._hub_writer, message)
+        # Resolved once the hub sends the command back in its order
+        return await future
+
+
+def create_broker(
+    apply: ApplyCallback,
+    dump_state: Callable[[], dict],
+    load_state: Callable[[dict], Awaitable[None]],
+    backend: str = BROKER_BACKEND,
+) -> Broker:
+    if backend == BrokerBackend.LOCAL:
+        return LocalBroker(apply, dump_state, load_state)
+    if backend == BrokerBackend.UNIX:
+        return UnixSocketBroker(apply, dump_state, load_state)
+    raise ValueError(f"Unknown broker backend: {backend}")
@@ -1,47 +1,103 @@
 # config.py
 import logging
+import os
 from pathlib import Path
 
-import orjson
-
 logger = logging.getLogger(__name__)
 
 BASE_DIR = Path(__file__).parent
 FRONTEND_DIR = BASE_DIR / "frontend"
 CHART_DATA_FILE = BASE_DIR / "chart_data.json"
+# chart_data.json or a binary scenario made from it, see scenario.py
+SCENARIO_FILE = Path(os.environ.get("SCENARIO_FILE", CHART_DATA_FILE))
+
+# Frontend pages are served from memory, compressed once. Players' browsers
+# may reuse the page for STATIC_MAX_AGE seconds before revalidating it with
+# its ETag. STATIC_DEV_RELOAD=1 rebuilds pages when their files change
+STATIC_MAX_AGE = 600
+STATIC_DEV_RELOAD = os.environ.get("STATIC_DEV_RELOAD") == "1"
 
 # Timeouts and limits
 SUBSCRIBER_TIMEOUT = 300  # 5 minutes
-EVENT_QUEUE_TIMEOUT = 2.0
 CLEANUP_INTERVAL = 60  # 1 minute
 
+# Fan-out: per-subscriber buffer size and what to do when it is full.
+# One of "drop_oldest", "coalesce" (replace queued chart and news events
+# with a fresh LOAD snapshot) or "disconnect"
+SUBSCRIBER_QUEUE_SIZE = 64
+SUBSCRIBER_OVERFLOW_POLICY = "drop_oldest"
+# Replace queued chart, news, leaderboard and analytics events the client
+# hasn't taken yet with newer ones, so slow clients catch up in a few events
+SUBSCRIBER_COALESCE = os.environ.get("SUBSCRIBER_COALESCE", "1") == "1"
+
+# SSE keep-alive and resume: heartbeat period in seconds and how many
+# broadcast events are kept for clients reconnecting with Last-Event-ID
+HEARTBEAT_INTERVAL = 15
+REPLAY_LOG_SIZE = 256
+
+# Games hosted by one process, the default room included
+MAX_ROOMS = 500
+
+# Automatic rounds: defaults for the admin schedule form and how many
+# publish delays are kept for the jitter report
+SCHEDULE_ROUND_INTERVAL = 60.0
+SCHEDULE_NEWS_DELAY = 30.0
+SCHEDULE_JITTER_SAMPLES = 256
+
+# Admin dashboard pushes changes at most this often, in seconds
+DASHBOARD_PUSH_INTERVAL = 0.25
+
+# Durable game state: command journal and snapshots, see journal.py.
+# Set JOURNAL_DIR to an empty string to keep games in memory only
+JOURNAL_DIR = os.environ.get("JOURNAL_DIR", str(BASE_DIR.parent / "journal"))
+JOURNAL_FLUSH_INTERVAL = 0.05
+JOURNAL_SNAPSHOT_EVERY = 1000
+
+# Trading: cash every player starts with, and how long orders are
+# collected before a batch is settled, in seconds
+STARTING_CASH = 100_000
+ORDER_BATCH_INTERVAL = 0.02
+
+# Leaderboard: players listed to everyone, and how often standings are
+# pushed to streams at most, in seconds
+LEADERBOARD_SIZE = 10
+LEADERBOARD_PUSH_INTERVAL = 1.0
+
+# Chart analytics: moving average windows and the window of returns
+# volatility is computed over, in rounds
+ANALYTICS_MA_WINDOWS = (5, 20)
+ANALYTICS_VOLATILITY_WINDOW = 20
+
+# Game command broker: "local" for a single worker, "unix" to share one game
+# between `uvicorn --workers N` processes on the same host
+BROKER_BACKEND = os.environ.get("BROKER_BACKEND", "local")
+BROKER_SOCKET_PATH = os.environ.get(
+    "BROKER_SOCKET_PATH", "/tmp/stock-market-simulation.sock"
+)
+BROKER_RETRY_INTERVAL = 0.5
+
 # Logging configuration
 LOG_LEVEL = "INFO"
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# With DEBUG logging, log one of every N frames sent to clients
+STREAM_LOG_SAMPLE_RATE = 1000
 
 
 def get_required_currencies():
-    """Dynamically load required currencies from chart_data.json round 0"""
-    try:
-        if not CHART_DATA_FILE.exists():
-            logger.warning(f"Chart data file not found: {CHART_DATA_FILE}")
-            return ["Apple", "Google", "РосАтом", "BitCoin"]  # fallback
+    """Currencies of the scenario, in the order of its price columns"""
+    from scenario import Scenario
 
-        with open(CHART_DATA_FILE, "r", encoding="utf-8") as f:
-            data = orjson.loads(f.read())
-
-        # Get currencies from round 0
-        round_0_data = data.get("0", {}).get("chart", {})
-        if not round_0_data:
-            logger.warning("No chart data found for round 0")
-            return ["Apple", "Google", "РосАтом", "BitCoin"]  # fallback
-
-        currencies = list(round_0_data.keys())
-        logger.info(f"Loaded currencies from chart data: {currencies}")
+    try:
+        # Opened once per process, rooms reuse it
+        currencies = Scenario.load(SCENARIO_FILE).data.currencies
+        logger.info(f"Loaded currencies from scenario: {currencies}")
         return currencies
 
+    except FileNotFoundError:
+        logger.warning(f"Scenario file not found: {SCENARIO_FILE}")
+        return ["Apple", "Google", "РосАтом", "BitCoin"]  # fallback
     except Exception as e:
-        logger.error(f"Error loading currencies from chart data: {e}")
+        logger.error(f"Error loading currencies from scenario: {e}")
         return ["Apple", "Google", "РосАтом", "BitCoin"]  # fallback
 
 
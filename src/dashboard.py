@@ -0,0 +1,87 @@
+"""
+Admin dashboard pushed over SSE: the full state on connect, then only
+the keys that changed, at most once per DASHBOARD_PUSH_INTERVAL.
+"""
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+from config import DASHBOARD_PUSH_INTERVAL, REQUIRED_CURRENCIES
+from events import DashboardEvent
+from pubsub import FANOUT_STATS, FanoutStats, Publisher, Subscriber
+
+if TYPE_CHECKING:
+    from rooms import Room
+
+logger = logging.getLogger(__name__)
+
+
+class Dashboard:
+    def __init__(self, room: "Room"):
+        self.room = room
+        # Admin streams of the room, kept out of the players' fan-out metrics
+        self.publisher = Publisher(FanoutStats(), metered=False)
+        self._last_state: dict = {}
+        self._flush_handle: asyncio.TimerHandle | None = None
+
+    def state(self) -> dict:
+        """What /service_info returns"""
+        controller = self.room.controller
+        publisher = self.room.publisher
+        return {
+            "room": self.room.name,
+            "current_prices": controller.get_current_step_chart(),
+            "current_news": controller.get_current_step_news(),
+            "current_round_number": controller.stock.current_step_chart,
+            "next_prices": controller.get_next_step_chart(),
+            "next_news": controller.get_next_step_news(),
+            "available_currencies": REQUIRED_CURRENCIES,
+            "subscribers": len(publisher.subscribers),
+            "publish_latency_ms": round(publisher.last_fanout_duration * 1000, 3),
+            "fanout": FANOUT_STATS.as_dict(),
+            "schedule": controller.scheduler.report(),
+        }
+
+    def changed(self):
+        """Game or subscribers changed, push a diff soon if anyone watches"""
+        if self._flush_handle is not None or not self.publisher.subscribers:
+            return
+        self._flush_handle = asyncio.get_event_loop().call_later(
+            DASHBOARD_PUSH_INTERVAL, self._flush
+        )
+
+    def _flush(self):
+        self._flush_handle = None
+        state = self.state()
+        diff = {
+            key: value
+            for key, value in state.items()
+            if self._last_state.get(key) != value
+        }
+        self._last_state = state
+        if diff:
+            asyncio.ensure_future(
+                self.publisher.notify(DashboardEvent(diff), assign_id=False)
+            )
+
+    def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self.publisher.close()
+
+    async def stream(self):
+        state = self.state()
+        if not self.publisher.subscribers:
+            # Diffs were not tracked while nobody watched
+            self._last_state = state
+        sub = Subscriber()
+        self.publisher.subscribe(sub)
+        try:
+            yield DashboardEvent(state).payload
+            async for frame in sub.listen():
+                yield frame
+        finally:
+            self.publisher.unsubscribe(sub)
+            sub.stop()
@@ -1,12 +1,31 @@
+import copy
+from functools import cached_property
 from typing import Any
 
 import orjson
 
+from config import REQUIRED_CURRENCIES
+
 
 class EventType:
     LOAD = "load"
     UPDATE = "update"
     STREAM_STOP = "stream_stop"
+    HEARTBEAT = "heartbeat"
+    HEADER = "header"
+    DASHBOARD = "dashboard"
+    # Already sent rounds replaced in place
+    PATCH = "patch"
+    # Chart and news rounds after the given steps dropped
+    REWIND = "rewind"
+    # Orders of the player filled, sent only to that player's streams
+    FILL = "fill"
+    # Top of the leaderboard, with the player's own standing on its streams
+    LEADERBOARD = "leaderboard"
+    # Per-currency stats of the played rounds, for streams that ask for them
+    ANALYTICS = "analytics"
+    # Result of a command sent over a WebSocket, to that socket only
+    REPLY = "reply"
 
 
 class EventDataType:
@@ -14,18 +33,123 @@ class EventDataType:
     NEWS = "news"
 
 
+class WireFormat:
+    JSON = "json"
+    # Currency names sent once, chart rounds as price arrays in header order
+    COMPACT = "compact"
+
+
+def _price_row(prices: dict[str, int]) -> list[int]:
+    return [prices[currency] for currency in REQUIRED_CURRENCIES]
+
+
 class Event:
     _type: str
+    # Whether make_compact_data differs from make_data
+    _compact = False
+    # Whether it carries the whole state of its type, so a newer one makes
+    # queued ones obsolete
+    _snapshot = False
 
     def __init__(self, data: Any):
         self.data = data
+        # SSE id, assigned by Publisher when the event is broadcast
+        self.id: int | None = None
 
     def make_data(self):
         return {"data": self.data, "event_type": self._type}
 
+    def make_compact_data(self):
+        return self.make_data()
+
     def dump(self):
         return orjson.dumps(self.make_data()).decode()
 
+    @cached_property
+    def body(self) -> bytes:
+        """
+        JSON of this event, encoded once and shared by every subscriber
+        queue the event is put into, whatever the transport.
+        """
+        return orjson.dumps(self.make_data())
+
+    @cached_property
+    def compact_body(self) -> bytes:
+        if not self._compact:
+            return self.body
+        return orjson.dumps(self.make_compact_data())
+
+    def body_for(self, wire_format: str) -> bytes:
+        if wire_format == WireFormat.COMPACT:
+            return self.compact_body
+        return self.body
+
+    @cached_property
+    def payload(self) -> bytes:
+        """SSE data frame for this event"""
+        return b"data: " + self.body + b"\n\n"
+
+    @cached_property
+    def frame(self) -> bytes:
+        """Payload prefixed with the SSE id line, if the event has an id"""
+        if self.id is None:
+            return self.payload
+        return b"id: %d\n" % self.id + self.payload
+
+    @cached_property
+    def compact_payload(self) -> bytes:
+        if not self._compact:
+            return self.payload
+        return b"data: " + self.compact_body + b"\n\n"
+
+    @cached_property
+    def compact_frame(self) -> bytes:
+        if self.id is None:
+            return self.compact_payload
+        return b"id: %d\n" % self.id + self.compact_payload
+
+    def payload_for(self, wire_format: str) -> bytes:
+        if wire_format == WireFormat.COMPACT:
+            return self.compact_payload
+        return self.payload
+
+    def frame_for(self, wire_format: str) -> bytes:
+        if wire_format == WireFormat.COMPACT:
+            return self.compact_frame
+        return self.frame
+
+    def _message(self, body: bytes) -> bytes:
+        """WebSocket message, the id spliced in as the first key"""
+        if self.id is None:
+            return body
+        return b'{"id":%d,' % self.id + body[1:]
+
+    @cached_property
+    def message(self) -> bytes:
+        return self._message(self.body)
+
+    @cached_property
+    def compact_message(self) -> bytes:
+        if not self._compact:
+            return self.message
+        return self._message(self.compact_body)
+
+    def message_for(self, wire_format: str) -> bytes | None:
+        if wire_format == WireFormat.COMPACT:
+            return self.compact_message
+        return self.message
+
+    def assign_id(self, event_id: int | None):
+        self.id = event_id
+        for name in ("frame", "compact_frame", "message", "compact_message"):
+            self.__dict__.pop(name, None)
+
+    def copy(self) -> "Event":
+        """Copy without id, sharing the already encoded payload"""
+        event = copy.copy(self)
+        event.assign_id(None)
+        return event
+
 
 class DataTypedEvent(Event):
     _data_type: str
@@ -49,6 +173,23 @@ class NewsLoadEvent(LoadEvent):
 
 class ChartLoadEvent(LoadEvent):
     _data_type = EventDataType.CHART
+    _compact = True
+
+    def make_compact_data(self):
+        """
+        First round as a price array, every next round as deltas against
+        the previous one
+        """
+        rounds = sorted(self.data, key=int)
+        rows = [_price_row(self.data[round_number]) for round_number in rounds]
+        deltas = rows[:1] + [
+            [price - previous_price for price, previous_price in zip(row, previous)]
+            for previous, row in zip(rows, rows[1:])
+        ]
+        return self.make_data() | {
+            "format": WireFormat.COMPACT,
+            "data": {"start": int(rounds[0]) if rounds else 0, "rounds": deltas},
+        }
 
 
 class UpdateEvent(DataTypedEvent):
@@ -59,6 +200,25 @@ class UpdateEvent(DataTypedEvent):
 
     _type = EventType.UPDATE
 
+    def merged_after(self, queued: "UpdateEvent") -> "UpdateEvent":
+        """
+        Rounds of a queued event and of this one, the newer ones win like
+        on the client, with this event's id. Subscribers with the same
+        queued event share the merge, so it is encoded once for all of them.
+        """
+        # Keeps queued alive, so its id() isn't reused while cached
+        merges = self.__dict__.setdefault("_merges", {})
+        if id(queued) not in merges:
+            merged = type(self)(queued.data | self.data)
+            merged.assign_id(self.id)
+            merges[id(queued)] = (queued, merged)
+        return merges[id(queued)][1]
+
+    def copy(self) -> "UpdateEvent":
+        event = super().copy()
+        event.__dict__.pop("_merges", None)
+        return event
+
 
 class NewsUpdateEvent(UpdateEvent):
     _data_type = EventDataType.NEWS
@@ -66,6 +226,38 @@ class NewsUpdateEvent(UpdateEvent):
 
 class ChartUpdateEvent(UpdateEvent):
     _data_type = EventDataType.CHART
+    _compact = True
+
+    def make_compact_data(self):
+        """Plain price arrays, so a dropped update never breaks the client"""
+        return self.make_data() | {
+            "format": WireFormat.COMPACT,
+            "data": {
+                round_number: _price_row(prices)
+                for round_number, prices in self.data.items()
+            },
+        }
+
+
+class NewsPatchEvent(NewsUpdateEvent):
+    """News of rounds the client already has, edited by the admin"""
+
+    _type = EventType.PATCH
+
+
+class ChartPatchEvent(ChartUpdateEvent):
+    """Prices of rounds the client already has, edited by the admin"""
+
+    _type = EventType.PATCH
+
+
+class RewindEvent(Event):
+    """Game moved back, clients drop rounds after chart_step and news_step"""
+
+    _type = EventType.REWIND
+
+    def __init__(self, chart_step: int, news_step: int):
+        super().__init__({"chart_step": chart_step, "news_step": news_step})
 
 
 class StopStreamEvent(Event):
@@ -75,3 +267,63 @@ class StopStreamEvent(Event):
 
     def __init__(self):
         super().__init__(None)
+
+
+class HeartbeatEvent(Event):
+    """
+    SSE comment that keeps idle connections alive through proxies.
+    Clients ignore it, so one shared instance is enough. WebSockets have
+    their own pings and skip it.
+    """
+
+    _type = EventType.HEARTBEAT
+    frame = payload = compact_frame = compact_payload = b": heartbeat\n\n"
+    message = compact_message = None
+
+    def __init__(self):
+        super().__init__(None)
+
+
+class CurrencyHeaderEvent(Event):
+    """First event of a compact stream, index of currencies in price arrays"""
+
+    _type = EventType.HEADER
+
+
+class DashboardEvent(Event):
+    """Admin dashboard state, or the keys of it that changed"""
+
+    _type = EventType.DASHBOARD
+
+
+class FillEvent(Event):
+    """Orders of one player filled in a batch, with the updated portfolio"""
+
+    _type = EventType.FILL
+
+
+class LeaderboardEvent(Event):
+    """Top players, and the receiving player's standing if it plays"""
+
+    _type = EventType.LEADERBOARD
+    _snapshot = True
+
+    def __init__(self, top: Any, players: int, standing: dict | None = None):
+        super().__init__({"top": top, "players": players, "standing": standing})
+
+
+class AnalyticsEvent(Event):
+    """Change, moving averages, volatility, range and rank of each currency"""
+
+    _type = EventType.ANALYTICS
+    _snapshot = True
+
+
+class ReplyEvent(Event):
+    """Result of an order or cancel sent by the client, with its ref"""
+
+    _type = EventType.REPLY
+
+
+HEARTBEAT = HeartbeatEvent()
+CURRENCY_HEADER = CurrencyHeaderEvent(REQUIRED_CURRENCIES)
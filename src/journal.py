@@ -0,0 +1,191 @@
+"""
+Durable game state: every applied game command is appended to a journal
+and the full state is snapshotted periodically. On startup the latest
+snapshot is loaded and the commands after it are replayed.
+
+Commands are buffered in memory and written with one fsync per
+JOURNAL_FLUSH_INTERVAL from a thread, so commands never wait for the disk.
+A crash loses at most that interval of commands.
+
+Layout of the journal directory:
+    snapshot.json     {"segment": n, "state": ...}, replay starts at segment n
+    segment-<n>.log   one orjson [op, args] per line
+"""
+
+import asyncio
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+import orjson
+
+from config import JOURNAL_FLUSH_INTERVAL, JOURNAL_SNAPSHOT_EVERY
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    SNAPSHOT_FILE = "snapshot.json"
+
+    def __init__(
+        self,
+        path: Path,
+        apply: Callable[[str, list], Awaitable[Any]],
+        dump_state: Callable[[], dict],
+        load_state: Callable[[dict], Awaitable[None]],
+        is_leader: Callable[[], bool],
+    ):
+        self.path = path
+        self.apply = apply
+        self.dump_state = dump_state
+        self.load_state = load_state
+        # Only one worker writes, the others get commands through it
+        self.is_leader = is_leader
+        self.segment = 0
+        self._file = None
+        self._buffer: list[bytes] = []
+        self._commands_since_snapshot = 0
+        self._writing = False
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.path / f"segment-{segment}.log"
+
+    def _segments(self) -> list[int]:
+        return sorted(
+            int(path.stem.removeprefix("segment-"))
+            for path in self.path.glob("segment-*.log")
+        )
+
+    def append(self, op: str, args: list):
+        """Record an applied command, written by the next flush"""
+        if not self._writing:
+            return
+        self._buffer.append(orjson.dumps([op, args]) + b"\n")
+        self._commands_since_snapshot += 1
+
+    async def recover(self):
+        """Load the latest snapshot and replay commands journaled after it"""
+        started = time.perf_counter()
+        self.path.mkdir(parents=True, exist_ok=True)
+        while True:
+            try:
+                replayed = await self._replay()
+                break
+            except FileNotFoundError as e:
+                # Pruned after a newer snapshot, which covers it
+                logger.warning(f"Journal changed while recovering ({e}), restarting")
+
+        logger.info(
+            f"Recovered game state from {self.path}, {replayed} commands "
+            f"replayed in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+
+    async def _replay(self) -> int:
+        first_segment = 0
+        snapshot_path = self.path / self.SNAPSHOT_FILE
+        if snapshot_path.exists():
+            snapshot = orjson.loads(snapshot_path.read_bytes())
+            first_segment = snapshot["segment"]
+            await self.load_state(snapshot["state"])
+
+        replayed = 0
+        for segment in self._segments():
+            if segment < first_segment:
+                continue
+            for line in self._segment_path(segment).read_bytes().splitlines():
+                try:
+                    op, args = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # Torn last write of a crash
+                    logger.warning(f"Skipping corrupt journal record in {segment}")
+                    continue
+                try:
+                    await self.apply(op, args)
+                except Exception as e:
+                    logger.error(f"Error replaying {op}: {e}")
+                replayed += 1
+            self.segment = max(self.segment, segment)
+        return replayed
+
+    async def run(self):
+        """Flush buffered commands and take snapshots while this worker leads"""
+        while True:
+            await asyncio.sleep(JOURNAL_FLUSH_INTERVAL)
+            if not self.is_leader():
+                self._writing = False
+                continue
+            try:
+                if not self._writing:
+                    # Just started or took over, start from a fresh snapshot
+                    await self.snapshot()
+                await self.flush()
+                if self._commands_since_snapshot >= JOURNAL_SNAPSHOT_EVERY:
+                    await self.snapshot()
+            except Exception as e:
+                logger.error(f"Error writing journal: {e}")
+
+    async def flush(self):
+        if not self._buffer or self._file is None:
+            return
+        data = b"".join(self._buffer)
+        self._buffer.clear()
+        await asyncio.to_thread(self._write, self._file, data)
+
+    @staticmethod
+    def _write(file, data: bytes):
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+    async def snapshot(self):
+        """
+        Start a new segment and snapshot the state at its start.
+        Older segments are removed once the snapshot is on disk.
+        """
+        # No awaits from the dump to the segment switch: buffered commands
+        # are part of the dump and finish the old segment, every later
+        # command goes to the new one
+        state = self.dump_state()
+        pending = b"".join(self._buffer)
+        self._buffer.clear()
+        old_file = self._file
+        self.segment = max([self.segment, *self._segments()]) + 1
+        self._file = open(self._segment_path(self.segment), "ab")
+        self._commands_since_snapshot = 0
+        self._writing = True
+
+        await asyncio.to_thread(self._rotate, old_file, pending, self.segment, state)
+        for segment in self._segments():
+            if segment < self.segment:
+                self._segment_path(segment).unlink(missing_ok=True)
+
+    def _rotate(self, old_file, pending: bytes, segment: int, state: dict):
+        if old_file is not None:
+            if pending:
+                self._write(old_file, pending)
+            old_file.close()
+        self._write_snapshot(segment, state)
+
+    def _write_snapshot(self, segment: int, state: dict):
+        tmp_path = self.path / (self.SNAPSHOT_FILE + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps({"segment": segment, "state": state}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path / self.SNAPSHOT_FILE)
+        directory = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    async def close(self):
+        """Snapshot on shutdown, so the next start has nothing to replay"""
+        if self._writing and self.is_leader():
+            await self.snapshot()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._writing = False
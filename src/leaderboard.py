@@ -0,0 +1,168 @@
+"""
+Leaderboard: players ranked by portfolio value at the current prices.
+
+Positions are kept as columns, one slot per player, so revaluing every
+player is one pass per currency. The ranking is kept sorted: new players
+are inserted in place, and after a revalue the previous order is sorted
+again, which is close to linear as rankings mostly persist between rounds.
+Players are sent the top of the table and their own rank, at most once
+per LEADERBOARD_PUSH_INTERVAL.
+"""
+
+import asyncio
+import bisect
+import logging
+from array import array
+from itertools import repeat
+from operator import add, mul
+from typing import TYPE_CHECKING
+
+import orjson
+
+from config import LEADERBOARD_PUSH_INTERVAL, LEADERBOARD_SIZE
+from events import LeaderboardEvent
+
+if TYPE_CHECKING:
+    from stock import StockMarketController
+    from trading import Portfolio
+
+logger = logging.getLogger(__name__)
+
+
+class Leaderboard:
+    def __init__(self, controller: "StockMarketController"):
+        self.controller = controller
+        self._clear()
+        self._flush_handle: asyncio.TimerHandle | None = None
+
+    def _clear(self):
+        self.player_ids: list[str] = []
+        self.slots: dict[str, int] = {}
+        self.cash = array("q")
+        self.holdings: dict[str, array] = {}
+        self.values: list[int] = []
+        # Slots by descending value, ties in registration order
+        self.order: list[int] = []
+        self.ranks: list[int] = []
+        self._dirty = False
+
+    def _sort_key(self, slot: int) -> int:
+        return -self.values[slot]
+
+    def add(self, player_id: str, portfolio: "Portfolio"):
+        slot = len(self.player_ids)
+        self.player_ids.append(player_id)
+        self.slots[player_id] = slot
+        self.cash.append(0)
+        for column in self.holdings.values():
+            column.append(0)
+        self.values.append(0)
+        self.update(player_id, portfolio)
+        self.ranks = []
+        if self._dirty:
+            # Placed by the pending revalue
+            self.order.append(slot)
+            return
+        # Cash only, its value doesn't depend on prices
+        self.values[slot] = portfolio.cash
+        bisect.insort(self.order, slot, key=self._sort_key)
+
+    def update(self, player_id: str, portfolio: "Portfolio"):
+        """
+        Copy a player's position after a trade. A trade at the current
+        price doesn't change the player's value, so the ranking stays valid.
+        """
+        slot = self.slots[player_id]
+        self.cash[slot] = portfolio.cash
+        for currency, quantity in portfolio.holdings.items():
+            if currency not in self.holdings:
+                self.holdings[currency] = array("q", bytes(8 * len(self.player_ids)))
+            self.holdings[currency][slot] = quantity
+        for currency, column in self.holdings.items():
+            if currency not in portfolio.holdings:
+                column[slot] = 0
+
+    def rebuild(self, players: dict[str, "Portfolio"]):
+        self._clear()
+        self._dirty = True
+        for player_id, portfolio in players.items():
+            self.add(player_id, portfolio)
+        self.prices_changed()
+
+    def prices_changed(self):
+        """Revalue on the next read and push the new standings soon"""
+        self._dirty = True
+        self.changed()
+
+    def _revalue(self):
+        prices = self.controller.exchange.prices()
+        values = list(self.cash)
+        for currency, column in self.holdings.items():
+            price = prices.get(currency, 0)
+            values = list(map(add, values, map(mul, column, repeat(price))))
+        self.values = values
+        self.order.sort(key=self._sort_key)
+        self.ranks = []
+        self._dirty = False
+
+    def _ranking(self) -> tuple[list[int], list[int]]:
+        if self._dirty:
+            self._revalue()
+        if not self.ranks:
+            ranks = [0] * len(self.order)
+            for rank, slot in enumerate(self.order, 1):
+                ranks[slot] = rank
+            self.ranks = ranks
+        return self.order, self.ranks
+
+    def _entry(self, slot: int, rank: int) -> dict:
+        player_id = self.player_ids[slot]
+        return {
+            "rank": rank,
+            "name": self.controller.exchange.names[player_id],
+            "value": self.values[slot],
+        }
+
+    def top(self, limit: int = LEADERBOARD_SIZE) -> list[dict]:
+        order, _ = self._ranking()
+        return [self._entry(slot, rank) for rank, slot in enumerate(order[:limit], 1)]
+
+    def standing(self, player_id: str) -> dict | None:
+        slot = self.slots.get(player_id)
+        if slot is None:
+            return None
+        _, ranks = self._ranking()
+        return self._entry(slot, ranks[slot])
+
+    def changed(self):
+        """Standings changed, push them soon if anyone streams the room here"""
+        if self._flush_handle is not None or not self.controller.publisher.subscribers:
+            return
+        self._flush_handle = asyncio.get_event_loop().call_later(
+            LEADERBOARD_PUSH_INTERVAL, lambda: asyncio.ensure_future(self._flush())
+        )
+
+    async def _flush(self):
+        """Top of the table to every stream, with the player's own rank if any"""
+        self._flush_handle = None
+        if not self.player_ids:
+            return
+        publisher = self.controller.publisher
+        # Encoded once, embedded into each player's event as is
+        top = orjson.Fragment(orjson.dumps(self.top()))
+        players = len(self.player_ids)
+        spectators = LeaderboardEvent(top, players)
+        player_uids = set()
+        for player_id, uids in self.controller.exchange.streams.items():
+            event = LeaderboardEvent(top, players, self.standing(player_id))
+            for uid in uids:
+                player_uids.add(uid)
+                await publisher.notify_by_uid(uid, event)
+        for uid in list(publisher.subscribers):
+            if uid not in player_uids:
+                await publisher.notify_by_uid(uid, spectators)
+
+    def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
@@ -1,91 +1,356 @@
 import asyncio
+import itertools
 import logging
 from contextlib import asynccontextmanager
+from typing import Callable
+from uuid import uuid4
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
+import orjson
+from fastapi import (
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
+from fastapi.responses import HTMLResponse, StreamingResponse
+from pydantic import ValidationError
 
-from admin_api import router, secret_uid
+from admin_api import ADMIN_PREFIX, game_router, router
 
 # Import configuration
-from config import FRONTEND_DIR, LOG_FORMAT, LOG_LEVEL
-from pubsub import Publisher, Subscriber
-from stock import StockMarketController
+from config import (
+    FRONTEND_DIR,
+    LOG_FORMAT,
+    LOG_LEVEL,
+    STATIC_MAX_AGE,
+    STREAM_LOG_SAMPLE_RATE,
+)
+from events import CURRENCY_HEADER, Event, EventType, ReplyEvent, WireFormat
+from metrics import BYTES_SENT
+from pubsub import Publisher, Subscriber, Transport
+from rooms import Room, Rooms
+from scheduler import RoundScheduler
+from static import StaticPage
+from trading_api import OrderData, trading_router
 
 # Configure logging
 logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
+_frames_sent = itertools.count()
 
-async def stream():
-    sub = Subscriber()
-    Publisher.subscribe(sub)
+
+def catch_up_events(room: Room, last_event_id: str | None) -> tuple[list[Event], bool]:
+    """
+    Events a (re)connecting client needs before live updates: events it
+    missed since Last-Event-ID, or the full LOAD snapshot if the replay
+    log doesn't cover the gap. Second value is whether they are missed
+    events, sent with their ids.
+    """
+    missed = None
+    if last_event_id is not None and last_event_id.isdigit():
+        missed = room.publisher.events_since(int(last_event_id))
+
+    # A finished game is reloaded from the snapshot, as on a fresh connect
+    if missed is not None and all(
+        event._type != EventType.STREAM_STOP for event in missed
+    ):
+        return missed, True
 
     # Send current progress to user (chart and news by rounds)
-    await StockMarketController.publish_until_current_step_data(sub.uid)
-    await StockMarketController.publish_until_current_step_news(sub.uid)
+    return list(room.stock.get_snapshot_events()), False
+
+
+def catch_up_frames(
+    room: Room, last_event_id: str | None, wire_format: str
+) -> list[bytes]:
+    frames = []
+    if wire_format == WireFormat.COMPACT:
+        frames.append(CURRENCY_HEADER.compact_payload)
+    events, missed = catch_up_events(room, last_event_id)
+    if missed:
+        return frames + [event.frame_for(wire_format) for event in events]
+
+    frames += [event.payload_for(wire_format) for event in events]
+    # Bare id line sets the client's Last-Event-ID to the snapshot position
+    if room.publisher.last_event_id:
+        frames.append(b"id: %d\n\n" % room.publisher.last_event_id)
+    return frames
+
+
+def catch_up_messages(
+    room: Room, last_event_id: str | None, wire_format: str
+) -> list[bytes]:
+    """catch_up_frames for WebSockets"""
+    messages = []
+    if wire_format == WireFormat.COMPACT:
+        messages.append(CURRENCY_HEADER.compact_body)
+    events, missed = catch_up_events(room, last_event_id)
+    if missed:
+        return messages + [event.message_for(wire_format) for event in events]
+
+    messages += [event.body_for(wire_format) for event in events]
+    # Position of the snapshot, to resume from after a reconnect
+    if room.publisher.last_event_id:
+        messages.append(b'{"id":%d}' % room.publisher.last_event_id)
+    return messages
 
-    # Stream updates
-    async for data in sub.listen():
-        print("sending", data, flush=True)
-        yield f"data: {data}\n\n"
 
-    Publisher.unsubscribe(sub)
+def subscribe(
+    room: Room, sub: Subscriber, player_id: str | None, analytics: bool
+) -> Callable[[], None]:
+    """Subscribe to the room, fills and analytics; returns the unsubscribe"""
+    controller = room.controller
+    room.publisher.subscribe(sub)
+    if analytics:
+        controller.analytics_streams.add(sub.uid)
+    # Fills of the player's orders go to each of its streams
+    player_streams = controller.exchange.streams
+    if player_id is not None:
+        player_streams[player_id].add(sub.uid)
+
+    def unsubscribe():
+        room.publisher.unsubscribe(sub)
+        sub.stop()
+        controller.analytics_streams.discard(sub.uid)
+        if player_id is not None:
+            player_streams[player_id].discard(sub.uid)
+            if not player_streams[player_id]:
+                del player_streams[player_id]
+
+    return unsubscribe
+
+
+async def stream(
+    room: Room,
+    last_event_id: str | None = None,
+    wire_format: str = WireFormat.JSON,
+    player_id: str | None = None,
+    analytics: bool = False,
+):
+    sub = Subscriber(wire_format=wire_format)
+    unsubscribe = subscribe(room, sub, player_id, analytics)
+
+    # Client disconnect cancels the generator, so unsubscribe in finally
+    try:
+        # Computed right after subscribing, so nothing is missed or duplicated
+        for frame in catch_up_frames(room, last_event_id, wire_format):
+            yield frame
+        if analytics:
+            yield room.stock.analytics.event().payload
+
+        # Stream updates, frames are already encoded once per event
+        async for frame in sub.listen():
+            BYTES_SENT.inc(amount=len(frame))
+            if next(_frames_sent) % STREAM_LOG_SAMPLE_RATE == 0:
+                logger.debug(f"Sending to {sub.uid}: {frame[:200]!r}")
+            yield frame
+    finally:
+        unsubscribe()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    cleanup_task = asyncio.create_task(Publisher.start_cleanup_task())
+    for page in (INDEX_PAGE, ADMIN_PAGE):
+        try:
+            page.load()
+        except OSError as e:
+            logger.error(f"Frontend page not loaded: {e}")
+    Rooms.default()
+    journal = Rooms.journal()
+    broker = Rooms.broker()
+    if journal is not None:
+        # Only the first leader loads the journal, the others get its state
+        broker.recover = journal.recover
+    await broker.start()
+    tasks = [asyncio.create_task(journal.run())] if journal is not None else []
+    tasks += [
+        asyncio.create_task(Publisher.start_cleanup_task()),
+        asyncio.create_task(Publisher.start_heartbeat_task()),
+        asyncio.create_task(RoundScheduler.start_scheduler_task()),
+    ]
     logger.info("Stock market simulation server started")
 
     yield
 
     # Shutdown
-    cleanup_task.cancel()
-    try:
-        await cleanup_task
-    except asyncio.CancelledError:
-        pass
-    await Publisher.cleanup_stale_subscribers(0)  # Remove all subscribers
+    for task in tasks:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    if journal is not None:
+        await journal.close()
+    Rooms.stop_all()
+    await broker.stop()
     logger.info("Stock market simulation server stopped")
 
 
 app = FastAPI(lifespan=lifespan, docs_url=None, redoc_url=None)
 app.include_router(router)
+app.include_router(game_router, prefix=ADMIN_PREFIX)
+app.include_router(game_router, prefix=f"{ADMIN_PREFIX}/rooms/{{room}}")
+app.include_router(trading_router, prefix="/api")
+app.include_router(trading_router, prefix="/api/rooms/{room}")
 
 
 @app.get("/stream")
-async def stream_data():
-    return StreamingResponse(stream(), media_type="text/event-stream")
+@app.get("/stream/{room}")
+async def stream_data(
+    room: str = Rooms.DEFAULT,
+    last_event_id: str | None = Header(None),
+    wire_format: str = Query(WireFormat.JSON, alias="format"),
+    player_id: str | None = Query(None, alias="player"),
+    analytics: bool = False,
+):
+    found = find_stream_room(room, wire_format, player_id)
+    return StreamingResponse(
+        stream(found, last_event_id, wire_format, player_id, analytics),
+        media_type="text/event-stream",
+    )
 
 
-@app.get("/", response_class=HTMLResponse)
-async def serve_index():
-    index_path = FRONTEND_DIR / "index.html"
-    if not index_path.exists():
-        raise HTTPException(status_code=404, detail="Index file not found")
-    return FileResponse(str(index_path))
+def find_stream_room(room: str, wire_format: str, player_id: str | None) -> Room:
+    if wire_format not in (WireFormat.JSON, WireFormat.COMPACT):
+        raise HTTPException(status_code=400, detail="Unknown stream format")
+    found = Rooms.get(room)
+    if found is None:
+        raise HTTPException(status_code=404, detail=f"Unknown room: {room}")
+    if player_id is not None and player_id not in found.controller.exchange.players:
+        raise HTTPException(status_code=404, detail=f"Unknown player: {player_id}")
+    return found
+
 
+async def handle_command(
+    room: Room, sub: Subscriber, player_id: str | None, command: dict
+):
+    """Order or cancel sent over a WebSocket, the result is queued as a reply"""
+    exchange = room.controller.exchange
+    action = command.pop("action", None)
+    reply = {"ref": command.pop("ref", None)}
+    if player_id is None:
+        reply |= {"status": "error", "message": "Connect with ?player= to trade"}
+    elif action == "order":
+        try:
+            order = OrderData.model_validate(command | {"player_id": player_id})
+        except ValidationError as e:
+            reply |= {"status": "error", "message": str(e)}
+        else:
+            order = order.model_dump() | {"order_id": uuid4().hex}
+            reply |= await exchange.submit(order)
+    elif action == "cancel":
+        order_id = command.get("order_id")
+        cancelled = await room.controller.cancel_order(player_id, order_id)
+        reply |= {"status": "cancelled" if cancelled else "error", "order_id": order_id}
+    else:
+        reply |= {"status": "error", "message": f"Unknown action: {action}"}
+    # Through the publisher, so a subscriber that can't take it is evicted
+    await room.publisher.notify_by_uid(sub.uid, ReplyEvent(reply))
 
-@app.get(f"/__admin__/{secret_uid}", response_class=HTMLResponse)
-async def serve_admin():
-    admin_path = FRONTEND_DIR / "admin.html"
-    if not admin_path.exists():
-        raise HTTPException(status_code=404, detail="Admin file not found")
 
+@app.websocket("/ws")
+@app.websocket("/ws/{room}")
+async def websocket_stream(
+    websocket: WebSocket,
+    room: str = Rooms.DEFAULT,
+    wire_format: str = Query(WireFormat.JSON, alias="format"),
+    player_id: str | None = Query(None, alias="player"),
+    analytics: bool = False,
+    last_event_id: str | None = None,
+):
+    """
+    The /stream events as binary messages of the same encoded JSON, and
+    orders and cancels from the client on the same socket. Compression
+    is negotiated per connection by the server (permessage-deflate).
+    """
     try:
-        with open(admin_path, "r", encoding="utf-8") as f:
-            content = f.read()
-    except IOError as e:
-        raise HTTPException(status_code=500, detail=f"Failed to read admin file: {e}")
-
-    # Inject the admin URL into the HTML
-    content = content.replace(
-        "adminBaseUrl = '';", f"adminBaseUrl = '/__admin__/{secret_uid}';"
-    )
+        found = find_stream_room(room, wire_format, player_id)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=e.detail)
+        return
+    await websocket.accept()
+    sub = Subscriber(wire_format=wire_format, transport=Transport.WEBSOCKET)
+    unsubscribe = subscribe(found, sub, player_id, analytics)
+    commands: set[asyncio.Task] = set()
+
+    async def receive():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                try:
+                    command = orjson.loads(message.get("bytes") or message.get("text"))
+                    if not isinstance(command, dict):
+                        raise ValueError("Commands are JSON objects")
+                except ValueError as e:
+                    await found.publisher.notify_by_uid(
+                        sub.uid, ReplyEvent({"status": "error", "message": str(e)})
+                    )
+                    continue
+                # Orders wait for their batch, keep reading meanwhile
+                task = asyncio.create_task(
+                    handle_command(found, sub, player_id, command)
+                )
+                commands.add(task)
+                task.add_done_callback(commands.discard)
+        finally:
+            sub.stop()
+
+    receiver = asyncio.create_task(receive())
+    try:
+        for message in catch_up_messages(found, last_event_id, wire_format):
+            await websocket.send_bytes(message)
+        if analytics:
+            await websocket.send_bytes(found.stock.analytics.event().body)
+        async for message in sub.listen():
+            BYTES_SENT.inc(amount=len(message))
+            await websocket.send_bytes(message)
+        if not receiver.done():
+            # Game finished
+            await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        for task in commands:
+            task.cancel()
+        unsubscribe()
+
+
+INDEX_PAGE = StaticPage(
+    FRONTEND_DIR / "index.html", f"public, max-age={STATIC_MAX_AGE}"
+)
+# Same page for every room, it takes the room's admin URL from its location
+ADMIN_PAGE = StaticPage(
+    FRONTEND_DIR / "admin.html",
+    "private, no-cache",
+    render=lambda content: content.replace(
+        "adminBaseUrl = '';", f"adminBaseUrl = '{ADMIN_PREFIX}';"
+    ),
+)
+
+
+@app.get("/", response_class=HTMLResponse)
+@app.get("/rooms/{room}", response_class=HTMLResponse)
+async def serve_index(request: Request, room: str = Rooms.DEFAULT):
+    if Rooms.get(room) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown room: {room}")
+    return INDEX_PAGE.response(request)
+
 
-    return HTMLResponse(content=content)
+@app.get(ADMIN_PREFIX, response_class=HTMLResponse)
+@app.get(f"{ADMIN_PREFIX}/rooms/{{room}}", response_class=HTMLResponse)
+async def serve_admin(request: Request, room: str = Rooms.DEFAULT):
+    if Rooms.get(room) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown room: {room}")
+    return ADMIN_PAGE.response(request)
 
 
 @app.get("/api/currencies")
@@ -0,0 +1,140 @@
+"""Minimal Prometheus text exposition, cheap enough for the fan-out hot path"""
+
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable
+
+
+def _format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    _kind: str
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self._kind}",
+            *self.samples(),
+        ]
+
+
+class Counter(Metric):
+    _kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: dict[tuple, float] = defaultdict(float)
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] += amount
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {value}"
+            for key, value in self.values.items()
+        ]
+
+
+class Gauge(Metric):
+    """Gauge read at scrape time, so nothing is tracked on the hot path"""
+
+    _kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.read = read
+
+    def samples(self) -> list[str]:
+        return [f"{self.name} {self.read()}"]
+
+
+class CallbackCounter(Gauge):
+    """Counter kept elsewhere and read at scrape time"""
+
+    _kind = "counter"
+
+
+class Histogram(Metric):
+    _kind = "histogram"
+
+    DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+        # Per-bucket counts, cumulated on render; last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+EVENTS_PUBLISHED = REGISTRY.register(
+    Counter(
+        "stock_sim_events_published_total",
+        "Broadcast events by event and data type",
+        ("event_type", "data_type"),
+    )
+)
+FANOUT_DURATION = REGISTRY.register(
+    Histogram(
+        "stock_sim_fanout_duration_seconds",
+        "Time to put one broadcast event into every subscriber queue",
+    )
+)
+BYTES_SENT = REGISTRY.register(
+    Counter("stock_sim_stream_bytes_sent_total", "SSE bytes yielded to clients")
+)
+SCHEDULER_JITTER = REGISTRY.register(
+    Histogram(
+        "stock_sim_scheduler_jitter_seconds",
+        "Delay between a scheduled round or news and its completed publish",
+    )
+)
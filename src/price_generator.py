@@ -0,0 +1,266 @@
+"""
+Procedural price paths for long or many parallel games.
+
+Vectorized geometric Brownian motion with correlated shocks, optional
+Merton jumps and news-driven jumps: a ticker named in a news item of a
+round jumps when that news is published. Seeded, so a scenario is
+reproducible. Needs the `generator` extra (NumPy).
+
+    python src/price_generator.py --rounds 1000 --seed 42 -o chart_data.json
+
+An output path not ending in .json gets the binary scenario format.
+"""
+
+import argparse
+from array import array
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import orjson
+
+from prices import PriceStore
+from scenario import Scenario
+
+
+class TickerSpec:
+    """
+    Per-round drift and volatility of log returns, and optional jumps:
+    jump_intensity is the expected number of jumps per round, jump sizes
+    are normal in log space. News naming the ticker or one of its aliases
+    move its price.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        start_price: float,
+        drift: float = 0.0,
+        volatility: float = 0.05,
+        jump_intensity: float = 0.0,
+        jump_mean: float = 0.0,
+        jump_std: float = 0.0,
+        aliases: Iterable[str] = (),
+    ):
+        self.name = name
+        self.start_price = start_price
+        self.drift = drift
+        self.volatility = volatility
+        self.jump_intensity = jump_intensity
+        self.jump_mean = jump_mean
+        self.jump_std = jump_std
+        self.aliases = tuple(aliases)
+
+    @classmethod
+    def from_dict(cls, name: str, spec: dict) -> "TickerSpec":
+        return cls(name, **spec)
+
+
+def generate_prices(
+    tickers: list[TickerSpec],
+    rounds: int,
+    correlation: np.ndarray | None = None,
+    news_impacts: dict[int, dict[str, float]] | None = None,
+    seed: int | None = None,
+) -> np.ndarray:
+    """
+    Price matrix of shape (rounds, tickers), round 0 is the start prices.
+
+    correlation is the tickers x tickers correlation matrix of shocks.
+    news_impacts maps a news round to log-return jumps per ticker; news
+    of round k is published after chart k, so it moves prices of round k+1.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(tickers)
+    steps = rounds - 1
+
+    drift = np.array([t.drift for t in tickers])
+    volatility = np.array([t.volatility for t in tickers])
+
+    shocks = rng.standard_normal((steps, n))
+    if correlation is not None:
+        shocks = shocks @ np.linalg.cholesky(correlation).T
+    log_returns = (drift - volatility**2 / 2) + volatility * shocks
+
+    intensity = np.array([t.jump_intensity for t in tickers])
+    if intensity.any():
+        jump_mean = np.array([t.jump_mean for t in tickers])
+        jump_std = np.array([t.jump_std for t in tickers])
+        jumps = rng.poisson(intensity, (steps, n))
+        # Sum of k normal jumps is normal with k times mean and variance
+        log_returns += jumps * jump_mean + np.sqrt(jumps) * jump_std * (
+            rng.standard_normal((steps, n))
+        )
+
+    index = {t.name: i for i, t in enumerate(tickers)}
+    for news_round, impacts in (news_impacts or {}).items():
+        if 0 <= news_round < steps:
+            for name, impact in impacts.items():
+                log_returns[news_round, index[name]] += impact
+
+    start = np.log([t.start_price for t in tickers])
+    log_prices = np.vstack([start, start + np.cumsum(log_returns, axis=0)])
+    # Game prices are whole and positive
+    return np.maximum(np.rint(np.exp(log_prices)), 1).astype(np.int64)
+
+
+def news_impacts_from_news(
+    tickers: list[TickerSpec],
+    news: Iterable[list[str]],
+    jump_std: float,
+    seed: int | None = None,
+) -> dict[int, dict[str, float]]:
+    """
+    Log-return jumps for generate_prices: every ticker named in a news
+    item of round k jumps once for that round. News carry no sentiment,
+    so jumps are normal with zero mean and jump_std.
+    """
+    # Separate stream, so prices of a seed don't change with the news
+    rng = np.random.default_rng(None if seed is None else [seed, 1])
+    names = [(t.name, [n.lower() for n in (t.name, *t.aliases)]) for t in tickers]
+    impacts = {}
+    for news_round, items in enumerate(news):
+        text = " ".join(items or []).lower()
+        named = [name for name, keys in names if any(k in text for k in keys)]
+        if named:
+            jumps = rng.normal(0.0, jump_std, len(named))
+            impacts[news_round] = dict(zip(named, jumps.tolist()))
+    return impacts
+
+
+def generate_scenario(settings: dict) -> Scenario:
+    """
+    Scenario over the tickers, round 0 prices and news of a scenario file,
+    settings being:
+    {"base": path, "rounds", "seed", "volatility", "correlation", "news_jump"}
+    """
+    base = Scenario.load(settings["base"])
+    rounds = settings["rounds"]
+    tickers = [
+        TickerSpec(name, price, volatility=settings["volatility"])
+        for name, price in base.data.round(0).items()
+    ]
+    n = len(tickers)
+    correlation = np.full((n, n), settings["correlation"])
+    np.fill_diagonal(correlation, 1.0)
+    news = list(base.news[:rounds])
+    news += [[] for _ in range(rounds - len(news))]
+    news_impacts = None
+    if settings["news_jump"]:
+        news_impacts = news_impacts_from_news(
+            tickers, news, settings["news_jump"], settings["seed"]
+        )
+    prices = generate_prices(
+        tickers, rounds, correlation, news_impacts, seed=settings["seed"]
+    )
+    return Scenario(to_price_store(tickers, prices), news)
+
+
+def to_price_store(tickers: list[TickerSpec], prices: np.ndarray) -> PriceStore:
+    store = PriceStore(t.name for t in tickers)
+    store.columns = [
+        array("q", np.ascontiguousarray(prices[:, i]).tobytes())
+        for i in range(len(tickers))
+    ]
+    return store
+
+
+def to_chart_json(
+    tickers: list[TickerSpec],
+    prices: np.ndarray,
+    news: Iterable[list[str]] = (),
+) -> dict:
+    """Same layout as chart_data.json"""
+    names = [t.name for t in tickers]
+    news = list(news)
+    return {
+        str(step): {
+            "chart": dict(zip(names, row)),
+            "news": news[step] if step < len(news) else [],
+        }
+        for step, row in enumerate(prices.tolist())
+    }
+
+
+def tickers_from_chart_data(chart_file: Path, volatility: float) -> list[TickerSpec]:
+    """Tickers and start prices of round 0 of an existing scenario"""
+    js = orjson.loads(chart_file.read_bytes())
+    return [
+        TickerSpec(name, price, volatility=volatility)
+        for name, price in js["0"]["chart"].items()
+    ]
+
+
+def main():
+    from config import CHART_DATA_FILE
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--rounds", type=int, default=100)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument(
+        "--tickers",
+        type=Path,
+        help='JSON {"name": {"start_price": ..., "drift": ..., ...}}, '
+        "defaults to round 0 of chart_data.json",
+    )
+    parser.add_argument("--volatility", type=float, default=0.1)
+    parser.add_argument(
+        "--correlation", type=float, default=0.0, help="Pairwise shock correlation"
+    )
+    parser.add_argument(
+        "--news-impacts",
+        type=Path,
+        help='JSON {"news round": {"ticker": log-return jump}}',
+    )
+    parser.add_argument(
+        "--news-jump",
+        type=float,
+        default=0.0,
+        help="Std of log-return jumps of tickers named in news, 0 for none",
+    )
+    parser.add_argument(
+        "--news-from",
+        type=Path,
+        default=CHART_DATA_FILE,
+        help="Take news of each round from this scenario",
+    )
+    parser.add_argument("-o", "--output", type=Path, required=True)
+    args = parser.parse_args()
+
+    if args.tickers:
+        specs = orjson.loads(args.tickers.read_bytes())
+        tickers = [TickerSpec.from_dict(name, spec) for name, spec in specs.items()]
+    else:
+        tickers = tickers_from_chart_data(CHART_DATA_FILE, args.volatility)
+
+    n = len(tickers)
+    correlation = np.full((n, n), args.correlation)
+    np.fill_diagonal(correlation, 1.0)
+
+    news = []
+    if args.news_from and args.news_from.exists():
+        scenario = orjson.loads(args.news_from.read_bytes())
+        news = [data["news"] or [] for data in scenario.values()]
+
+    news_impacts = {}
+    if args.news_jump:
+        news_impacts = news_impacts_from_news(tickers, news, args.news_jump, args.seed)
+    if args.news_impacts:
+        for news_round, impacts in orjson.loads(args.news_impacts.read_bytes()).items():
+            round_impacts = news_impacts.setdefault(int(news_round), {})
+            for name, impact in impacts.items():
+                round_impacts[name] = round_impacts.get(name, 0.0) + impact
+
+    prices = generate_prices(
+        tickers, args.rounds, correlation, news_impacts, seed=args.seed
+    )
+    if args.output.suffix != ".json":
+        Scenario(to_price_store(tickers, prices), news).write_binary(args.output)
+        return
+    args.output.write_bytes(
+        orjson.dumps(to_chart_json(tickers, prices, news), option=orjson.OPT_INDENT_2)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+from array import array
+from typing import Iterable
+
+
+class PriceStore:
+    """
+    Columnar price storage: one contiguous int64 array per currency,
+    indexed by round. Currency order is fixed at creation and is the
+    order used by price rows and the compact stream format.
+
+    Indexing and len() behave like the list of per-round dicts it replaces.
+    Columns of a memory-mapped scenario are read-only int64 memoryviews,
+    copy() the store before changing it.
+    """
+
+    def __init__(self, currencies: Iterable[str]):
+        self.currencies = list(currencies)
+        self.index = {currency: i for i, currency in enumerate(self.currencies)}
+        self.columns = [array("q") for _ in self.currencies]
+
+    @classmethod
+    def from_rounds(
+        cls, rounds: Iterable[dict[str, int]], currencies: Iterable[str]
+    ) -> "PriceStore":
+        store = cls(currencies)
+        for prices in rounds:
+            store.append(prices)
+        return store
+
+    def copy(self) -> "PriceStore":
+        """Writable copy, also of a memory-mapped store"""
+        store = PriceStore(self.currencies)
+        for copied, column in zip(store.columns, self.columns):
+            copied.frombytes(column.tobytes())
+        return store
+
+    def __len__(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def __getitem__(self, step: int) -> dict[str, int]:
+        return self.round(step)
+
+    def __iter__(self):
+        return (self.round(step) for step in range(len(self)))
+
+    def _price_row(self, prices: dict[str, int]) -> array:
+        """
+        Prices in currency order, raises KeyError, TypeError or
+        OverflowError before any column is written
+        """
+        missing = [currency for currency in self.currencies if currency not in prices]
+        if missing:
+            raise KeyError(f"Missing prices for {missing}")
+        return array("q", (prices[currency] for currency in self.currencies))
+
+    def append(self, prices: dict[str, int]):
+        """Add a round, amortized O(1) per currency"""
+        for column, price in zip(self.columns, self._price_row(prices)):
+            column.append(price)
+
+    def append_row(self, row: Iterable[int]):
+        for column, price in zip(self.columns, row, strict=True):
+            column.append(price)
+
+    def set_round(self, step: int, prices: dict[str, int]):
+        """Replace prices of a round in place"""
+        for column, price in zip(self.columns, self._price_row(prices)):
+            column[step] = price
+
+    def row(self, step: int) -> list[int]:
+        """Prices of a round in currency order"""
+        return [column[step] for column in self.columns]
+
+    def round(self, step: int) -> dict[str, int]:
+        return dict(zip(self.currencies, self.row(step)))
+
+    def rows(self, stop: int, start: int = 0) -> list[list[int]]:
+        """Price rows of rounds [start, stop)"""
+        return [list(prices) for prices in zip(*(c[start:stop] for c in self.columns))]
+
+    def rounds(self, stop: int, start: int = 0) -> dict[str, dict[str, int]]:
+        """Rounds [start, stop) keyed by stringified round number"""
+        return {
+            str(step): dict(zip(self.currencies, row))
+            for step, row in enumerate(self.rows(stop, start), start)
+        }
+
+    def column(self, currency: str) -> array | memoryview:
+        return self.columns[self.index[currency]]
+
+    def dump(self) -> dict:
+        return {
+            "currencies": self.currencies,
+            "columns": [column.tolist() for column in self.columns],
+        }
+
+    @classmethod
+    def load(cls, state: dict) -> "PriceStore":
+        store = cls(state["currencies"])
+        store.columns = [array("q", column) for column in state["columns"]]
+        return store
@@ -1,131 +1,529 @@
 import asyncio
-from typing import Generic, TypeVar
+import logging
+import time
+from collections import deque
+from typing import Callable, Generic, Iterable, TypeVar
 from uuid import UUID, uuid4
 
-from events import Event, EventType
+from config import (
+    CLEANUP_INTERVAL,
+    HEARTBEAT_INTERVAL,
+    REPLAY_LOG_SIZE,
+    SUBSCRIBER_COALESCE,
+    SUBSCRIBER_OVERFLOW_POLICY,
+    SUBSCRIBER_QUEUE_SIZE,
+    SUBSCRIBER_TIMEOUT,
+)
+from events import (
+    HEARTBEAT,
+    DataTypedEvent,
+    Event,
+    EventType,
+    LoadEvent,
+    UpdateEvent,
+    WireFormat,
+)
+from metrics import (
+    EVENTS_PUBLISHED,
+    FANOUT_DURATION,
+    REGISTRY,
+    CallbackCounter,
+    Gauge,
+)
+
+logger = logging.getLogger(__name__)
 
 T = TypeVar("T")
 
 
-class TimeoutQueue(Generic[T]):
-    def __init__(self):
-        self.q = asyncio.Queue()
+class Transport:
+    SSE = "sse"
+    WEBSOCKET = "websocket"
 
-    async def get(self, timeout: float = 1.0) -> T:
-        async with asyncio.timeout(timeout):
-            result = await self.q.get()
-            return result
 
-    async def put(self, item: T, timeout: float = 1.0):
-        async with asyncio.timeout(timeout):
-            await self.q.put(item)
+class OverflowPolicy:
+    DROP_OLDEST = "drop_oldest"
+    COALESCE = "coalesce"
+    DISCONNECT = "disconnect"
 
 
-class EventQueue(TimeoutQueue[Event]):
-    pass
+class BoundedQueue(Generic[T]):
+    """
+    Bounded FIFO queue. Getting waits until an item arrives or the queue
+    is closed, putting never waits.
+    """
 
+    def __init__(self, maxsize: int = 0):
+        self.q: deque[T] = deque()
+        self.maxsize = maxsize
+        self.closed = False
+        self._not_empty = asyncio.Event()
 
-class Publisher:
-    _instance: "Publisher" = None
+    def __len__(self) -> int:
+        return len(self.q)
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= len(self.q)
+
+    async def get(self) -> T | None:
+        """Returns None once the queue is closed"""
+        while not self.q and not self.closed:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        if self.closed:
+            return None
+        return self.q.popleft()
+
+    def put_nowait(self, item: T):
+        """Append item, the caller is responsible for checking full()"""
+        self.q.append(item)
+        self._not_empty.set()
+
+    def drop_oldest(self) -> T | None:
+        return self.q.popleft() if self.q else None
+
+    def clear(self):
+        self.q.clear()
+
+    def close(self):
+        """Wake up the waiting getter and make it return None"""
+        self.closed = True
+        self._not_empty.set()
+
+
+class EventQueue(BoundedQueue[Event]):
+    """
+    Events of one subscriber. With coalescing, queued events the consumer
+    hasn't taken yet give way to newer ones carrying the same state, so a
+    slow consumer holds about one event per kind of state and catches up
+    without replaying every one of them:
+    - a LOAD drops queued LOAD, UPDATE and PATCH events of its data type
+    - a leaderboard or analytics event drops queued ones of its type
+    - an UPDATE or PATCH merges with a queued one of the same type and data
+      type, unless a REWIND or another event of that data type is between
+
+    The new or merged event goes to the tail with the newest id, so ids
+    keep increasing. Stream stop events are never dropped, neither here
+    nor when the queue overflows, and replies are neither coalesced nor
+    dropped while there are other events to drop.
+    """
+
+    def __init__(self, maxsize: int = 0, coalesce: bool = False):
+        super().__init__(maxsize)
+        self.coalesce = coalesce
+
+    def absorb(self, event: Event) -> tuple[Event, int]:
+        """
+        Remove queued events made obsolete by event. Returns the event to
+        queue in their place and how many were removed.
+        """
+        if not self.coalesce or not self.q:
+            return event, 0
+        if isinstance(event, LoadEvent):
+            return event, self._remove(
+                lambda queued: isinstance(queued, DataTypedEvent)
+                and queued._data_type == event._data_type
+            )
+        if event._snapshot:
+            return event, self._remove(lambda queued: queued._type == event._type)
+        if isinstance(event, UpdateEvent):
+            index = self._merge_index(event)
+            if index is not None:
+                queued = self.q[index]
+                del self.q[index]
+                return event.merged_after(queued), 1
+        return event, 0
+
+    def drop_oldest(self) -> Event | None:
+        """
+        Drop the oldest event that isn't a stream stop. Replies to the
+        client's commands only go if nothing else is queued.
+        """
+        for kept in (
+            (EventType.STREAM_STOP, EventType.REPLY),
+            (EventType.STREAM_STOP,),
+        ):
+            for index, queued in enumerate(self.q):
+                if queued._type not in kept:
+                    del self.q[index]
+                    return queued
+        return None
+
+    @staticmethod
+    def in_snapshot(event: Event) -> bool:
+        """Whether a LOAD snapshot of the game state makes event obsolete"""
+        return isinstance(event, DataTypedEvent) or event._type in (
+            EventType.REWIND,
+            EventType.HEARTBEAT,
+        )
+
+    def restart_from(self, snapshot: Iterable[Event]) -> int:
+        """
+        Replace queued chart, news and rewind events with the snapshot,
+        ahead of the other events. Returns how many were dropped.
+        """
+        kept = [queued for queued in self.q if not self.in_snapshot(queued)]
+        dropped = len(self.q) - len(kept)
+        self.q.clear()
+        self.q.extend(snapshot)
+        self.q.extend(kept)
+        self._not_empty.set()
+        return dropped
+
+    def _remove(self, obsolete: Callable[[Event], bool]) -> int:
+        kept = [queued for queued in self.q if not obsolete(queued)]
+        removed = len(self.q) - len(kept)
+        if removed:
+            self.q.clear()
+            self.q.extend(kept)
+        return removed
+
+    def _merge_index(self, event: UpdateEvent) -> int | None:
+        """Index of the queued event the update can be merged with"""
+        for index in range(len(self.q) - 1, -1, -1):
+            queued = self.q[index]
+            if queued._type in (EventType.REWIND, EventType.STREAM_STOP):
+                return None
+            if (
+                isinstance(queued, DataTypedEvent)
+                and queued._data_type == event._data_type
+            ):
+                return index if queued._type == event._type else None
+        return None
+
+
+class FanoutStats:
+    """Counters for tuning subscriber buffer size and overflow policy"""
 
     def __init__(self):
+        self.events_dropped = 0
+        self.events_coalesced = 0
+        self.queues_coalesced = 0
+        self.subscribers_evicted = 0
+        self.stale_cleaned = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return {
+            "events_dropped": self.events_dropped,
+            "events_coalesced": self.events_coalesced,
+            "queues_coalesced": self.queues_coalesced,
+            "subscribers_evicted": self.subscribers_evicted,
+            "stale_cleaned": self.stale_cleaned,
+        }
+
+
+# Process-wide, rooms share it unless given their own
+FANOUT_STATS = FanoutStats()
+
+
+class Publisher:
+    """
+    Subscribers of one game room. Rooms have their own publishers, so a
+    broadcast only walks the subscribers of its room.
+    """
+
+    # Open publishers, walked by the shared cleanup and heartbeat tasks
+    _publishers: set["Publisher"] = set()
+
+    def __init__(self, stats: FanoutStats | None = None, metered: bool = True):
         self.subscribers: dict[UUID, "Subscriber"] = {}
+        self.stats = stats if stats is not None else FANOUT_STATS
+        # Whether subscribers and broadcasts count in the player metrics
+        self.metered = metered
+        # Returns LOAD events for the current game state, used to coalesce
+        # the backlog of a subscriber that fell behind
+        self.snapshot_provider: Callable[[], Iterable[Event]] | None = None
+        # SSE ids of broadcast events and the tail of them for resuming
+        self.last_event_id = 0
+        self.replay_log: deque[Event] = deque(maxlen=REPLAY_LOG_SIZE)
+        self.last_fanout_duration = 0.0
+        # Called when subscribers come and go or an event is broadcast
+        self.on_change: Callable[[], None] | None = None
+        Publisher._publishers.add(self)
 
     @classmethod
-    def instance(cls) -> "Publisher":
-        if cls._instance is None:
-            cls._instance = cls()
-        return cls._instance
+    def all(cls) -> list["Publisher"]:
+        return list(cls._publishers)
 
-    @classmethod
-    def subscribe(cls, subscriber: "Subscriber"):
-        cls.instance().subscribers[subscriber.uid] = subscriber
+    def close(self):
+        """Stop every subscriber and forget the publisher"""
+        self.stop_all()
+        self.replay_log.clear()
+        Publisher._publishers.discard(self)
 
-    @classmethod
-    def unsubscribe(cls, subscriber: "Subscriber"):
-        if subscriber.uid in cls.instance().subscribers:
-            cls.instance().subscribers.pop(subscriber.uid)
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
 
-    @classmethod
-    async def notify(cls, event: Event):
-        """Notify all subscribers with race condition protection"""
-        # Create a snapshot of subscribers to avoid race conditions
-        subscribers_snapshot = list(cls.instance().subscribers.values())
-
-        if not subscribers_snapshot:
-            return
-
-        try:
-            await asyncio.gather(
-                *[subscriber.update(event) for subscriber in subscribers_snapshot],
-                return_exceptions=True,  # Don't fail if one subscriber fails
-            )
-        except Exception as e:
-            # Log the error but don't crash the whole system
-            print(f"Error notifying subscribers: {e}")
+    def subscribe(self, subscriber: "Subscriber"):
+        subscriber.publisher = self
+        self.subscribers[subscriber.uid] = subscriber
+        self._changed()
 
-    @classmethod
-    async def notify_by_uid(cls, uid: UUID, event: Event):
-        if uid in cls.instance().subscribers:
-            await cls.instance().subscribers[uid].update(event)
+    def unsubscribe(self, subscriber: "Subscriber"):
+        if self.subscribers.pop(subscriber.uid, None) is not None:
+            self._changed()
 
-    @classmethod
-    async def cleanup_stale_subscribers(cls, timeout_seconds: int = 300):
-        """Remove subscribers that haven't been active recently"""
-        instance = cls.instance()
-        stale_uids = [
-            uid
-            for uid, subscriber in instance.subscribers.items()
+    def _deliver(self, subscriber: "Subscriber", event: Event):
+        if not subscriber.update(event):
+            self.unsubscribe(subscriber)
+            subscriber.stop()
+            self.stats.subscribers_evicted += 1
+            logger.info(f"Evicted slow subscriber: {subscriber.uid}")
+
+    def set_last_event_id(self, event_id: int):
+        """Continue numbering from another worker, own replay log is void"""
+        self.last_event_id = event_id
+        self.replay_log.clear()
+
+    def events_since(self, event_id: int) -> list[Event] | None:
+        """
+        Broadcast events after event_id, from the replay log.
+        None if the log doesn't cover the gap and a full snapshot is needed.
+        """
+        if event_id > self.last_event_id:
+            # Ids from before a server restart
+            return None
+        if event_id == self.last_event_id:
+            return []
+        log = self.replay_log
+        if not log or log[0].id > event_id + 1:
+            return None
+        return [event for event in log if event.id > event_id]
+
+    async def notify(self, event: Event, assign_id: bool = True):
+        """
+        Put event into every subscriber queue.
+        Never waits on a subscriber, slow ones are handled by overflow policy.
+        Events without id are not kept for Last-Event-ID resume.
+        """
+        started = time.perf_counter()
+        if assign_id or event.id is not None:
+            # Ids go on a copy sharing the encoded payload, so events the
+            # caller keeps, like the cached LOAD snapshot, never carry one
+            event = event.copy()
+        if assign_id:
+            self.last_event_id += 1
+            event.assign_id(self.last_event_id)
+            self.replay_log.append(event)
+
+        # Create a snapshot of subscribers, evictions change the dict
+        subscribers_snapshot = list(self.subscribers.values())
+
+        for subscriber in subscribers_snapshot:
+            try:
+                self._deliver(subscriber, event)
+            except Exception as e:
+                # Log the error but don't crash the whole system
+                logger.error(f"Error notifying subscriber {subscriber.uid}: {e}")
+
+        self.last_fanout_duration = time.perf_counter() - started
+        if self.metered:
+            EVENTS_PUBLISHED.inc(event._type, getattr(event, "_data_type", ""))
+            FANOUT_DURATION.observe(self.last_fanout_duration)
+        self._changed()
+
+    async def notify_by_uid(self, uid: UUID, event: Event):
+        if uid in self.subscribers:
+            self._deliver(self.subscribers[uid], event)
+
+    def cleanup_stale_subscribers(
+        self, timeout_seconds: int = SUBSCRIBER_TIMEOUT
+    ) -> int:
+        """
+        Remove and stop subscribers whose consumer hasn't taken an event
+        for too long. This single sweep replaces per-connection timeouts.
+        """
+        stale_subscribers = [
+            subscriber
+            for subscriber in self.subscribers.values()
             if subscriber.is_stale(timeout_seconds)
         ]
 
-        for uid in stale_uids:
-            instance.subscribers.pop(uid, None)
-            print(f"Cleaned up stale subscriber: {uid}")
+        for subscriber in stale_subscribers:
+            self.subscribers.pop(subscriber.uid, None)
+            subscriber.stop()
+            logger.info(f"Cleaned up stale subscriber: {subscriber.uid}")
+
+        self.stats.stale_cleaned += len(stale_subscribers)
+        if stale_subscribers:
+            self._changed()
+        return len(stale_subscribers)
+
+    def stop_all(self):
+        """Unsubscribe and stop every subscriber, ending their streams"""
+        for subscriber in list(self.subscribers.values()):
+            subscriber.stop()
+        self.subscribers.clear()
+
+    def queue_depths(self) -> list[int]:
+        return [len(s.events) for s in self.subscribers.values()]
 
-        return len(stale_uids)
+    @classmethod
+    def subscriber_count(cls) -> int:
+        return sum(len(p.subscribers) for p in cls._publishers if p.metered)
+
+    @classmethod
+    def all_queue_depths(cls) -> list[int]:
+        return [
+            depth for p in cls._publishers if p.metered for depth in p.queue_depths()
+        ]
+
+    @classmethod
+    async def start_heartbeat_task(cls):
+        """
+        Periodically put the shared heartbeat frame into idle subscriber
+        queues. One task for all rooms and connections, no per-connection
+        timers.
+        """
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            for publisher in cls.all():
+                for subscriber in list(publisher.subscribers.values()):
+                    if not subscriber.events:
+                        subscriber.update(HEARTBEAT)
 
     @classmethod
     async def start_cleanup_task(cls):
-        """Start periodic cleanup of stale subscribers"""
+        """Start periodic cleanup of stale subscribers in every room"""
         while True:
-            await asyncio.sleep(60)  # Check every minute
-            try:
-                await cls.cleanup_stale_subscribers()
-            except Exception as e:
-                print(f"Error in cleanup task: {e}")
+            await asyncio.sleep(CLEANUP_INTERVAL)
+            for publisher in cls.all():
+                try:
+                    publisher.cleanup_stale_subscribers()
+                except Exception as e:
+                    logger.error(f"Error in cleanup task: {e}")
 
 
 class Subscriber:
-    def __init__(self):
+    def __init__(
+        self,
+        queue_size: int = SUBSCRIBER_QUEUE_SIZE,
+        overflow_policy: str = SUBSCRIBER_OVERFLOW_POLICY,
+        wire_format: str = WireFormat.JSON,
+        transport: str = Transport.SSE,
+        coalesce: bool = SUBSCRIBER_COALESCE,
+    ):
         self.uid = uuid4()
-        self.events = EventQueue()
+        self.wire_format = wire_format
+        self.transport = transport
+        self.events = EventQueue(queue_size, coalesce)
+        self.overflow_policy = overflow_policy
         self._stopped = False
+        # Set by Publisher.subscribe
+        self.publisher: Publisher | None = None
+        # Last time the consumer took an event or its queue became non-empty
         self._last_activity = asyncio.get_event_loop().time()
 
     def stop(self):
         self._stopped = True
+        self.events.close()
 
-    async def update(self, event: Event):
-        """Update with activity tracking"""
-        self._last_activity = asyncio.get_event_loop().time()
-        try:
-            await self.events.put(event, 2.0)
-        except asyncio.TimeoutError:
-            # Mark as potentially dead if queue is full
-            print(f"Subscriber {self.uid} queue timeout - may be disconnected")
-
-    def is_stale(self, timeout_seconds: int = 300) -> bool:
-        """Check if subscriber has been inactive for too long"""
+    def update(self, event: Event) -> bool:
+        """
+        Queue event without waiting.
+        Returns False if the subscriber has to be disconnected.
+        """
+        stats = self.publisher.stats if self.publisher else FANOUT_STATS
+        event, absorbed = self.events.absorb(event)
+        stats.events_coalesced += absorbed
+        if self.events.full():
+            if self.overflow_policy == OverflowPolicy.DISCONNECT:
+                return False
+            if self.overflow_policy == OverflowPolicy.COALESCE and self._coalesce(
+                event
+            ):
+                stats.queues_coalesced += 1
+                return True
+            if self.events.drop_oldest() is not None:
+                stats.events_dropped += 1
+        elif not self.events:
+            # Consumer was idle, staleness is counted from now
+            self._last_activity = asyncio.get_event_loop().time()
+        self.events.put_nowait(event)
+        return True
+
+    def _coalesce(self, event: Event) -> bool:
+        """
+        Replace the queued chart and news events with a fresh LOAD snapshot
+        of the game state. Fills, replies, stops and the like are kept.
+        """
+        provider = self.publisher and self.publisher.snapshot_provider
+        if provider is None:
+            return False
+        events = self.events
+        snapshot = list(provider())
+        keep_event = not events.in_snapshot(event)
+        if len(snapshot) + keep_event > sum(map(events.in_snapshot, events.q)):
+            # The snapshot frees no room, the oldest event is dropped instead
+            return False
+        self.publisher.stats.events_dropped += events.restart_from(snapshot)
+        if keep_event:
+            events.put_nowait(event)
+        return True
+
+    def is_stale(self, timeout_seconds: int = SUBSCRIBER_TIMEOUT) -> bool:
+        """
+        Subscriber is stale if events are waiting and its consumer hasn't
+        taken any for too long. Idle subscribers with empty queues are fine.
+        """
+        if not self.events:
+            return False
         current_time = asyncio.get_event_loop().time()
         return (current_time - self._last_activity) > timeout_seconds
 
     async def listen(self):
+        """
+        Wait for events without any timers, stop() wakes it up.
+        Yields the event's SSE frame or WebSocket message, both encoded
+        once per event.
+        """
+        websocket = self.transport == Transport.WEBSOCKET
         while not self._stopped:
-            try:
-                event = await self.events.get(2.0)
-            except asyncio.TimeoutError:
-                continue
-            if event._type == EventType.STREAM_STOP:
+            event = await self.events.get()
+            if event is None or event._type == EventType.STREAM_STOP:
                 return
-            yield event.dump()
+            self._last_activity = asyncio.get_event_loop().time()
+            if websocket:
+                message = event.message_for(self.wire_format)
+                if message is not None:
+                    yield message
+            else:
+                yield event.frame_for(self.wire_format)
+
+
+REGISTRY.register(
+    Gauge(
+        "stock_sim_subscribers_active",
+        "Connected subscribers",
+        Publisher.subscriber_count,
+    )
+)
+REGISTRY.register(
+    Gauge(
+        "stock_sim_subscriber_queue_depth_total",
+        "Events waiting in all subscriber queues",
+        lambda: sum(Publisher.all_queue_depths()),
+    )
+)
+REGISTRY.register(
+    Gauge(
+        "stock_sim_subscriber_queue_depth_max",
+        "Events waiting in the fullest subscriber queue",
+        lambda: max(Publisher.all_queue_depths(), default=0),
+    )
+)
+for _name, _documentation in (
+    ("events_dropped", "Events dropped from full subscriber queues"),
+    ("events_coalesced", "Queued events replaced by newer ones"),
+    ("queues_coalesced", "Full subscriber queues replaced by a LOAD snapshot"),
+    ("subscribers_evicted", "Subscribers disconnected for a full queue"),
+    ("stale_cleaned", "Subscribers removed by the stale cleanup task"),
+):
+    REGISTRY.register(
+        CallbackCounter(
+            f"stock_sim_{_name}_total",
+            _documentation,
+            lambda _name=_name: getattr(FANOUT_STATS, _name),
+        )
+    )
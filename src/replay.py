@@ -0,0 +1,314 @@
+"""
+Headless replay: drive a room through a timeline of game commands at N×
+speed, with thousands of in-process subscribers and no HTTP. Checks that
+every subscriber got increasing event ids and ended up with the same chart
+and news as a subscriber that missed nothing, and reports fan-out
+throughput. --slow subscribers take --lag seconds per event, so their
+queues coalesce.
+
+Timelines:
+- default, the scenario played like the scheduler does: a chart step
+  every --interval seconds and its news --news-delay seconds later
+- --timeline FILE, a JSON list of [seconds, op, args] entries, op being
+  one of StockMarketController.REPLICATED_OPS
+- --journal DIR, commands recorded by the journal for --room, starting
+  from its snapshot and spaced --interval seconds apart
+
+    python src/replay.py --subscribers 5000 --speed 0
+    python src/replay.py --journal journal --speed 100
+
+Exits with status 1 if any subscriber ended up with a different state.
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import orjson
+
+from broker import LocalBroker
+from config import (
+    SCENARIO_FILE,
+    SCHEDULE_NEWS_DELAY,
+    SCHEDULE_ROUND_INTERVAL,
+    SUBSCRIBER_QUEUE_SIZE,
+)
+from events import DataTypedEvent, EventType, WireFormat
+from journal import Journal
+from pubsub import FanoutStats, Subscriber
+from rooms import Room, Rooms
+from scenario import Scenario
+
+logger = logging.getLogger(__name__)
+
+# Timeline commands the replay drives itself
+_SKIPPED_OPS = {"schedule_start", "schedule_pause", "schedule_resume", "schedule_stop"}
+
+
+class Probe:
+    """
+    Consumer of one subscriber, applies chart and news events like the
+    client does and keeps a fingerprint of the sequence it got
+    """
+
+    def __init__(self, subscriber: Subscriber, lag: float = 0):
+        self.subscriber = subscriber
+        self.lag = lag
+        self.state = {}
+        self.events = 0
+        self.bytes = 0
+        self.digest = 0
+        self.last_id = 0
+        self.out_of_order = 0
+        self.stopped = False
+
+    async def consume(self):
+        subscriber = self.subscriber
+        while True:
+            event = await subscriber.events.get()
+            if event is None:
+                return
+            self.events += 1
+            self.bytes += len(event.frame_for(subscriber.wire_format))
+            if event.id is not None:
+                if event.id <= self.last_id:
+                    self.out_of_order += 1
+                self.last_id = event.id
+            self.digest = hash((self.digest, event.id, event._type))
+            self.apply(event)
+            if event._type == EventType.STREAM_STOP:
+                self.stopped = True
+                return
+            if self.lag:
+                await asyncio.sleep(self.lag)
+
+    def apply(self, event):
+        if isinstance(event, DataTypedEvent):
+            if event._type == EventType.LOAD:
+                self.state[event._data_type] = dict(event.data)
+            else:
+                self.state.setdefault(event._data_type, {}).update(event.data)
+        elif event._type == EventType.REWIND:
+            for data_type, step in (
+                ("chart", event.data["chart_step"]),
+                ("news", event.data["news_step"]),
+            ):
+                rounds = self.state.get(data_type, {})
+                for round_number in [r for r in rounds if int(r) > step]:
+                    del rounds[round_number]
+
+
+def scenario_timeline(
+    scenario: Scenario, interval: float, news_delay: float | None
+) -> list[tuple[float, str, list]]:
+    """Rounds as the scheduler plays them, then the end of the game"""
+    timeline = []
+    for step in range(1, len(scenario.data)):
+        at = step * interval
+        timeline += [
+            (at, "next_chart_step", []),
+            (at, "publish_current_chart_data", []),
+        ]
+        if news_delay is not None:
+            timeline.append((at + news_delay, "publish_current_news", []))
+    timeline.append((len(scenario.data) * interval, "publish_stop_game", []))
+    return timeline
+
+
+def file_timeline(path: Path) -> list[tuple[float, str, list]]:
+    return [(at, op, args) for at, op, args in orjson.loads(path.read_bytes())]
+
+
+def journal_timeline(
+    path: Path, room: str, interval: float
+) -> tuple[dict | None, list[tuple[float, str, list]]]:
+    """State of the room in the journal's snapshot and its later commands"""
+    state = None
+    first_segment = 0
+    snapshot_path = path / Journal.SNAPSHOT_FILE
+    if snapshot_path.exists():
+        snapshot = orjson.loads(snapshot_path.read_bytes())
+        first_segment = snapshot["segment"]
+        state = snapshot["state"]["rooms"].get(room)
+
+    commands = []
+    for segment_path in sorted(
+        path.glob("segment-*.log"),
+        key=lambda p: int(p.stem.removeprefix("segment-")),
+    ):
+        if int(segment_path.stem.removeprefix("segment-")) < first_segment:
+            continue
+        for line in segment_path.read_bytes().splitlines():
+            try:
+                op, args = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue
+            if op in ("create_room", "close_room") or not args or args[0] != room:
+                continue
+            commands.append((len(commands) * interval, op, args[1:]))
+    return state, commands
+
+
+async def replay(
+    timeline: list[tuple[float, str, list]],
+    subscribers: int,
+    speed: float,
+    scenario: Scenario,
+    state: dict | None = None,
+    queue_size: int = SUBSCRIBER_QUEUE_SIZE,
+    slow: int = 0,
+    lag: float = 0.01,
+) -> dict:
+    """
+    Play the timeline at speed× (0 for as fast as possible) and return
+    the report
+    """
+
+    async def apply(op: str, args: list):
+        return await room.controller.apply(op, args[1:])
+
+    async def load_state(_state: dict):
+        pass
+
+    room = Room(Rooms.DEFAULT, LocalBroker(apply, dict, load_state), scenario)
+    controller = room.controller
+    if state is not None:
+        await controller.load_state(state)
+    stats = room.publisher.stats = FanoutStats()
+
+    # Unbounded and uncoalesced reference, every probe has to match it
+    reference = Probe(Subscriber(queue_size=0, coalesce=False))
+    probes = [
+        Probe(
+            Subscriber(
+                queue_size=queue_size,
+                wire_format=WireFormat.COMPACT if i % 2 else WireFormat.JSON,
+            ),
+            lag if i < slow else 0,
+        )
+        for i in range(subscribers)
+    ]
+    for probe in (reference, *probes):
+        room.publisher.subscribe(probe.subscriber)
+    tasks = [asyncio.create_task(probe.consume()) for probe in (reference, *probes)]
+
+    loop = asyncio.get_running_loop()
+    command_durations = []
+    lateness = []
+    started = loop.time()
+    cpu_started = time.process_time()
+    for at, op, args in timeline:
+        if op in _SKIPPED_OPS:
+            continue
+        if speed > 0:
+            due = started + at / speed
+            if due > loop.time():
+                await asyncio.sleep(due - loop.time())
+            lateness.append(loop.time() - due)
+        command_started = time.perf_counter()
+        try:
+            await controller.dispatch(op, *args)
+        except Exception as e:
+            logger.error(f"Command {op} failed: {e}")
+        command_durations.append(time.perf_counter() - command_started)
+        # Let subscribers drain their queues, as a network would
+        await asyncio.sleep(0)
+    if not timeline or timeline[-1][1] != "publish_stop_game":
+        await controller.publish_stop_game()
+    await asyncio.wait(tasks, timeout=30 + (lag * len(timeline) * 2 if slow else 0))
+    elapsed = loop.time() - started
+    cpu = time.process_time() - cpu_started
+    for probe in (reference, *probes):
+        probe.subscriber.stop()
+    room.controller.leaderboard.close()
+    room.dashboard.close()
+
+    consistent = sum(probe.state == reference.state for probe in probes)
+    identical = sum(
+        probe.digest == reference.digest and probe.events == reference.events
+        for probe in probes
+    )
+    delivered = sum(probe.events for probe in probes)
+    delivered_bytes = sum(probe.bytes for probe in probes)
+    ordered = sorted(command_durations) or [0.0]
+    return {
+        "commands": len(command_durations),
+        "subscribers": subscribers,
+        "events_broadcast": room.publisher.last_event_id,
+        "events_per_subscriber": reference.events,
+        "events_delivered": delivered,
+        "elapsed_s": round(elapsed, 3),
+        "cpu_s": round(cpu, 3),
+        "events_per_s": round(delivered / elapsed) if elapsed else None,
+        "mb_per_s": round(delivered_bytes / elapsed / 1e6, 2) if elapsed else None,
+        "command_ms": {
+            "p50": round(statistics.median(ordered) * 1000, 3),
+            "p99": round(ordered[int((len(ordered) - 1) * 0.99)] * 1000, 3),
+            "max": round(ordered[-1] * 1000, 3),
+        },
+        "max_lateness_ms": round(max(lateness) * 1000, 3) if lateness else None,
+        "consistent_subscribers": consistent,
+        "identical_sequences": identical,
+        "out_of_order_events": sum(probe.out_of_order for probe in probes),
+        "unfinished_subscribers": sum(not probe.stopped for probe in probes),
+        "events_dropped": stats.events_dropped,
+        "events_coalesced": stats.events_coalesced,
+        "queues_coalesced": stats.queues_coalesced,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay a game headlessly and check fan-out consistency"
+    )
+    parser.add_argument("--scenario", type=Path, default=SCENARIO_FILE)
+    parser.add_argument("--subscribers", type=int, default=2000)
+    parser.add_argument(
+        "--speed", type=float, default=0, help="N× real time, 0 for no waiting"
+    )
+    parser.add_argument("--timeline", type=Path)
+    parser.add_argument("--journal", type=Path)
+    parser.add_argument("--room", default=Rooms.DEFAULT)
+    parser.add_argument("--interval", type=float, default=SCHEDULE_ROUND_INTERVAL)
+    parser.add_argument("--news-delay", type=float, default=SCHEDULE_NEWS_DELAY)
+    parser.add_argument("--queue-size", type=int, default=SUBSCRIBER_QUEUE_SIZE)
+    parser.add_argument("--slow", type=int, default=0)
+    parser.add_argument("--lag", type=float, default=0.01)
+    args = parser.parse_args()
+
+    scenario = Scenario.load(args.scenario)
+    state = None
+    if args.journal:
+        state, timeline = journal_timeline(args.journal, args.room, args.interval)
+    elif args.timeline:
+        timeline = file_timeline(args.timeline)
+    else:
+        timeline = scenario_timeline(scenario, args.interval, args.news_delay)
+
+    report = asyncio.run(
+        replay(
+            timeline,
+            args.subscribers,
+            args.speed,
+            scenario,
+            state,
+            args.queue_size,
+            args.slow,
+            args.lag,
+        )
+    )
+    print(orjson.dumps(report, option=orjson.OPT_INDENT_2).decode())
+    if (
+        report["consistent_subscribers"] != report["subscribers"]
+        or report["out_of_order_events"]
+        or report["unfinished_subscribers"]
+    ):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Game rooms: every room has its own StockMarket, Publisher and replay log,
+so a broadcast only reaches the subscribers of its room. Rooms playing
+the same scenario share its read-only prices and news.
+"""
+
+import logging
+import re
+from pathlib import Path
+
+from broker import Broker, create_broker
+from config import JOURNAL_DIR, MAX_ROOMS
+from dashboard import Dashboard
+from events import StopStreamEvent
+from journal import Journal
+from pubsub import Publisher
+from stock import Scenario, StockMarket, StockMarketController
+
+logger = logging.getLogger(__name__)
+
+ROOM_NAME = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+class Room:
+    def __init__(self, name: str, broker: Broker, scenario: Scenario | None = None):
+        self.name = name
+        self.publisher = Publisher()
+        self.controller = StockMarketController(
+            name, StockMarket(scenario), self.publisher, broker
+        )
+        self.dashboard = Dashboard(self)
+        self.publisher.on_change = self.dashboard.changed
+        self.controller.on_change = self.dashboard.changed
+
+    @property
+    def stock(self) -> StockMarket:
+        return self.controller.stock
+
+    async def close(self):
+        """End every stream of the room and drop its state"""
+        self.controller.scheduler.stop()
+        await self.publisher.notify(StopStreamEvent())
+        self.publisher.close()
+        self.dashboard.close()
+        self.controller.leaderboard.close()
+
+
+class Rooms:
+    """
+    Rooms of this process. Creating and closing rooms goes through the
+    same broker as game commands, so every worker hosts the same rooms.
+    The default room always exists and serves the room-less routes.
+    """
+
+    DEFAULT = "default"
+
+    _rooms: dict[str, Room] = {}
+    _broker: Broker = None
+    _journal: Journal | None = None
+
+    @classmethod
+    def broker(cls) -> Broker:
+        if cls._broker is None:
+            cls._broker = create_broker(cls.apply, cls.dump_state, cls.load_state)
+        return cls._broker
+
+    @classmethod
+    def journal(cls) -> Journal | None:
+        """None if game state is kept in memory only"""
+        if cls._journal is None and JOURNAL_DIR:
+            cls._journal = Journal(
+                Path(JOURNAL_DIR),
+                cls._apply,
+                cls.dump_state,
+                cls.load_state,
+                lambda: cls.broker().is_leader,
+            )
+        return cls._journal
+
+    @classmethod
+    def default(cls) -> Room:
+        if cls.DEFAULT not in cls._rooms:
+            cls._create_room(cls.DEFAULT)
+        return cls._rooms[cls.DEFAULT]
+
+    @classmethod
+    def get(cls, name: str) -> Room | None:
+        if name == cls.DEFAULT:
+            return cls.default()
+        return cls._rooms.get(name)
+
+    @classmethod
+    def all(cls) -> list[Room]:
+        return list(cls._rooms.values())
+
+    @classmethod
+    async def create(cls, name: str) -> Room:
+        if not ROOM_NAME.fullmatch(name):
+            raise ValueError("Room name must be 1-64 letters, digits, '-' or '_'")
+        if name == cls.DEFAULT or name in cls._rooms:
+            raise ValueError(f"Room {name} already exists")
+        if len(cls._rooms) >= MAX_ROOMS:
+            raise ValueError(f"Room limit of {MAX_ROOMS} reached")
+        await cls.broker().dispatch("create_room", name)
+        return cls._rooms[name]
+
+    @classmethod
+    async def close(cls, name: str):
+        if name == cls.DEFAULT:
+            raise ValueError("The default room can't be closed")
+        if name not in cls._rooms:
+            raise KeyError(f"Unknown room: {name}")
+        await cls.broker().dispatch("close_room", name)
+
+    @classmethod
+    def stop_all(cls):
+        """Stop the subscribers of every room, on shutdown"""
+        for room in cls.all():
+            room.publisher.stop_all()
+
+    @classmethod
+    def _create_room(cls, name: str) -> Room:
+        if name not in cls._rooms:
+            cls._rooms[name] = Room(name, cls.broker())
+            logger.info(f"Room {name} created")
+        return cls._rooms[name]
+
+    @classmethod
+    async def _close_room(cls, name: str):
+        room = cls._rooms.pop(name, None)
+        if room is not None:
+            await room.close()
+            logger.info(f"Room {name} closed")
+
+    @classmethod
+    async def apply(cls, op: str, args: list):
+        """Broker callback, journals every applied command"""
+        result = await cls._apply(op, args)
+        journal = cls.journal()
+        if journal is not None:
+            journal.append(op, args)
+        return result
+
+    @classmethod
+    async def _apply(cls, op: str, args: list):
+        """Game commands carry their room as first argument"""
+        if op == "create_room":
+            cls._create_room(*args)
+            return None
+        if op == "close_room":
+            await cls._close_room(*args)
+            return None
+        name, *args = args
+        room = cls.get(name)
+        if room is None:
+            raise KeyError(f"Unknown room: {name}")
+        return await room.controller.apply(op, args)
+
+    @classmethod
+    def dump_state(cls) -> dict:
+        return {
+            "rooms": {
+                name: room.controller.dump_state() for name, room in cls._rooms.items()
+            }
+        }
+
+    @classmethod
+    async def load_state(cls, state: dict):
+        """Adopt rooms of another worker and reload local subscribers"""
+        for name in set(cls._rooms) - set(state["rooms"]) - {cls.DEFAULT}:
+            await cls._close_room(name)
+        for name, room_state in state["rooms"].items():
+            await cls._create_room(name).controller.load_state(room_state)
@@ -0,0 +1,191 @@
+"""
+Game scenarios: chart prices and news of every round, read-only and
+shared by all rooms playing them.
+
+Two file formats:
+- chart_data.json, {"round": {"chart": {currency: price}, "news": [...]}}
+- binary scenario, memory-mapped so opening it is O(1) in its size:
+
+    magic        8 bytes  b"SMSCEN01"
+    header size  uint32 LE
+    header       orjson {"currencies": [...], "rounds": n, "byteorder": ...}
+    padding      to 8 bytes
+    prices       int64, one column of n rounds per currency
+    news index   n + 1 uint64 offsets into the news table
+    news table   orjson array of news strings per round
+
+Convert with:
+
+    python src/scenario.py src/chart_data.json -o src/scenario.bin
+"""
+
+import argparse
+import mmap
+import struct
+import sys
+from array import array
+from collections.abc import Sequence
+from pathlib import Path
+
+import orjson
+
+from prices import PriceStore
+
+MAGIC = b"SMSCEN01"
+_HEADER_SIZE = struct.Struct("<I")
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+class NewsTable(Sequence):
+    """News of a binary scenario, each round decoded when accessed"""
+
+    def __init__(self, index: memoryview, table: memoryview):
+        self.index = index
+        self.table = table
+
+    def __len__(self) -> int:
+        return len(self.index) - 1
+
+    def __getitem__(self, step):
+        if isinstance(step, slice):
+            return [self[i] for i in range(*step.indices(len(self)))]
+        if step < 0:
+            step += len(self)
+        if not 0 <= step < len(self):
+            raise IndexError("news round out of range")
+        return orjson.loads(self.table[self.index[step] : self.index[step + 1]])
+
+
+class Scenario:
+    """
+    Read-only chart data and news. Rooms playing the same scenario share
+    it and copy prices or news on their first edit.
+    """
+
+    # Scenarios opened from files, by resolved path
+    _loaded: dict[Path, "Scenario"] = {}
+
+    def __init__(
+        self,
+        data: PriceStore,
+        news: Sequence[list[str]],
+        path: str | None = None,
+    ):
+        self.data = data
+        self.news = news
+        # File the scenario was opened from, lets state dumps refer to it
+        self.path = path
+        self._mmap: mmap.mmap | None = None
+
+    @classmethod
+    def load(cls, path: Path) -> "Scenario":
+        """Open a JSON or binary scenario, once per process"""
+        path = Path(path).resolve()
+        if path not in cls._loaded:
+            if path.suffix == ".json":
+                cls._loaded[path] = cls.from_json(path)
+            else:
+                cls._loaded[path] = cls.from_binary(path)
+        return cls._loaded[path]
+
+    @classmethod
+    def from_json(cls, chart_file: Path) -> "Scenario":
+        """Load both chart data and news from file once to avoid duplicate reads"""
+        if not chart_file.exists():
+            raise FileNotFoundError(f"Chart data file not found: {chart_file}")
+
+        try:
+            with open(chart_file, "r", encoding="utf-8") as f:
+                js = orjson.loads(f.read())
+
+            # Currencies and their order come from round 0
+            currencies = list(js["0"]["chart"])
+            chart_data = PriceStore.from_rounds(
+                (data["chart"] for data in js.values()), currencies
+            )
+            news_data = [data["news"] or [] for data in js.values()]
+
+            return cls(chart_data, news_data, str(chart_file))
+
+        except orjson.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON in chart data file: {e}")
+        except KeyError as e:
+            raise ValueError(f"Missing required key in chart data: {e}")
+        except IOError as e:
+            raise IOError(f"Failed to read chart data file: {e}")
+
+    @classmethod
+    def from_binary(cls, path: Path) -> "Scenario":
+        """Map the file, prices and news are read from it on access"""
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(mapped)
+        if buffer[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a binary scenario file: {path}")
+
+        offset = len(MAGIC)
+        (header_size,) = _HEADER_SIZE.unpack_from(buffer, offset)
+        offset += _HEADER_SIZE.size
+        header = orjson.loads(buffer[offset : offset + header_size])
+        offset = _align(offset + header_size)
+
+        rounds = header["rounds"]
+        columns = []
+        for _ in header["currencies"]:
+            column = buffer[offset : offset + rounds * 8].cast("q")
+            if header["byteorder"] != sys.byteorder:
+                column = array("q", column.tobytes())
+                column.byteswap()
+            columns.append(column)
+            offset += rounds * 8
+
+        index = buffer[offset : offset + (rounds + 1) * 8].cast("Q")
+        if header["byteorder"] != sys.byteorder:
+            index = array("Q", index.tobytes())
+            index.byteswap()
+        offset += (rounds + 1) * 8
+
+        data = PriceStore(header["currencies"])
+        data.columns = columns
+        scenario = cls(data, NewsTable(index, buffer[offset:]), str(path))
+        scenario._mmap = mapped
+        return scenario
+
+    def write_binary(self, path: Path):
+        header = orjson.dumps(
+            {
+                "currencies": self.data.currencies,
+                "rounds": len(self.data),
+                "byteorder": sys.byteorder,
+            }
+        )
+        news = [orjson.dumps(list(round_news)) for round_news in self.news]
+        news += [b"[]"] * (len(self.data) - len(news))
+        index = array("Q", [0])
+        for round_news in news:
+            index.append(index[-1] + len(round_news))
+
+        with open(path, "wb") as f:
+            f.write(MAGIC + _HEADER_SIZE.pack(len(header)) + header)
+            f.write(b"\0" * (_align(f.tell()) - f.tell()))
+            for column in self.data.columns:
+                f.write(column.tobytes())
+            f.write(index.tobytes())
+            f.writelines(news)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a chart_data.json scenario to the binary format"
+    )
+    parser.add_argument("source", type=Path)
+    parser.add_argument("-o", "--output", type=Path, required=True)
+    args = parser.parse_args()
+    Scenario.from_json(args.source).write_binary(args.output)
+
+
+if __name__ == "__main__":
+    main()
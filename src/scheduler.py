@@ -0,0 +1,250 @@
+"""
+Automatic rounds: every room can run a timeline of chart steps every
+round_interval seconds and news news_delay seconds after each chart step.
+"""
+
+import asyncio
+import logging
+import statistics
+from collections import deque
+from typing import TYPE_CHECKING
+
+from config import SCHEDULE_JITTER_SAMPLES
+from metrics import SCHEDULER_JITTER
+
+if TYPE_CHECKING:
+    from stock import StockMarketController
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduleState:
+    STOPPED = "stopped"
+    RUNNING = "running"
+    PAUSED = "paused"
+
+
+class RoundScheduler:
+    """
+    Timeline of one room.
+
+    Deadlines advance by the configured intervals from the previous
+    deadline, not from the time an action actually ran, so delays don't
+    accumulate. With several workers every worker keeps the timeline, only
+    the broker leader acts on it, so a new leader continues on time.
+    """
+
+    # Schedulers of every room, served by a single timer task
+    _schedulers: set["RoundScheduler"] = set()
+    _changed: asyncio.Event | None = None
+    _tasks: set[asyncio.Task] = set()
+
+    def __init__(self, controller: "StockMarketController"):
+        self.controller = controller
+        self.state = ScheduleState.STOPPED
+        self.round_interval = 0.0
+        self.news_delay: float | None = None
+        self.finish_game = False
+        # Loop times of the next chart step and of pending news
+        self._next_chart_at = 0.0
+        self._news_at: float | None = None
+        self._paused_at: float | None = None
+        # Seconds between scheduled and completed publish
+        self.jitter: deque[float] = deque(maxlen=SCHEDULE_JITTER_SAMPLES)
+        self.rounds_run = 0
+
+    @staticmethod
+    def _now() -> float:
+        return asyncio.get_event_loop().time()
+
+    @classmethod
+    def _wake(cls):
+        if cls._changed is not None:
+            cls._changed.set()
+
+    def start(
+        self,
+        round_interval: float,
+        news_delay: float | None = None,
+        finish_game: bool = False,
+        start_delay: float = 0.0,
+    ):
+        """
+        Start the timeline, first chart step after start_delay.
+        On a running timeline only the settings change: the next chart
+        step moves to the previous one plus the new interval.
+        """
+        if round_interval <= 0:
+            raise ValueError("Round interval must be positive")
+        if news_delay is not None and not 0 <= news_delay < round_interval:
+            raise ValueError("News delay must be between 0 and the round interval")
+
+        now = self._now()
+        if self.state == ScheduleState.STOPPED:
+            self._next_chart_at = now + start_delay
+            self._news_at = None
+            self.rounds_run = 0
+        else:
+            self._next_chart_at += round_interval - self.round_interval
+        self.round_interval = round_interval
+        self.news_delay = news_delay
+        self.finish_game = finish_game
+        if self.state == ScheduleState.STOPPED:
+            self.state = ScheduleState.RUNNING
+        RoundScheduler._schedulers.add(self)
+        self._wake()
+
+    def pause(self):
+        if self.state == ScheduleState.RUNNING:
+            self.state = ScheduleState.PAUSED
+            self._paused_at = self._now()
+
+    def resume(self):
+        """Continue the timeline shifted by the time spent paused"""
+        if self.state != ScheduleState.PAUSED:
+            return
+        paused_for = self._now() - self._paused_at
+        self._next_chart_at += paused_for
+        if self._news_at is not None:
+            self._news_at += paused_for
+        self._paused_at = None
+        self.state = ScheduleState.RUNNING
+        self._wake()
+
+    def stop(self):
+        self.state = ScheduleState.STOPPED
+        self._news_at = None
+        RoundScheduler._schedulers.discard(self)
+
+    def next_deadline(self) -> float | None:
+        if self.state != ScheduleState.RUNNING:
+            return None
+        if self._news_at is not None:
+            return min(self._news_at, self._next_chart_at)
+        return self._next_chart_at
+
+    def _take_due_action(self, now: float) -> tuple[str, float] | None:
+        """Advance the timeline past the next due action and return it"""
+        deadline = self.next_deadline()
+        if deadline is None or deadline > now:
+            return None
+        if self._news_at is not None and self._news_at <= self._next_chart_at:
+            self._news_at = None
+            return "news", deadline
+
+        if self.news_delay is not None:
+            self._news_at = self._next_chart_at + self.news_delay
+        self._next_chart_at += self.round_interval
+        if self._next_chart_at < now:
+            # Stalled for more than a round, continue from now instead of
+            # firing the missed rounds back to back
+            logger.warning(f"Scheduler of room {self.controller.room} fell behind")
+            self._next_chart_at = now + self.round_interval
+        return "chart", deadline
+
+    async def _run_action(self, action: str, scheduled: float):
+        controller = self.controller
+        try:
+            if action == "news":
+                await controller.publish_current_news()
+            elif await controller.next_chart_step():
+                await controller.publish_current_chart_data()
+                self.rounds_run += 1
+            else:
+                # Out of rounds, news of the last one went out a round ago
+                await self._finish()
+                return
+        except Exception as e:
+            logger.error(f"Scheduled {action} in room {controller.room} failed: {e}")
+            return
+
+        jitter = self._now() - scheduled
+        self.jitter.append(jitter)
+        SCHEDULER_JITTER.observe(jitter)
+
+    async def _finish(self):
+        await self.controller.schedule_stop()
+        if self.finish_game:
+            await self.controller.publish_stop_game()
+
+    def report(self) -> dict:
+        """Settings, state and jitter percentiles in milliseconds"""
+        ordered = sorted(self.jitter)
+        jitter = {"samples": len(ordered)}
+        if ordered:
+            jitter |= {
+                "p50_ms": round(statistics.median(ordered) * 1000, 3),
+                "p99_ms": round(ordered[int((len(ordered) - 1) * 0.99)] * 1000, 3),
+                "max_ms": round(ordered[-1] * 1000, 3),
+            }
+        deadline = self.next_deadline()
+        return {
+            "state": self.state,
+            "round_interval": self.round_interval,
+            "news_delay": self.news_delay,
+            "finish_game": self.finish_game,
+            "rounds_run": self.rounds_run,
+            "next_action_in": (
+                round(max(deadline - self._now(), 0), 3)
+                if deadline is not None
+                else None
+            ),
+            "jitter": jitter,
+        }
+
+    def dump_state(self) -> dict:
+        """Deadlines relative to now, loop times differ between workers"""
+        now = self._paused_at if self._paused_at is not None else self._now()
+        return {
+            "state": self.state,
+            "round_interval": self.round_interval,
+            "news_delay": self.news_delay,
+            "finish_game": self.finish_game,
+            "next_chart_in": self._next_chart_at - now,
+            "news_in": None if self._news_at is None else self._news_at - now,
+        }
+
+    def load_state(self, state: dict):
+        now = self._now()
+        self.state = state["state"]
+        self.round_interval = state["round_interval"]
+        self.news_delay = state["news_delay"]
+        self.finish_game = state["finish_game"]
+        self._next_chart_at = now + state["next_chart_in"]
+        self._news_at = None if state["news_in"] is None else now + state["news_in"]
+        self._paused_at = now if self.state == ScheduleState.PAUSED else None
+        if self.state == ScheduleState.STOPPED:
+            RoundScheduler._schedulers.discard(self)
+        else:
+            RoundScheduler._schedulers.add(self)
+            self._wake()
+
+    @classmethod
+    async def start_scheduler_task(cls):
+        """
+        One timer for the timelines of all rooms. Due actions run as
+        their own tasks, so a room's fan-out never delays another room.
+        """
+        cls._changed = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        while True:
+            now = loop.time()
+            for scheduler in list(cls._schedulers):
+                while due := scheduler._take_due_action(now):
+                    # Followers only keep time, the leader publishes
+                    if scheduler.controller.broker.is_leader:
+                        task = asyncio.create_task(scheduler._run_action(*due))
+                        cls._tasks.add(task)
+                        task.add_done_callback(cls._tasks.discard)
+
+            deadlines = [
+                deadline
+                for scheduler in cls._schedulers
+                if (deadline := scheduler.next_deadline()) is not None
+            ]
+            cls._changed.clear()
+            timeout = max(min(deadlines) - loop.time(), 0) if deadlines else None
+            try:
+                await asyncio.wait_for(cls._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,127 @@
+"""
+Frontend pages rendered and compressed once, served from memory with an
+ETag so repeat visits get a 304. With STATIC_DEV_RELOAD a page is rebuilt
+when its file changes.
+"""
+
+import gzip
+import hashlib
+import logging
+from pathlib import Path
+from typing import Callable
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+
+from config import STATIC_DEV_RELOAD
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+def _accepted_encodings(header: str) -> set[str]:
+    """Codings of an Accept-Encoding header, without those with q=0"""
+    encodings = set()
+    for part in header.split(","):
+        name, *params = part.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+class StaticPage:
+    def __init__(
+        self,
+        path: Path,
+        cache_control: str,
+        render: Callable[[str], str] | None = None,
+        media_type: str = "text/html; charset=utf-8",
+    ):
+        self.path = path
+        self.cache_control = cache_control
+        # Applied once to the file content, e.g. to inject settings
+        self.render = render
+        self.media_type = media_type
+        self._mtime: float | None = None
+        # Content-Encoding (None for identity) -> body
+        self._bodies: dict[str | None, bytes] = {}
+        self._etags: dict[str | None, str] = {}
+
+    def load(self):
+        """Render and compress the page, raises OSError if it can't be read"""
+        mtime = self.path.stat().st_mtime
+        content = self.path.read_text(encoding="utf-8")
+        if self.render is not None:
+            content = self.render(content)
+
+        body = content.encode()
+        digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+        self._bodies = {None: body, "gzip": gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            self._bodies["br"] = brotli.compress(body, quality=11)
+        # Each encoding is a representation of its own, with its own tag
+        self._etags = {
+            encoding: f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+            for encoding in self._bodies
+        }
+        self._mtime = mtime
+        logger.info(
+            f"Loaded {self.path.name}: "
+            + ", ".join(
+                f"{encoding or 'identity'} {len(data)} B"
+                for encoding, data in self._bodies.items()
+            )
+        )
+
+    def _ensure_loaded(self):
+        if self._mtime is None:
+            self.load()
+        elif STATIC_DEV_RELOAD and self.path.stat().st_mtime != self._mtime:
+            self.load()
+
+    def response(self, request: Request) -> Response:
+        try:
+            self._ensure_loaded()
+        except OSError as e:
+            logger.error(f"Failed to load {self.path}: {e}")
+            raise HTTPException(status_code=404, detail=f"{self.path.name} not found")
+
+        accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+        encoding = next(
+            (
+                encoding
+                for encoding in ("br", "gzip")
+                if encoding in self._bodies and encoding in accepted
+            ),
+            None,
+        )
+        headers = {
+            "ETag": self._etags[encoding],
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+
+        # Any of our tags means the client has the current content
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            if "*" in tags or tags & set(self._etags.values()):
+                return Response(status_code=304, headers=headers)
+
+        return Response(
+            self._bodies[encoding], media_type=self.media_type, headers=headers
+        )
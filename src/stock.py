@@ -1,30 +1,64 @@
 import logging
+import time
+from typing import Callable
 from uuid import UUID
 
-import orjson
-
+from analytics import Analytics
+from broker import Broker
+from config import SCENARIO_FILE
 from events import (
     ChartLoadEvent,
+    ChartPatchEvent,
     ChartUpdateEvent,
     NewsLoadEvent,
+    NewsPatchEvent,
     NewsUpdateEvent,
+    RewindEvent,
     StopStreamEvent,
 )
+from leaderboard import Leaderboard
+from prices import PriceStore
 from pubsub import Publisher
+from scenario import Scenario
+from scheduler import RoundScheduler
+from trading import Exchange
 
 logger = logging.getLogger(__name__)
 
 
 class StockMarket:
-    def __init__(self):
+    def __init__(self, scenario: Scenario | None = None):
         try:
-            self.data, self.news = self.load_chart_data()
+            self.scenario = scenario or Scenario.load(SCENARIO_FILE)
+            self.data = self.scenario.data
+            self.news = self.scenario.news
+            # Settings of a generated scenario, see price_generator.py
+            self.generator_settings: dict | None = None
             self.current_step_chart = 0
             self.current_step_news = -1
+            # Bumped on every state change, keys the cached LOAD snapshot
+            self.version = 0
+            self._snapshot: tuple[ChartLoadEvent, NewsLoadEvent] | None = None
+            self._snapshot_version = -1
+            self.analytics = Analytics(self)
         except Exception as e:
             logger.error(f"Failed to initialize StockMarket: {e}")
             raise
 
+    def _own_data(self) -> PriceStore:
+        """Copy shared scenario prices before the first edit"""
+        if self.data is self.scenario.data:
+            self.data = self.data.copy()
+        return self.data
+
+    def _own_news(self) -> list[list[str]]:
+        if self.news is self.scenario.news:
+            self.news = list(self.news)
+        return self.news
+
+    def _bump_version(self):
+        self.version += 1
+
     @property
     def current_step_chart_str(self):
         return str(self.current_step_chart)
@@ -33,38 +67,13 @@ class StockMarket:
     def current_step_news_str(self):
         return str(self.current_step_news)
 
-    def load_chart_data(self) -> tuple[list[dict[str, int]], list[list[str]]]:
-        """Load both chart data and news from file once to avoid duplicate reads"""
-        from config import CHART_DATA_FILE
-
-        chart_file = CHART_DATA_FILE
-
-        if not chart_file.exists():
-            raise FileNotFoundError(f"Chart data file not found: {chart_file}")
-
-        try:
-            with open(chart_file, "r", encoding="utf-8") as f:
-                js = orjson.loads(f.read())
-
-            # Extract chart data and news data
-            chart_data = [data["chart"] for data in js.values()]
-            news_data = [data["news"] or [] for data in js.values()]
-
-            return chart_data, news_data
-
-        except orjson.JSONDecodeError as e:
-            raise ValueError(f"Invalid JSON in chart data file: {e}")
-        except KeyError as e:
-            raise ValueError(f"Missing required key in chart data: {e}")
-        except IOError as e:
-            raise IOError(f"Failed to read chart data file: {e}")
-
     def set_chart_step(self, step: int):
         """Set current chart step with bounds checking"""
         if 0 <= step < len(self.data):
             self.current_step_chart = step
             if self.current_step_news >= self.current_step_chart:
                 self.current_step_news = self.current_step_chart - 1
+            self._bump_version()
         else:
             logger.warning(
                 f"Invalid chart step {step}, must be between 0 and {len(self.data)-1}"
@@ -79,6 +88,7 @@ class StockMarket:
             return False
         if 0 <= step < len(self.news):
             self.current_step_news = step
+            self._bump_version()
             return True
         else:
             logger.warning(
@@ -94,6 +104,8 @@ class StockMarket:
         self.current_step_chart += 1
         if self.current_step_news >= self.current_step_chart:
             self.current_step_news = self.current_step_chart - 1
+        self._bump_version()
+        self.analytics.update()
         return True
 
     def next_news_step(self):
@@ -107,18 +119,16 @@ class StockMarket:
             logger.info("Already at the last news step, cannot advance further")
             return False
         self.current_step_news += 1
+        self._bump_version()
         return True
 
     def get_current_step_data(self) -> dict[str, dict[str, int]]:
         """Returns dict with string keys, not int keys"""
-        return {self.current_step_chart_str: self.data[self.current_step_chart]}
+        return {self.current_step_chart_str: self.data.round(self.current_step_chart)}
 
     def get_until_current_step_data(self) -> dict[str, dict[str, int]]:
         """Returns dict with string keys, not int keys"""
-        return {
-            str(i): data
-            for i, data in enumerate(self.data[: self.current_step_chart + 1])
-        }
+        return self.data.rounds(self.current_step_chart + 1)
 
     def get_current_step_news(self) -> dict[str, list[str]]:
         """Returns dict with string keys, not int keys"""
@@ -135,12 +145,26 @@ class StockMarket:
             for i, news in enumerate(self.news[: self.current_step_news + 1])
         }
 
+    def get_steps_data(self, start: int, stop: int) -> dict[str, dict[str, int]]:
+        """Chart rounds [start, stop) with string keys"""
+        return self.data.rounds(stop, start)
+
+    def get_steps_news(self, start: int, stop: int) -> dict[str, list[str]]:
+        """News rounds [start, stop) with string keys"""
+        return {str(i): self.news[i] for i in range(max(start, 0), stop)}
+
     def update_step_data(self, step_num: int, data: dict[str, int]):
         """Update step data with bounds checking"""
         if not (0 <= step_num < len(self.data)):
             logger.warning(f"Cannot update step {step_num}: out of bounds")
             return False
-        self.data[step_num] = data
+        try:
+            self._own_data().set_round(step_num, data)
+        except (KeyError, TypeError, OverflowError) as e:
+            logger.warning(f"Cannot update step {step_num}: {e}")
+            return False
+        self._bump_version()
+        self.analytics.invalidate(step_num)
         return True
 
     def update_step_news(self, step_num: int, news: list[str]):
@@ -148,7 +172,8 @@ class StockMarket:
         if not (0 <= step_num < len(self.news)):
             logger.warning(f"Cannot update step {step_num}: out of bounds")
             return False
-        self.news[step_num] = news
+        self._own_news()[step_num] = news
+        self._bump_version()
         return True
 
     def get_step_data(self, step_num: int) -> dict[str, int]:
@@ -156,7 +181,7 @@ class StockMarket:
         if not (0 <= step_num < len(self.data)):
             logger.warning(f"Invalid step number {step_num}")
             return {}
-        return self.data[step_num]
+        return self.data.round(step_num)
 
     def get_step_news(self, step_num: int) -> list[str]:
         """Get step news with bounds checking"""
@@ -165,41 +190,185 @@ class StockMarket:
             return []
         return self.news[step_num]
 
+    def get_snapshot_events(self) -> tuple[ChartLoadEvent, NewsLoadEvent]:
+        """
+        LOAD events for everything up to the current step.
+        Built once per state version, so their frames are encoded once too.
+        """
+        if self._snapshot is None or self._snapshot_version != self.version:
+            self._snapshot = (
+                ChartLoadEvent(self.get_until_current_step_data()),
+                NewsLoadEvent(self.get_until_current_step_news()),
+            )
+            self._snapshot_version = self.version
+        return self._snapshot
+
+    def dump_state(self) -> dict:
+        """
+        Unedited prices and news of a scenario file are referenced by its
+        path instead of copied, those of a generated one by its settings
+        """
+        path = self.scenario.path
+        shared = path is not None or self.generator_settings is not None
+        shared_data = shared and self.data is self.scenario.data
+        shared_news = shared and self.news is self.scenario.news
+        return {
+            "scenario": path,
+            "generated": self.generator_settings,
+            "data": None if shared_data else self.data.dump(),
+            "news": None if shared_news else list(self.news),
+            "current_step_chart": self.current_step_chart,
+            "current_step_news": self.current_step_news,
+        }
+
+    def load_state(self, state: dict):
+        if state.get("generated"):
+            self.scenario = _generate_scenario(state["generated"])
+            self.generator_settings = state["generated"]
+        elif state.get("scenario"):
+            self.scenario = Scenario.load(state["scenario"])
+            self.generator_settings = None
+        if state["data"] is None:
+            self.data = self.scenario.data
+        else:
+            self.data = PriceStore.load(state["data"])
+        self.news = self.scenario.news if state["news"] is None else state["news"]
+        self.current_step_chart = state["current_step_chart"]
+        self.current_step_news = state["current_step_news"]
+        self._bump_version()
+        self.analytics.invalidate()
+
+    def load_generated_scenario(self, settings: dict):
+        """
+        Replace the game with a scenario generated from settings, over the
+        same currencies, and start from round 0
+        """
+        scenario = _generate_scenario(settings)
+        if scenario.data.currencies != self.data.currencies:
+            raise ValueError(
+                f"Scenario currencies must be {self.data.currencies}, "
+                f"got {scenario.data.currencies}"
+            )
+        self.scenario = scenario
+        self.generator_settings = settings
+        self.reset()
+
     def reset(self):
-        self.data, self.news = self.load_chart_data()
+        """Back to round 0 of the scenario, edits are dropped"""
+        self.data = self.scenario.data
+        self.news = self.scenario.news
         self.current_step_chart = 0
         self.current_step_news = -1
+        self._bump_version()
+        self.analytics.invalidate()
+
+
+def _generate_scenario(settings: dict) -> Scenario:
+    try:
+        from price_generator import generate_scenario
+    except ImportError:
+        raise ValueError("Generating scenarios needs the 'generator' extra (NumPy)")
+    return generate_scenario(settings)
 
 
 class StockMarketController:
-    _stock: StockMarket = None
+    """
+    Game of one room. Commands go through the broker, so with several
+    workers every worker applies them to its own StockMarket and notifies
+    its own subscribers. Public coroutines dispatch, `_`-prefixed ones apply.
+    """
+
+    REPLICATED_OPS = frozenset(
+        {
+            "next_chart_step",
+            "next_news_step",
+            "publish_current_chart_data",
+            "publish_current_news",
+            "publish_until_current_step_data_all",
+            "publish_until_current_step_news_all",
+            "publish_stop_game",
+            "update_round",
+            "go_to_step",
+            "reset",
+            "schedule_start",
+            "schedule_pause",
+            "schedule_resume",
+            "schedule_stop",
+            "register_player",
+            "place_orders",
+            "cancel_order",
+            "apply_batch",
+            "load_generated_scenario",
+        }
+    )
+
+    def __init__(
+        self, room: str, stock: StockMarket, publisher: Publisher, broker: Broker
+    ):
+        self.room = room
+        self.stock = stock
+        self.publisher = publisher
+        self.broker = broker
+        self.scheduler = RoundScheduler(self)
+        self.leaderboard = Leaderboard(self)
+        self.exchange = Exchange(self)
+        # Streams that asked for analytics, in this worker
+        self.analytics_streams: set[UUID] = set()
+        # Called after every applied command
+        self.on_change: Callable[[], None] | None = None
+        # Lets the publisher coalesce a lagging subscriber's backlog into a snapshot
+        publisher.snapshot_provider = stock.get_snapshot_events
+
+    async def dispatch(self, op: str, *args):
+        return await self.broker.dispatch(op, self.room, *args)
+
+    async def apply(self, op: str, args: list):
+        """Run a dispatched command against this worker's game state"""
+        if op not in self.REPLICATED_OPS:
+            raise ValueError(f"Unknown game command: {op}")
+        try:
+            return await getattr(self, f"_{op}")(*args)
+        finally:
+            if self.on_change is not None:
+                self.on_change()
 
-    @classmethod
-    def stock(cls) -> StockMarket:
-        if not cls._stock:
-            cls._stock = StockMarket()
-            logger.info("StockMarket instance created")
-        return cls._stock
+    def dump_state(self) -> dict:
+        return {
+            "stock": self.stock.dump_state(),
+            "last_event_id": self.publisher.last_event_id,
+            "schedule": self.scheduler.dump_state(),
+            "exchange": self.exchange.dump_state(),
+        }
 
-    @classmethod
-    async def next_chart_step(cls):
+    async def load_state(self, state: dict):
+        """Adopt state of another worker and reload local subscribers"""
+        self.stock.load_state(state["stock"])
+        self.publisher.set_last_event_id(state["last_event_id"])
+        self.scheduler.load_state(state["schedule"])
+        self.exchange.load_state(state["exchange"])
+        for event in self.stock.get_snapshot_events():
+            await self.publisher.notify(event, assign_id=False)
+        await self._publish_analytics()
+
+    async def _next_chart_step(self):
         """Move to next chart step with error handling"""
         try:
-            success = cls.stock().next_chart_step()
+            success = self.stock.next_chart_step()
             if not success:
                 logger.warning(
                     "Cannot advance to next chart step: already at last step"
                 )
+            else:
+                await self.exchange.match()
             return success
         except Exception as e:
             logger.error(f"Error advancing to next chart step: {e}")
             raise
 
-    @classmethod
-    async def next_news_step(cls):
+    async def _next_news_step(self):
         """Move to next news step with error handling"""
         try:
-            success = cls.stock().next_news_step()
+            success = self.stock.next_news_step()
             if not success:
                 logger.warning(
                     "Cannot advance to next news step: constraint violation or at last step"
@@ -209,75 +378,363 @@ class StockMarketController:
             logger.error(f"Error advancing to next news step: {e}")
             raise
 
-    @classmethod
-    async def publish_current_chart_data(cls):
+    async def _publish_current_chart_data(self):
         """Publish current chart data with error handling"""
         try:
-            data = cls.stock().get_current_step_data()
-            await Publisher.notify(ChartUpdateEvent(data))
+            data = self.stock.get_current_step_data()
+            await self.publisher.notify(ChartUpdateEvent(data))
+            await self._publish_analytics()
         except Exception as e:
             logger.error(f"Error publishing chart data: {e}")
             raise
 
-    @classmethod
-    async def publish_current_news(cls):
+    async def _publish_current_news(self):
         """Publish current news with error handling"""
         try:
-            success = cls.stock().next_news_step()
+            success = self.stock.next_news_step()
             if not success:
                 logger.warning("Cannot publish news: unable to advance news step")
                 return False
-            news = cls.stock().get_current_step_news()
-            await Publisher.notify(NewsUpdateEvent(news))
+            news = self.stock.get_current_step_news()
+            await self.publisher.notify(NewsUpdateEvent(news))
             return True
         except Exception as e:
             logger.error(f"Error publishing news: {e}")
             raise
 
-    @classmethod
-    async def publish_until_current_step_data(cls, uid: UUID):
-        await Publisher.notify_by_uid(
-            uid, ChartLoadEvent(cls.stock().get_until_current_step_data())
+    async def _publish_analytics(self):
+        """Current analytics to the streams that asked for them"""
+        if not self.analytics_streams:
+            return
+        event = self.stock.analytics.event()
+        for uid in list(self.analytics_streams):
+            await self.publisher.notify_by_uid(uid, event)
+
+    async def publish_until_current_step_data(self, uid: UUID):
+        chart_event, _ = self.stock.get_snapshot_events()
+        await self.publisher.notify_by_uid(uid, chart_event)
+
+    async def publish_until_current_step_news(self, uid: UUID):
+        _, news_event = self.stock.get_snapshot_events()
+        await self.publisher.notify_by_uid(uid, news_event)
+
+    async def _publish_until_current_step_data_all(self):
+        chart_event, _ = self.stock.get_snapshot_events()
+        await self.publisher.notify(chart_event)
+
+    async def _publish_until_current_step_news_all(self):
+        _, news_event = self.stock.get_snapshot_events()
+        await self.publisher.notify(news_event)
+
+    async def _publish_stop_game(self):
+        await self.publisher.notify(StopStreamEvent())
+
+    async def _update_round(
+        self,
+        round_number: int,
+        chart_data: dict[str, int] | None,
+        news: list[str] | None,
+    ):
+        stock = self.stock
+        # Chart edits are checked as they are applied, so news are checked
+        # first and nothing is changed unless both parts apply
+        if news and not 0 <= round_number < len(stock.news):
+            logger.warning(f"Cannot update news of round {round_number}: out of bounds")
+            return False
+        if chart_data and not stock.update_step_data(round_number, chart_data):
+            return False
+        if news:
+            stock.update_step_news(round_number, news)
+        if chart_data and round_number == stock.current_step_chart:
+            await self.exchange.match()
+        # Clients only have rounds up to the current steps, later ones
+        # reach them with the regular updates
+        if chart_data and round_number <= stock.current_step_chart:
+            await self.publisher.notify(
+                ChartPatchEvent(stock.get_steps_data(round_number, round_number + 1))
+            )
+            await self._publish_analytics()
+        if news and round_number <= stock.current_step_news:
+            await self.publisher.notify(
+                NewsPatchEvent(stock.get_steps_news(round_number, round_number + 1))
+            )
+        return True
+
+    async def _go_to_step(self, step: int):
+        """Send clients only what changed: a rewind and/or the skipped rounds"""
+        stock = self.stock
+        chart_before, news_before = stock.current_step_chart, stock.current_step_news
+        stock.set_chart_step(step)
+        stock.set_news_step(step - 1)
+        moved = stock.current_step_chart != chart_before
+        if moved:
+            await self.exchange.match()
+        await self._publish_changes(chart_before, news_before, set(), set())
+        if moved:
+            await self._publish_analytics()
+
+    async def _reset(self):
+        self.stock.reset()
+        await self._restart()
+
+    async def _load_generated_scenario(self, settings: dict):
+        self.stock.load_generated_scenario(settings)
+        await self._restart()
+
+    async def _restart(self):
+        """Clear trading and reload subscribers, the game is back at round 0"""
+        self.exchange.reset()
+        await self._publish_until_current_step_data_all()
+        await self._publish_until_current_step_news_all()
+        await self._publish_analytics()
+
+    async def _apply_batch(self, operations: list[dict]) -> dict:
+        """
+        Apply admin operations to the game as one transaction, then send
+        clients what changed in one go: at most a rewind, a patch and an
+        update per data type, or a fresh LOAD after a reset. Open orders
+        are matched once, against the prices the batch ends on.
+        """
+        stock = self.stock
+        started = time.perf_counter()
+        backup = stock.dump_state()
+        chart_before, news_before = stock.current_step_chart, stock.current_step_news
+        edited_chart: set[int] = set()
+        edited_news: set[int] = set()
+        was_reset = False
+        try:
+            for index, operation in enumerate(operations):
+                if not self._apply_batch_operation(stock, operation):
+                    raise ValueError(f"Operation {index} ({operation['op']}) failed")
+                if operation["op"] == "edit_round":
+                    if operation.get("chart_data"):
+                        edited_chart.add(operation["round_number"])
+                    if operation.get("news"):
+                        edited_news.add(operation["round_number"])
+                elif operation["op"] == "reset":
+                    was_reset = True
+        except Exception:
+            stock.load_state(backup)
+            raise
+        applied = time.perf_counter()
+
+        if was_reset:
+            # Trading starts over like after a reset command, the batch
+            # has no trading operations for it to undo
+            self.exchange.reset()
+            for event in stock.get_snapshot_events():
+                await self.publisher.notify(event)
+        else:
+            await self._publish_changes(
+                chart_before, news_before, edited_chart, edited_news
+            )
+        if stock.current_step_chart != chart_before or edited_chart or was_reset:
+            await self.exchange.match()
+        await self._publish_analytics()
+        return {
+            "apply_ms": round((applied - started) * 1000, 3),
+            "fanout_ms": round((time.perf_counter() - applied) * 1000, 3),
+        }
+
+    @staticmethod
+    def _apply_batch_operation(stock: StockMarket, operation: dict) -> bool:
+        op = operation["op"]
+        if op == "edit_round":
+            round_number = operation["round_number"]
+            if operation.get("chart_data") and not stock.update_step_data(
+                round_number, operation["chart_data"]
+            ):
+                return False
+            return not operation.get("news") or stock.update_step_news(
+                round_number, operation["news"]
+            )
+        if op == "go_to_step":
+            stock.set_chart_step(operation["step"])
+            stock.set_news_step(operation["step"] - 1)
+            return stock.current_step_chart == operation["step"]
+        if op == "next_round":
+            return stock.next_chart_step()
+        if op == "publish_news":
+            return stock.next_news_step()
+        if op == "reset":
+            stock.reset()
+            return True
+        raise ValueError(f"Unknown batch operation: {op}")
+
+    async def _publish_changes(
+        self,
+        chart_before: int,
+        news_before: int,
+        edited_chart: set[int],
+        edited_news: set[int],
+    ):
+        """Bring clients from the given steps to the current state"""
+        stock = self.stock
+        chart_step, news_step = stock.current_step_chart, stock.current_step_news
+        if chart_step < chart_before or news_step < news_before:
+            await self.publisher.notify(RewindEvent(chart_step, news_step))
+
+        # Edited rounds clients keep, later ones are sent as updates
+        chart_kept = sorted(
+            r for r in edited_chart if r <= min(chart_before, chart_step)
         )
+        news_kept = sorted(r for r in edited_news if r <= min(news_before, news_step))
+        if chart_kept:
+            await self.publisher.notify(
+                ChartPatchEvent({str(r): stock.data.round(r) for r in chart_kept})
+            )
+        if news_kept:
+            await self.publisher.notify(
+                NewsPatchEvent({str(r): stock.news[r] for r in news_kept})
+            )
+        if chart_step > chart_before:
+            await self.publisher.notify(
+                ChartUpdateEvent(stock.get_steps_data(chart_before + 1, chart_step + 1))
+            )
+        if news_step > news_before:
+            await self.publisher.notify(
+                NewsUpdateEvent(stock.get_steps_news(news_before + 1, news_step + 1))
+            )
 
-    @classmethod
-    async def publish_until_current_step_news(cls, uid: UUID):
-        await Publisher.notify_by_uid(
-            uid, NewsLoadEvent(cls.stock().get_until_current_step_news())
+    async def _schedule_start(
+        self,
+        round_interval: float,
+        news_delay: float | None,
+        finish_game: bool,
+        start_delay: float,
+    ):
+        self.scheduler.start(round_interval, news_delay, finish_game, start_delay)
+
+    async def _schedule_pause(self):
+        self.scheduler.pause()
+
+    async def _schedule_resume(self):
+        self.scheduler.resume()
+
+    async def _schedule_stop(self):
+        self.scheduler.stop()
+
+    async def _register_player(self, player_id: str, name: str):
+        self.exchange.register(player_id, name)
+
+    async def _place_orders(self, orders: list[dict]):
+        return await self.exchange.place(orders)
+
+    async def _cancel_order(self, player_id: str, order_id: str):
+        return self.exchange.cancel(player_id, order_id)
+
+    async def next_chart_step(self):
+        # Orders sent during the round settle at its prices
+        await self.exchange.flush()
+        return await self.dispatch("next_chart_step")
+
+    async def next_news_step(self):
+        return await self.dispatch("next_news_step")
+
+    async def publish_current_chart_data(self):
+        await self.dispatch("publish_current_chart_data")
+
+    async def publish_current_news(self):
+        return await self.dispatch("publish_current_news")
+
+    async def publish_until_current_step_data_all(self):
+        await self.dispatch("publish_until_current_step_data_all")
+
+    async def publish_until_current_step_news_all(self):
+        await self.dispatch("publish_until_current_step_news_all")
+
+    async def publish_stop_game(self):
+        await self.dispatch("publish_stop_game")
+
+    async def update_round(
+        self,
+        round_number: int,
+        chart_data: dict[str, int] | None = None,
+        news: list[str] | None = None,
+    ) -> bool:
+        """Replace chart data and/or news of a round and reload subscribers"""
+        return await self.dispatch("update_round", round_number, chart_data, news)
+
+    async def go_to_step(self, step: int):
+        """Rewind or jump to chart step and reload subscribers"""
+        await self.dispatch("go_to_step", step)
+
+    async def reset(self):
+        await self.dispatch("reset")
+
+    async def schedule_start(
+        self,
+        round_interval: float,
+        news_delay: float | None = None,
+        finish_game: bool = False,
+        start_delay: float = 0.0,
+    ):
+        """Run rounds automatically, or change settings of the running timeline"""
+        await self.dispatch(
+            "schedule_start", round_interval, news_delay, finish_game, start_delay
         )
 
-    @classmethod
-    async def publish_until_current_step_data_all(cls):
-        await Publisher.notify(
-            ChartLoadEvent(cls.stock().get_until_current_step_data())
+    async def schedule_pause(self):
+        await self.dispatch("schedule_pause")
+
+    async def schedule_resume(self):
+        await self.dispatch("schedule_resume")
+
+    async def schedule_stop(self):
+        await self.dispatch("schedule_stop")
+
+    async def apply_batch(self, operations: list[dict]) -> dict:
+        """Apply admin operations atomically with one round of broadcasts"""
+        # Orders sent before the batch settle at the prices before it
+        await self.exchange.flush()
+        return await self.dispatch("apply_batch", operations)
+
+    async def load_generated_scenario(
+        self,
+        rounds: int,
+        seed: int,
+        volatility: float = 0.1,
+        correlation: float = 0.0,
+        news_jump: float = 0.0,
+    ):
+        """
+        Play a scenario generated from the tickers, start prices and news
+        of the current one. Seeded, so every worker generates the same prices
+        """
+        settings = self.stock.generator_settings
+        base = settings["base"] if settings else self.stock.scenario.path
+        if base is None:
+            raise ValueError("The current scenario has no file to generate from")
+        await self.dispatch(
+            "load_generated_scenario",
+            {
+                "base": base,
+                "rounds": rounds,
+                "seed": seed,
+                "volatility": volatility,
+                "correlation": correlation,
+                "news_jump": news_jump,
+            },
         )
 
-    @classmethod
-    async def publish_until_current_step_news_all(cls):
-        await Publisher.notify(NewsLoadEvent(cls.stock().get_until_current_step_news()))
+    async def register_player(self, player_id: str, name: str):
+        await self.dispatch("register_player", player_id, name)
 
-    @classmethod
-    async def publish_stop_game(cls):
-        await Publisher.notify(StopStreamEvent())
+    async def place_orders(self, orders: list[dict]) -> list[dict]:
+        """Settle a batch of orders, results in the same order"""
+        return await self.dispatch("place_orders", orders)
 
-    @classmethod
-    async def reset(cls):
-        cls.stock().reset()
-        await cls.publish_until_current_step_data_all()
-        await cls.publish_until_current_step_news_all()
+    async def cancel_order(self, player_id: str, order_id: str) -> bool:
+        return await self.dispatch("cancel_order", player_id, order_id)
 
-    @classmethod
-    def get_current_step_chart(cls):
-        return cls.stock().get_current_step_data()
+    def get_current_step_chart(self):
+        return self.stock.get_current_step_data()
 
-    @classmethod
-    def get_current_step_news(cls):
-        return cls.stock().get_current_step_news()
+    def get_current_step_news(self):
+        return self.stock.get_current_step_news()
 
-    @classmethod
-    def get_next_step_chart(cls):
-        return cls.stock().get_step_data(cls.stock().current_step_chart + 1)
+    def get_next_step_chart(self):
+        return self.stock.get_step_data(self.stock.current_step_chart + 1)
 
-    @classmethod
-    def get_next_step_news(cls):
-        return cls.stock().get_step_news(cls.stock().current_step_news + 1)
+    def get_next_step_news(self):
+        return self.stock.get_step_news(self.stock.current_step_news + 1)
@@ -0,0 +1,389 @@
+"""
+Trading: player portfolios and orders against the room's current prices.
+
+The room is the counterparty of every order. Market orders fill at the
+current round price. Limit orders that can't fill right away rest in a
+per-currency order book and fill at the round price once it reaches their
+limit. Orders are collected for ORDER_BATCH_INTERVAL and settled by one
+broker command, so a burst of orders costs one pass and one fan-out.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+from collections import defaultdict
+from typing import TYPE_CHECKING
+from uuid import UUID
+
+from config import ORDER_BATCH_INTERVAL, STARTING_CASH
+from events import FillEvent
+
+if TYPE_CHECKING:
+    from stock import StockMarketController
+
+logger = logging.getLogger(__name__)
+
+
+class OrderSide:
+    BUY = "buy"
+    SELL = "sell"
+
+
+class OrderType:
+    MARKET = "market"
+    LIMIT = "limit"
+
+
+class OrderStatus:
+    FILLED = "filled"
+    OPEN = "open"
+    REJECTED = "rejected"
+    CANCELLED = "cancelled"
+
+
+class Portfolio:
+    def __init__(self, cash: int = STARTING_CASH):
+        self.cash = cash
+        self.holdings: dict[str, int] = {}
+        # Committed to open limit orders
+        self.reserved_cash = 0
+        self.reserved: dict[str, int] = {}
+
+    def available_cash(self) -> int:
+        return self.cash - self.reserved_cash
+
+    def available(self, currency: str) -> int:
+        return self.holdings.get(currency, 0) - self.reserved.get(currency, 0)
+
+    def as_dict(self) -> dict:
+        return {
+            "cash": self.cash,
+            "holdings": self.holdings,
+            "reserved_cash": self.reserved_cash,
+            "reserved": self.reserved,
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "Portfolio":
+        portfolio = cls(state["cash"])
+        portfolio.holdings = state["holdings"]
+        portfolio.reserved_cash = state["reserved_cash"]
+        portfolio.reserved = state["reserved"]
+        return portfolio
+
+
+class Order:
+    def __init__(
+        self,
+        order_id: str,
+        player_id: str,
+        currency: str,
+        side: str,
+        order_type: str,
+        quantity: int,
+        limit_price: int | None = None,
+    ):
+        self.id = order_id
+        self.player_id = player_id
+        self.currency = currency
+        self.side = side
+        self.type = order_type
+        self.quantity = quantity
+        self.limit_price = limit_price
+        self.status = OrderStatus.OPEN
+
+    def as_dict(self) -> dict:
+        return {
+            "order_id": self.id,
+            "player_id": self.player_id,
+            "currency": self.currency,
+            "side": self.side,
+            "type": self.type,
+            "quantity": self.quantity,
+            "limit_price": self.limit_price,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Order":
+        return cls(
+            data["order_id"],
+            data["player_id"],
+            data["currency"],
+            data["side"],
+            data["type"],
+            data["quantity"],
+            data.get("limit_price"),
+        )
+
+    def marketable(self, price: int) -> bool:
+        if self.type == OrderType.MARKET:
+            return True
+        if self.side == OrderSide.BUY:
+            return price <= self.limit_price
+        return price >= self.limit_price
+
+
+class OrderBook:
+    """
+    Open limit orders of one currency: heaps keyed by limit price, FIFO
+    within a price. Cancelled orders are skipped when they reach the top.
+    """
+
+    def __init__(self):
+        # (-limit, seq, order), highest bid first
+        self.bids: list[tuple[int, int, Order]] = []
+        # (limit, seq, order), lowest ask first
+        self.asks: list[tuple[int, int, Order]] = []
+        self._seq = itertools.count()
+
+    def add(self, order: Order):
+        if order.side == OrderSide.BUY:
+            heapq.heappush(self.bids, (-order.limit_price, next(self._seq), order))
+        else:
+            heapq.heappush(self.asks, (order.limit_price, next(self._seq), order))
+
+    def pop_marketable(self, price: int) -> list[Order]:
+        """Remove and return open orders that fill at price, O(k log n)"""
+        orders = []
+        while self.bids and -self.bids[0][0] >= price:
+            orders.append(heapq.heappop(self.bids)[2])
+        while self.asks and self.asks[0][0] <= price:
+            orders.append(heapq.heappop(self.asks)[2])
+        return [order for order in orders if order.status == OrderStatus.OPEN]
+
+
+class Exchange:
+    """
+    Portfolios and order books of one room.
+
+    Intake (submit, flush) runs in the worker that received the order.
+    Everything else is applied in every worker through the broker, so it
+    has to be deterministic.
+    """
+
+    def __init__(self, controller: "StockMarketController"):
+        self.controller = controller
+        self.players: dict[str, Portfolio] = {}
+        # Shown on the leaderboard instead of the ids, which are credentials
+        self.names: dict[str, str] = {}
+        self.books: dict[str, OrderBook] = defaultdict(OrderBook)
+        # Open limit orders by id, in arrival order
+        self.open_orders: dict[str, Order] = {}
+        # Subscriber uids of each player's streams in this worker
+        self.streams: dict[str, set[UUID]] = defaultdict(set)
+        self._intake: list[tuple[dict, asyncio.Future]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+
+    async def submit(self, order: dict) -> dict:
+        """Queue an order for the next batch and wait for its result"""
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._intake.append((order, future))
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(
+                ORDER_BATCH_INTERVAL, lambda: asyncio.ensure_future(self.flush())
+            )
+        return await future
+
+    async def flush(self):
+        """Settle queued orders as one command"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._intake = self._intake, []
+        if not batch:
+            return
+        try:
+            results = await self.controller.place_orders([order for order, _ in batch])
+        except Exception as e:
+            logger.error(f"Error settling {len(batch)} orders: {e}")
+            results = [{"status": OrderStatus.REJECTED, "reason": str(e)}] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def register(self, player_id: str, name: str):
+        if player_id in self.players:
+            return
+        self.players[player_id] = Portfolio()
+        self.names[player_id] = name
+        self.controller.leaderboard.add(player_id, self.players[player_id])
+        self.controller.leaderboard.changed()
+
+    def prices(self) -> dict[str, int]:
+        stock = self.controller.stock
+        return stock.get_step_data(stock.current_step_chart)
+
+    async def place(self, orders: list[dict]) -> list[dict]:
+        """Settle a batch against the current prices in one pass"""
+        prices = self.prices()
+        fills: dict[str, list[dict]] = defaultdict(list)
+        results = [self._place(order, prices, fills) for order in orders]
+        await self._notify_fills(fills)
+        return results
+
+    def _reject(self, order_id: str | None, reason: str) -> dict:
+        return {"order_id": order_id, "status": OrderStatus.REJECTED, "reason": reason}
+
+    def _place(self, data: dict, prices: dict[str, int], fills: dict) -> dict:
+        try:
+            order = Order.from_dict(data)
+        except KeyError as e:
+            return self._reject(data.get("order_id"), f"Missing {e}")
+
+        portfolio = self.players.get(order.player_id)
+        if portfolio is None:
+            return self._reject(order.id, "Unknown player")
+        if order.currency not in prices:
+            return self._reject(order.id, f"Unknown currency {order.currency}")
+        if order.side not in (OrderSide.BUY, OrderSide.SELL):
+            return self._reject(order.id, f"Unknown side {order.side}")
+        if order.type not in (OrderType.MARKET, OrderType.LIMIT):
+            return self._reject(order.id, f"Unknown order type {order.type}")
+        if order.quantity <= 0:
+            return self._reject(order.id, "Quantity must be positive")
+        if order.type == OrderType.LIMIT and not (
+            order.limit_price and order.limit_price > 0
+        ):
+            return self._reject(order.id, "Limit orders need a positive limit price")
+
+        price = prices[order.currency]
+        if order.marketable(price):
+            if order.side == OrderSide.BUY:
+                if portfolio.available_cash() < price * order.quantity:
+                    return self._reject(order.id, "Not enough cash")
+            elif portfolio.available(order.currency) < order.quantity:
+                return self._reject(order.id, f"Not enough {order.currency}")
+            fill = self._fill(order, portfolio, price)
+            fills[order.player_id].append(fill)
+            return {"order_id": order.id, "status": OrderStatus.FILLED, "fill": fill}
+
+        # Rest in the book, committing what the order may need
+        if order.side == OrderSide.BUY:
+            cost = order.limit_price * order.quantity
+            if portfolio.available_cash() < cost:
+                return self._reject(order.id, "Not enough cash")
+            portfolio.reserved_cash += cost
+        else:
+            if portfolio.available(order.currency) < order.quantity:
+                return self._reject(order.id, f"Not enough {order.currency}")
+            portfolio.reserved[order.currency] = (
+                portfolio.reserved.get(order.currency, 0) + order.quantity
+            )
+        self.books[order.currency].add(order)
+        self.open_orders[order.id] = order
+        return {"order_id": order.id, "status": OrderStatus.OPEN}
+
+    def _release(self, order: Order, portfolio: Portfolio):
+        """Return what an open order had reserved"""
+        if order.side == OrderSide.BUY:
+            portfolio.reserved_cash -= order.limit_price * order.quantity
+        else:
+            portfolio.reserved[order.currency] -= order.quantity
+            if not portfolio.reserved[order.currency]:
+                del portfolio.reserved[order.currency]
+
+    def _fill(self, order: Order, portfolio: Portfolio, price: int) -> dict:
+        amount = price * order.quantity
+        if order.side == OrderSide.BUY:
+            portfolio.cash -= amount
+            portfolio.holdings[order.currency] = (
+                portfolio.holdings.get(order.currency, 0) + order.quantity
+            )
+        else:
+            portfolio.cash += amount
+            portfolio.holdings[order.currency] -= order.quantity
+            if not portfolio.holdings[order.currency]:
+                del portfolio.holdings[order.currency]
+        order.status = OrderStatus.FILLED
+        self.controller.leaderboard.update(order.player_id, portfolio)
+        return order.as_dict() | {"price": price, "amount": amount}
+
+    async def match(self):
+        """
+        Fill open limit orders the new current prices reach, then revalue
+        the leaderboard
+        """
+        fills: dict[str, list[dict]] = defaultdict(list)
+        for currency, price in self.prices().items():
+            if currency not in self.books:
+                continue
+            for order in self.books[currency].pop_marketable(price):
+                portfolio = self.players[order.player_id]
+                self._release(order, portfolio)
+                del self.open_orders[order.id]
+                fills[order.player_id].append(self._fill(order, portfolio, price))
+        await self._notify_fills(fills)
+        self.controller.leaderboard.prices_changed()
+
+    def cancel(self, player_id: str, order_id: str) -> bool:
+        order = self.open_orders.get(order_id)
+        if order is None or order.player_id != player_id:
+            return False
+        self._release(order, self.players[player_id])
+        order.status = OrderStatus.CANCELLED
+        del self.open_orders[order_id]
+        return True
+
+    async def _notify_fills(self, fills: dict[str, list[dict]]):
+        """One event per player and batch, to the player's local streams"""
+        publisher = self.controller.publisher
+        for player_id, player_fills in fills.items():
+            uids = self.streams.get(player_id)
+            if not uids:
+                continue
+            event = FillEvent(
+                {
+                    "fills": player_fills,
+                    "portfolio": self.players[player_id].as_dict(),
+                }
+            )
+            for uid in list(uids):
+                await publisher.notify_by_uid(uid, event)
+
+    def player_info(self, player_id: str) -> dict | None:
+        portfolio = self.players.get(player_id)
+        if portfolio is None:
+            return None
+        return {
+            "player_id": player_id,
+            "name": self.names[player_id],
+            "portfolio": portfolio.as_dict(),
+            "open_orders": [
+                order.as_dict()
+                for order in self.open_orders.values()
+                if order.player_id == player_id
+            ],
+        }
+
+    def reset(self):
+        """New game: everyone back to starting cash, no open orders"""
+        self.players = {player_id: Portfolio() for player_id in self.players}
+        self.books.clear()
+        self.open_orders.clear()
+        self.controller.leaderboard.rebuild(self.players)
+
+    def dump_state(self) -> dict:
+        return {
+            "players": {
+                player_id: portfolio.as_dict()
+                for player_id, portfolio in self.players.items()
+            },
+            "names": self.names,
+            "open_orders": [order.as_dict() for order in self.open_orders.values()],
+        }
+
+    def load_state(self, state: dict):
+        self.players = {
+            player_id: Portfolio.from_dict(portfolio)
+            for player_id, portfolio in state["players"].items()
+        }
+        self.names = state["names"]
+        self.books.clear()
+        self.open_orders.clear()
+        for data in state["open_orders"]:
+            order = Order.from_dict(data)
+            self.books[order.currency].add(order)
+            self.open_orders[order.id] = order
+        self.controller.leaderboard.rebuild(self.players)
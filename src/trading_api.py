@@ -0,0 +1,91 @@
+from uuid import uuid4
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel
+
+from admin_api import get_room
+from config import LEADERBOARD_SIZE
+from rooms import Room
+from trading import OrderType
+
+# Player routes, included under /api for the default room and under
+# /api/rooms/{room} for every other room
+trading_router = APIRouter()
+
+
+def get_player_info(room: Room, player_id: str) -> dict:
+    info = room.controller.exchange.player_info(player_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail=f"Unknown player: {player_id}")
+    return info
+
+
+class PlayerData(BaseModel):
+    name: str | None = None
+
+
+@trading_router.post("/players")
+async def register_player(
+    data: PlayerData | None = None, room: Room = Depends(get_room)
+):
+    """New player with starting cash, the id is its only credential"""
+    name = (data.name or "").strip() if data else ""
+    if len(name) > 32:
+        raise HTTPException(status_code=400, detail="Name is longer than 32 characters")
+    player_id = uuid4().hex
+    exchange = room.controller.exchange
+    await room.controller.register_player(
+        player_id, name or f"Player {len(exchange.players) + 1}"
+    )
+    return get_player_info(room, player_id)
+
+
+@trading_router.get("/players/{player_id}")
+async def get_player(player_id: str, room: Room = Depends(get_room)):
+    """Portfolio and open orders, e.g. after reconnecting the stream"""
+    return get_player_info(room, player_id)
+
+
+class OrderData(BaseModel):
+    player_id: str
+    currency: str
+    side: str
+    type: str = OrderType.MARKET
+    quantity: int
+    limit_price: int | None = None
+
+
+@trading_router.post("/orders")
+async def place_order(data: OrderData, room: Room = Depends(get_room)):
+    """
+    Settled with the other orders of the next batch. Returns the order's
+    status; limit orders left open report their fill on the player's stream
+    """
+    get_player_info(room, data.player_id)
+    order = data.model_dump() | {"order_id": uuid4().hex}
+    return await room.controller.exchange.submit(order)
+
+
+@trading_router.delete("/orders/{order_id}")
+async def cancel_order(order_id: str, player_id: str, room: Room = Depends(get_room)):
+    try:
+        if not await room.controller.cancel_order(player_id, order_id):
+            return {"status": "error", "message": f"No open order {order_id}"}
+        return {"status": "success", "message": f"Order {order_id} cancelled"}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+
+@trading_router.get("/leaderboard")
+async def get_leaderboard(
+    limit: int = Query(LEADERBOARD_SIZE, ge=1, le=100),
+    player_id: str | None = Query(None, alias="player"),
+    room: Room = Depends(get_room),
+):
+    """Top players, and the given player's standing"""
+    leaderboard = room.controller.leaderboard
+    return {
+        "top": leaderboard.top(limit),
+        "players": len(leaderboard.player_ids),
+        "standing": leaderboard.standing(player_id) if player_id else None,
+    }
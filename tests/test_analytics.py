@@ -0,0 +1,40 @@
+from analytics import Analytics
+from prices import PriceStore
+from scenario import Scenario
+from stock import StockMarket
+
+ROUNDS = 30
+
+
+def make_stock() -> StockMarket:
+    prices = PriceStore.from_rounds(
+        ({"A": 100 + step, "B": 200 - step * (step % 3)} for step in range(ROUNDS)),
+        ["A", "B"],
+    )
+    return StockMarket(Scenario(prices, [[] for _ in range(ROUNDS)]))
+
+
+def test_edit_of_unplayed_round_is_used_when_reached():
+    stock = make_stock()
+    stock.next_chart_step()
+    stock.analytics.report()
+    # First edit copies the scenario prices the running stats were built on
+    assert stock.update_step_data(3, {"A": 500, "B": 50})
+    for _ in range(5):
+        stock.next_chart_step()
+
+    report = stock.analytics.report()
+    assert report["currencies"]["A"]["max"] == 500
+    assert report["currencies"]["B"]["min"] == 50
+    assert report == Analytics(stock).report()
+
+
+def test_matches_rebuild_after_edits_and_rewinds():
+    stock = make_stock()
+    for step in range(1, ROUNDS):
+        stock.next_chart_step()
+        if step % 7 == 0:
+            stock.update_step_data(step - 2, {"A": step, "B": 3 * step})
+        if step % 11 == 0:
+            stock.set_chart_step(step - 4)
+        assert stock.analytics.report() == Analytics(stock).report()
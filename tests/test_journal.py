@@ -0,0 +1,58 @@
+import asyncio
+
+import orjson
+
+from broker import LocalBroker
+from journal import Journal
+
+
+def test_recover_restarts_when_a_segment_is_pruned(tmp_path):
+    async def main():
+        applied = []
+        loaded = []
+
+        async def apply(op: str, args: list):
+            applied.append(op)
+            if op == "first":
+                # The leader snapshots and prunes the segment meanwhile
+                (tmp_path / Journal.SNAPSHOT_FILE).write_bytes(
+                    orjson.dumps({"segment": 2, "state": {"after": "first"}})
+                )
+                (tmp_path / "segment-1.log").unlink()
+
+        async def load_state(state: dict):
+            loaded.append(state)
+
+        (tmp_path / "segment-0.log").write_bytes(b'["first", []]\n')
+        (tmp_path / "segment-1.log").write_bytes(b'["pruned", []]\n')
+        (tmp_path / "segment-2.log").write_bytes(b'["second", []]\n')
+        journal = Journal(tmp_path, apply, dict, load_state, lambda: True)
+        await journal.recover()
+
+        assert loaded == [{"after": "first"}]
+        assert applied == ["first", "second"]
+        assert journal.segment == 2
+
+    asyncio.run(main())
+
+
+def test_broker_recovers_once():
+    async def main():
+        recovered = []
+
+        async def recover():
+            recovered.append(True)
+
+        async def apply(op: str, args: list):
+            pass
+
+        async def load_state(state: dict):
+            pass
+
+        broker = LocalBroker(apply, dict, load_state)
+        broker.recover = recover
+        await broker.start()
+        await broker.start()
+        assert recovered == [True]
+
+    asyncio.run(main())
@@ -0,0 +1,120 @@
+import asyncio
+
+import orjson
+import pytest
+
+pytest.importorskip("numpy")
+
+from broker import LocalBroker
+from price_generator import (
+    TickerSpec,
+    generate_prices,
+    generate_scenario,
+    news_impacts_from_news,
+    to_chart_json,
+)
+from rooms import Room, Rooms
+from scenario import Scenario
+from stock import StockMarket
+
+NEWS = [
+    ["Alpha opens a new plant"],
+    ["Weather is fine"],
+    ["Beta and ALPHA merge"],
+    [],
+]
+
+
+@pytest.fixture
+def base_file(tmp_path):
+    tickers = [
+        TickerSpec("Alpha", 100),
+        TickerSpec("Beta", 50),
+        TickerSpec("Gamma", 10),
+    ]
+    prices = generate_prices(tickers, len(NEWS), seed=1)
+    path = tmp_path / "chart_data.json"
+    path.write_bytes(orjson.dumps(to_chart_json(tickers, prices, NEWS)))
+    return str(path)
+
+
+def settings(base: str, **overrides) -> dict:
+    return {
+        "base": base,
+        "rounds": 50,
+        "seed": 7,
+        "volatility": 0.1,
+        "correlation": 0.5,
+        "news_jump": 0.2,
+    } | overrides
+
+
+def test_news_jumps_hit_named_tickers_only():
+    tickers = [TickerSpec("Alpha", 100), TickerSpec("Beta", 50, aliases=["Bet"])]
+    impacts = news_impacts_from_news(tickers, NEWS, 0.3, seed=3)
+    assert {r: set(i) for r, i in impacts.items()} == {
+        0: {"Alpha"},
+        2: {"Alpha", "Beta"},
+    }
+    assert impacts == news_impacts_from_news(tickers, NEWS, 0.3, seed=3)
+
+    # News of round 2 move prices of round 3 only
+    impacts = {2: {"Alpha": 1.0}}
+    calm = generate_prices(tickers[:1], 5, seed=3)
+    moved = generate_prices(tickers[:1], 5, news_impacts=impacts, seed=3)
+    assert (moved[:3] == calm[:3]).all()
+    assert (moved[3:] > calm[3:]).all()
+
+
+def test_generated_scenario_is_reproducible(base_file):
+    scenario = generate_scenario(settings(base_file))
+    again = generate_scenario(settings(base_file))
+    assert len(scenario.data) == 50
+    assert len(scenario.news) == 50
+    assert scenario.news[: len(NEWS)] == NEWS
+    assert scenario.data.currencies == ["Alpha", "Beta", "Gamma"]
+    assert scenario.data.round(0) == Scenario.load(base_file).data.round(0)
+    assert [scenario.data.round(r) for r in range(50)] == [
+        again.data.round(r) for r in range(50)
+    ]
+
+
+def test_room_loads_generated_scenario(base_file):
+    async def main():
+        async def apply(op: str, args: list):
+            return await room.controller.apply(op, args[1:])
+
+        async def load_state(_state: dict):
+            pass
+
+        room = Room(
+            Rooms.DEFAULT,
+            LocalBroker(apply, dict, load_state),
+            Scenario.load(base_file),
+        )
+        try:
+            await room.controller.next_chart_step()
+            await room.controller.load_generated_scenario(30, seed=5, news_jump=0.1)
+            stock = room.stock
+            assert (len(stock.data), stock.current_step_chart) == (30, 0)
+
+            # Dumps refer to the settings, loading them regenerates the prices
+            state = stock.dump_state()
+            assert state["data"] is None and state["news"] is None
+            assert state["generated"]["base"] == base_file
+            other = StockMarket(Scenario.load(base_file))
+            other.load_state(orjson.loads(orjson.dumps(state)))
+            assert [other.data.round(r) for r in range(30)] == [
+                stock.data.round(r) for r in range(30)
+            ]
+
+            # A reset goes back to the generated scenario
+            stock.update_step_data(0, {"Alpha": 1, "Beta": 1, "Gamma": 1})
+            await room.controller.reset()
+            assert len(stock.data) == 30
+            assert stock.data.round(0) == other.data.round(0)
+        finally:
+            room.controller.leaderboard.close()
+            room.dashboard.close()
+
+    asyncio.run(main())
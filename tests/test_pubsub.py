@@ -0,0 +1,240 @@
+import asyncio
+
+from events import (
+    ChartLoadEvent,
+    ChartUpdateEvent,
+    EventType,
+    FillEvent,
+    NewsUpdateEvent,
+    ReplyEvent,
+    RewindEvent,
+    StopStreamEvent,
+)
+from metrics import EVENTS_PUBLISHED, FANOUT_DURATION
+from pubsub import FanoutStats, OverflowPolicy, Publisher, Subscriber
+
+
+def queued(subscriber: Subscriber) -> list:
+    return list(subscriber.events.q)
+
+
+def broadcast(subscriber: Subscriber, *events):
+    for event_id, event in enumerate(events, 1):
+        event.assign_id(event_id)
+        subscriber.update(event)
+
+
+async def delivered_types(subscriber: Subscriber) -> list[str]:
+    """Event types a stream gets, up to and including its stop"""
+    types = []
+    while True:
+        event = await asyncio.wait_for(subscriber.events.get(), 1)
+        types.append(event._type)
+        if event._type == EventType.STREAM_STOP:
+            return types
+
+
+def test_stop_survives_overflow():
+    async def main():
+        subscriber = Subscriber(
+            queue_size=3, overflow_policy=OverflowPolicy.DROP_OLDEST, coalesce=False
+        )
+        broadcast(
+            subscriber,
+            StopStreamEvent(),
+            *(ChartUpdateEvent({str(step): {}}) for step in range(10)),
+        )
+        assert len(subscriber.events) == 3
+        assert await delivered_types(subscriber) == [EventType.STREAM_STOP]
+
+    asyncio.run(main())
+
+
+def test_replies_survive_overflow():
+    async def main():
+        subscriber = Subscriber(
+            queue_size=2, overflow_policy=OverflowPolicy.DROP_OLDEST
+        )
+        broadcast(
+            subscriber,
+            ReplyEvent({"ref": 1}),
+            *(FillEvent({"fills": [step]}) for step in range(5)),
+        )
+        assert [event._type for event in queued(subscriber)] == [
+            EventType.REPLY,
+            EventType.FILL,
+        ]
+
+        # A client sending commands without reading loses its oldest replies
+        broadcast(subscriber, *(ReplyEvent({"ref": ref}) for ref in range(2, 5)))
+        assert [event.data["ref"] for event in queued(subscriber)] == [3, 4]
+
+    asyncio.run(main())
+
+
+def test_stop_survives_snapshot_coalescing():
+    async def main():
+        publisher = Publisher()
+        publisher.snapshot_provider = lambda: [ChartLoadEvent({"0": {}})]
+        subscriber = Subscriber(
+            queue_size=2, overflow_policy=OverflowPolicy.COALESCE, coalesce=False
+        )
+        publisher.subscribe(subscriber)
+        broadcast(
+            subscriber,
+            ChartUpdateEvent({"1": {}}),
+            StopStreamEvent(),
+            NewsUpdateEvent({"0": []}),
+        )
+        assert EventType.STREAM_STOP in await delivered_types(subscriber)
+        publisher.close()
+
+    asyncio.run(main())
+
+
+def test_snapshot_coalescing_keeps_fills_and_replies():
+    async def main():
+        publisher = Publisher()
+        publisher.snapshot_provider = lambda: [ChartLoadEvent({"0": {}})]
+        subscriber = Subscriber(
+            queue_size=3, overflow_policy=OverflowPolicy.COALESCE, coalesce=False
+        )
+        publisher.subscribe(subscriber)
+        broadcast(
+            subscriber,
+            ChartUpdateEvent({"1": {}}),
+            FillEvent({"fills": []}),
+            ChartUpdateEvent({"2": {}}),
+            ReplyEvent({"ref": 1}),
+        )
+        assert [event._type for event in queued(subscriber)] == [
+            EventType.LOAD,
+            EventType.FILL,
+            EventType.REPLY,
+        ]
+
+        # Nothing left a snapshot replaces, the oldest event gives way
+        broadcast(subscriber, FillEvent({"fills": []}))
+        assert [event._type for event in queued(subscriber)] == [
+            EventType.FILL,
+            EventType.REPLY,
+            EventType.FILL,
+        ]
+        publisher.close()
+
+    asyncio.run(main())
+
+
+def test_updates_merge_into_newest():
+    async def main():
+        subscriber = Subscriber()
+        broadcast(
+            subscriber,
+            ChartUpdateEvent({"1": {"A": 1}}),
+            NewsUpdateEvent({"0": ["a"]}),
+            ChartUpdateEvent({"2": {"A": 2}}),
+        )
+        news, chart = queued(subscriber)
+        assert news.data == {"0": ["a"]}
+        assert chart.id == 3
+        assert chart.data == {"1": {"A": 1}, "2": {"A": 2}}
+
+    asyncio.run(main())
+
+
+def test_subscribers_share_merged_updates():
+    async def main():
+        publisher = Publisher()
+        behind = [Subscriber(coalesce=True), Subscriber(coalesce=True)]
+        caught_up = Subscriber(coalesce=True)
+        for subscriber in behind:
+            publisher.subscribe(subscriber)
+        await publisher.notify(ChartUpdateEvent({"1": {"A": 1}}))
+        publisher.subscribe(caught_up)
+        for step in (2, 3):
+            await publisher.notify(ChartUpdateEvent({str(step): {"A": step}}))
+
+        (merged,) = queued(behind[0])
+        assert queued(behind[1]) == [merged]
+        assert (merged.id, list(merged.data)) == (3, ["1", "2", "3"])
+        # Queued a different event, so it gets its own merge
+        (other,) = queued(caught_up)
+        assert other is not merged
+        assert (other.id, list(other.data)) == (3, ["2", "3"])
+        publisher.close()
+
+    asyncio.run(main())
+
+
+def test_rewind_stops_merging():
+    async def main():
+        subscriber = Subscriber()
+        broadcast(
+            subscriber,
+            ChartUpdateEvent({"1": {}}),
+            RewindEvent(0, -1),
+            ChartUpdateEvent({"1": {}}),
+        )
+        assert [event.id for event in queued(subscriber)] == [1, 2, 3]
+
+    asyncio.run(main())
+
+
+def test_load_supersedes_its_data_type():
+    async def main():
+        subscriber = Subscriber()
+        broadcast(
+            subscriber,
+            ChartUpdateEvent({"1": {}}),
+            NewsUpdateEvent({"0": []}),
+            StopStreamEvent(),
+            ChartLoadEvent({"0": {}}),
+        )
+        assert [event._type for event in queued(subscriber)] == [
+            EventType.UPDATE,
+            EventType.STREAM_STOP,
+            EventType.LOAD,
+        ]
+        assert queued(subscriber)[0]._data_type == "news"
+
+    asyncio.run(main())
+
+
+def test_broadcast_leaves_snapshot_events_without_id():
+    async def main():
+        publisher = Publisher()
+        snapshot = ChartLoadEvent({"0": {}})
+        publisher.snapshot_provider = lambda: [snapshot]
+        subscriber = Subscriber(
+            queue_size=1, overflow_policy=OverflowPolicy.COALESCE, coalesce=False
+        )
+        publisher.subscribe(subscriber)
+        await publisher.notify(snapshot)
+        assert snapshot.id is None
+        assert queued(subscriber)[0].id == 1
+
+        await publisher.notify(NewsUpdateEvent({"0": []}))
+        assert [event.id for event in queued(subscriber)] == [None]
+        publisher.close()
+
+    asyncio.run(main())
+
+
+def test_unmetered_publisher_stays_out_of_player_metrics():
+    async def main():
+        subscribers, depths = Publisher.subscriber_count(), Publisher.all_queue_depths()
+        players, admins = Publisher(), Publisher(FanoutStats(), metered=False)
+        players.subscribe(Subscriber())
+        admins.subscribe(Subscriber())
+        published = sum(EVENTS_PUBLISHED.values.values())
+        fanouts = FANOUT_DURATION.counts[:]
+
+        await admins.notify(ChartUpdateEvent({"1": {}}), assign_id=False)
+        assert sum(EVENTS_PUBLISHED.values.values()) == published
+        assert FANOUT_DURATION.counts == fanouts
+        assert Publisher.subscriber_count() == subscribers + 1
+        assert sorted(Publisher.all_queue_depths()) == sorted([*depths, 0])
+        players.close()
+        admins.close()
+
+    asyncio.run(main())
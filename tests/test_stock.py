@@ -0,0 +1,180 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from admin_api import BatchOperation, validate_batch
+from broker import LocalBroker
+from config import SCENARIO_FILE, STARTING_CASH
+from events import EventType
+from prices import PriceStore
+from pubsub import Subscriber
+from rooms import Room, Rooms
+from scenario import Scenario
+from trading import Portfolio
+
+ROUNDS = 10
+
+
+def make_scenario(news_rounds: int = ROUNDS) -> Scenario:
+    prices = PriceStore.from_rounds(
+        ({"A": 100 + step, "B": 200 - step} for step in range(ROUNDS)), ["A", "B"]
+    )
+    return Scenario(prices, [[f"news {step}"] for step in range(news_rounds)])
+
+
+@asynccontextmanager
+async def make_room(scenario: Scenario | None = None):
+    """Room on a local broker with one unbounded subscriber"""
+
+    async def apply(op: str, args: list):
+        return await room.controller.apply(op, args[1:])
+
+    async def load_state(_state: dict):
+        pass
+
+    room = Room(
+        Rooms.DEFAULT, LocalBroker(apply, dict, load_state), scenario or make_scenario()
+    )
+    subscriber = Subscriber(queue_size=0, coalesce=False)
+    room.publisher.subscribe(subscriber)
+    try:
+        yield room, subscriber
+    finally:
+        room.controller.leaderboard.close()
+        room.dashboard.close()
+        room.publisher.close()
+
+
+def taken(subscriber: Subscriber) -> list:
+    events = list(subscriber.events.q)
+    subscriber.events.q.clear()
+    return events
+
+
+def test_round_edit_changes_nothing_if_its_news_fail():
+    async def main():
+        async with make_room(make_scenario(news_rounds=5)) as (room, subscriber):
+            controller = room.controller
+            for _ in range(7):
+                await controller.next_chart_step()
+            taken(subscriber)
+
+            assert not await controller.update_round(7, {"A": 1, "B": 1}, ["late"])
+            assert room.stock.data.round(7) == {"A": 107, "B": 193}
+            assert taken(subscriber) == []
+
+            assert await controller.update_round(7, {"A": 1, "B": 1})
+            assert [event._type for event in taken(subscriber)] == [EventType.PATCH]
+
+    asyncio.run(main())
+
+
+def batch(*operations: dict) -> list[BatchOperation]:
+    return [BatchOperation(**operation) for operation in operations]
+
+
+def test_batch_reset_restarts_trading():
+    async def main():
+        async with make_room(Scenario.load(SCENARIO_FILE)) as (room, subscriber):
+            controller = room.controller
+            await controller.register_player("p1", "Player")
+            await controller.next_chart_step()
+            currency = room.stock.data.currencies[0]
+            await controller.place_orders(
+                [
+                    {
+                        "order_id": "o1",
+                        "player_id": "p1",
+                        "currency": currency,
+                        "side": "buy",
+                        "type": "market",
+                        "quantity": 2,
+                    },
+                    {
+                        "order_id": "o2",
+                        "player_id": "p1",
+                        "currency": currency,
+                        "side": "buy",
+                        "type": "limit",
+                        "limit_price": 1,
+                        "quantity": 1,
+                    },
+                ]
+            )
+            exchange = controller.exchange
+            assert exchange.players["p1"].holdings == {currency: 2}
+
+            operations = batch({"op": "reset"}, {"op": "next_round"})
+            assert validate_batch(room.stock, operations) == []
+            await controller.apply_batch(
+                [operation.model_dump(exclude_none=True) for operation in operations]
+            )
+            assert room.stock.current_step_chart == 1
+            assert exchange.players["p1"].as_dict() == Portfolio().as_dict()
+            assert exchange.open_orders == {}
+            assert controller.leaderboard.top()[0]["value"] == STARTING_CASH
+
+    asyncio.run(main())
+
+
+def test_mixed_batches_validate_like_they_apply():
+    batches = [
+        # Later operations start from round 0 after a reset
+        [{"op": "go_to_step", "step": 5}, {"op": "reset"}, {"op": "publish_news"}],
+        [
+            {"op": "go_to_step", "step": 5},
+            {"op": "reset"},
+            {"op": "publish_news"},
+            {"op": "publish_news"},
+        ],
+        [{"op": "reset"}, {"op": "next_round"}, {"op": "next_round"}],
+        [{"op": "go_to_step", "step": 9}, {"op": "next_round"}],
+        [{"op": "go_to_step", "step": 9}, {"op": "reset"}, {"op": "next_round"}],
+        [
+            {"op": "next_round"},
+            {"op": "edit_round", "round_number": 1, "news": ["edited"]},
+            {"op": "publish_news"},
+            {"op": "publish_news"},
+            {"op": "reset"},
+            {"op": "go_to_step", "step": 3},
+            {"op": "publish_news"},
+        ],
+    ]
+
+    async def main():
+        for operations in batches:
+            async with make_room(Scenario.load(SCENARIO_FILE)) as (room, _):
+                valid = not validate_batch(room.stock, batch(*operations))
+                try:
+                    await room.controller.apply_batch(operations)
+                    applied = True
+                except ValueError:
+                    applied = False
+                assert valid == applied, operations
+
+    asyncio.run(main())
+
+
+def test_failed_batch_changes_nothing():
+    async def main():
+        async with make_room(Scenario.load(SCENARIO_FILE)) as (room, subscriber):
+            stock = room.stock
+            await room.controller.go_to_step(3)
+            before = stock.dump_state()
+            taken(subscriber)
+
+            # The edit and the reset apply, the last step fails
+            operations = [
+                {"op": "edit_round", "round_number": 1, "news": ["edited"]},
+                {"op": "reset"},
+                {"op": "go_to_step", "step": len(stock.data)},
+            ]
+            assert validate_batch(stock, batch(*operations))
+            with pytest.raises(ValueError):
+                await room.controller.apply_batch(operations)
+            assert stock.dump_state() == before
+            assert stock.get_step_news(1) != ["edited"]
+            assert taken(subscriber) == []
+
+    asyncio.run(main())